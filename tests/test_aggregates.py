@@ -0,0 +1,82 @@
+"""
+Checks the running statistics of utils.aggregates against NumPy, for rows in every color mode
+"""
+# IMPORTS
+import numpy as np
+import pytest
+
+from utils.aggregates import CollectionStats
+from utils.image_processing import packed_to_hex, rgb_to_packed
+
+
+# FUNCTIONS
+def make_rows(color_mode):
+    """
+    Features rows of process_collection with the colors in a color mode.
+    """
+    rows = []
+
+    for i, (ratios, colors) in enumerate(ROWS):
+        if color_mode == 'RGB':
+            colors = [[float(channel) for channel in color] for color in colors]
+        elif color_mode == 'RGB_CSV':
+            colors = [str([float(channel) for channel in color]) for color in colors]
+        elif color_mode == 'HEX':
+            colors = packed_to_hex(rgb_to_packed(colors)).tolist()
+        else:
+            colors = rgb_to_packed(colors).tolist()
+        rows.append(['label', f'label_{i:04d}'] + ratios + colors)
+
+    return rows
+
+
+@pytest.mark.parametrize('color_mode', ['RGB', 'RGB_CSV', 'HEX', 'PACKED'])
+def test_color_counts(color_mode):
+    stats = CollectionStats('label')
+    for row in make_rows(color_mode):
+        stats.add(row)
+
+    assert stats.top_colors(10) == EXPECTED_COLORS
+
+
+@pytest.mark.parametrize('color_mode', ['RGB', 'HEX', 'PACKED'])
+def test_ratios(color_mode):
+    stats = CollectionStats('label')
+    for row in make_rows(color_mode):
+        stats.add(row)
+    ratios = np.array([ratios for ratios, _ in ROWS])
+
+    assert stats.count == len(ROWS)
+    assert np.allclose(stats.mean, ratios.mean(axis=0))
+    assert np.allclose(stats.variance(), ratios.var(axis=0))
+    assert np.allclose(stats.variance(ddof=1), ratios.var(axis=0, ddof=1))
+    assert np.array_equal(stats.minimum, ratios.min(axis=0))
+    assert np.array_equal(stats.maximum, ratios.max(axis=0))
+
+
+def test_merge_and_save(tmp_path):
+    rows = make_rows('HEX')
+    whole, first, second = CollectionStats('label'), CollectionStats('label'), CollectionStats('label')
+    for i, row in enumerate(rows):
+        whole.add(row)
+        (first if i < 2 else second).add(row)
+
+    first.merge(second)
+    first.save(str(tmp_path/'label_stats.json'))
+    loaded = CollectionStats.load(str(tmp_path/'label_stats.json'))
+
+    assert loaded.count == whole.count
+    assert np.allclose(loaded.m2, whole.m2)
+    assert loaded.top_colors(10) == whole.top_colors(10)
+
+
+# VARIABLES
+# Ratios and colors of three rows, five distinct palette colors in all
+ROWS = [([0.625, 1.34022, 16.93889], [[255, 255, 255], [63, 63, 63], [191, 191, 255], [0, 0, 0], [127, 127, 63]]),
+        ([1.45631, 0.04762, 0.01942], [[63, 63, 63], [255, 255, 255], [0, 0, 0], [127, 127, 63], [191, 191, 255]]),
+        ([1.41509, 0.0, 0.0], [[0, 0, 0], [63, 63, 63], [255, 255, 255], [191, 191, 255], [127, 127, 63]])]
+
+EXPECTED_COLORS = [('#000000', 3), ('#3F3F3F', 3), ('#7F7F3F', 3), ('#BFBFFF', 3), ('#FFFFFF', 3)]
+
+
+# END OF FILE
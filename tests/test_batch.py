@@ -0,0 +1,25 @@
+"""
+Checks that utils.batch merges the rows of every shard in the order of a sequential run
+"""
+# IMPORTS
+import os
+from csv import reader, writer
+
+from utils.batch import merge_shards
+
+
+# FUNCTIONS
+def test_merge_order_past_9999(tmp_path):
+    names = [f'goya_{i:04d}' for i in (7, 999, 1000, 1001, 9999, 10000, 10001, 12345)]
+
+    # Rows dealt round robin over shards, as the deterministic split spreads them
+    for shard in range(3):
+        shard_dir = tmp_path / f'shard-{shard:04d}-of-0003' / 'goya'
+        os.makedirs(shard_dir)
+        with open(shard_dir / 'goya.csv', 'w', newline='') as file:
+            writer(file).writerows(['goya', name, '1.0'] for name in names[shard::3])
+
+    merge_shards(str(tmp_path))
+
+    with open(tmp_path / 'goya' / 'goya.csv', newline='') as file:
+        assert [row[1] for row in reader(file)] == names
@@ -0,0 +1,50 @@
+"""
+Checks that importing the utils modules stays fast and leaves plotting and clustering libraries unloaded
+"""
+# IMPORTS
+import json
+import os
+import subprocess
+import sys
+
+import pytest
+
+from utils.misc import import_time
+
+
+# FUNCTIONS
+def loaded_modules(module_name):
+    """
+    Heavy modules loaded after importing a module in a fresh interpreter.
+    """
+    code = (f'import json, sys; import {module_name}; '
+            f'print(json.dumps(sorted(name for name in {list(HEAVY_MODULES)} if name in sys.modules)))')
+    output = subprocess.run([sys.executable, '-c', code], capture_output=True, check=True, text=True, cwd=ROOT)
+
+    return json.loads(output.stdout)
+
+
+@pytest.mark.parametrize('module_name', ['utils.data_handling', 'utils.image_processing'])
+def test_heavy_modules_not_imported(module_name):
+    assert loaded_modules(module_name) == []
+
+
+def test_data_handling_import_budget():
+    # Best of three runs, so a busy machine doesn't fail the budget
+    seconds = min(import_time('utils.data_handling') for _ in range(3))
+
+    assert seconds < IMPORT_BUDGET
+
+
+# VARIABLES
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Libraries imported only by the functions that use them
+HEAVY_MODULES = ('matplotlib', 'mpl_toolkits.axes_grid1', 'sklearn')
+
+# Seconds allowed to import utils.data_handling, about the cost of cv2 and numpy plus a margin. The eager imports
+# took about 0.8 s
+IMPORT_BUDGET = 0.5
+
+
+# END OF FILE
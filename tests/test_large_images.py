@@ -0,0 +1,71 @@
+"""
+Checks that utils.large_images reads the size of images above the decompression bomb limit of PIL
+"""
+# IMPORTS
+import struct
+import zlib
+
+import cv2
+import numpy as np
+import pytest
+from PIL import Image
+
+from utils.large_images import MemoryBudget, get_img_size, load_img_resized
+
+
+# FUNCTIONS
+def jpeg_header(width, height):
+    """
+    Start of a baseline JPEG file: SOI, an APP0 segment, the SOF0 segment with the size of the image and the SOS
+    segment the scan data would follow.
+    """
+    app0 = b'JFIF\x00\x01\x01\x00\x00\x01\x00\x01\x00\x00'
+    sof0 = struct.pack('>BHHB', 8, height, width, 3) + b'\x01\x22\x00\x02\x11\x01\x03\x11\x01'
+    sos = b'\x03\x01\x00\x02\x11\x03\x11\x00\x3f\x00'
+
+    return b'\xff\xd8' + b'\xff\xe0' + struct.pack('>H', len(app0) + 2) + app0 + \
+        b'\xff\xc0' + struct.pack('>H', len(sof0) + 2) + sof0 + b'\xff\xda' + struct.pack('>H', len(sos) + 2) + sos
+
+
+def png_header(width, height):
+    """
+    Start of a PNG file: signature, IHDR chunk with the size of the image and an empty IDAT chunk.
+    """
+    ihdr = struct.pack('>2L5B', width, height, 8, 2, 0, 0, 0)
+
+    return b'\x89PNG\r\n\x1a\n' + struct.pack('>L', len(ihdr)) + b'IHDR' + ihdr + \
+        struct.pack('>L', zlib.crc32(b'IHDR' + ihdr)) + struct.pack('>L', 0) + b'IDAT' + \
+        struct.pack('>L', zlib.crc32(b'IDAT'))
+
+
+@pytest.mark.parametrize('extension, header, img_format', [('.jpg', jpeg_header, 'JPEG'),
+                                                            ('.png', png_header, 'PNG')])
+def test_oversized_header(tmp_path, extension, header, img_format):
+    image_path = tmp_path / f'scan{extension}'
+    image_path.write_bytes(header(30000, 20000))
+
+    # PIL refuses to open the file
+    with pytest.raises(Image.DecompressionBombError):
+        Image.open(image_path)
+
+    assert get_img_size(str(image_path)) == (30000, 20000, img_format)
+    assert Image.MAX_IMAGE_PIXELS is not None
+
+
+@pytest.mark.parametrize('extension', ['.jpg', '.png', '.bmp'])
+def test_same_size_as_pil(tmp_path, extension):
+    image_path = str(tmp_path / f'image{extension}')
+    cv2.imwrite(image_path, np.random.default_rng(0).integers(0, 256, (30, 50, 3), dtype=np.uint8))
+
+    with Image.open(image_path) as img:
+        assert get_img_size(image_path) == (img.width, img.height, img.format)
+
+
+def test_budget_loads_above_limit(tmp_path, monkeypatch):
+    image_path = str(tmp_path / 'scan.jpg')
+    cv2.imwrite(image_path, np.full((400, 300, 3), 128, dtype=np.uint8))
+    monkeypatch.setattr(Image, 'MAX_IMAGE_PIXELS', 50000)
+
+    image = load_img_resized(image_path, 40, budget=MemoryBudget(max_image_bytes=100000))
+
+    assert image.shape == (40, 30, 3)
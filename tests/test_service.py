@@ -0,0 +1,43 @@
+"""
+Checks that utils.service predicts images without black pixels with the clustering saved with the model
+"""
+# IMPORTS
+import cv2
+import numpy as np
+import pytest
+
+from utils.features import get_color_features
+from utils.service import SERVICE_CLUSTERING, Predictor
+
+
+# FUNCTIONS
+def test_chiaroscuro_without_black_pixels():
+    image = np.full((10, 10, 3), 255, dtype=np.uint8)
+    image[:5] = (200, 30, 30)
+
+    assert get_color_features(image) == (50., 50.)
+
+
+@pytest.mark.parametrize('saved, expected', [(None, SERVICE_CLUSTERING),
+                                             ({'backend': 'numpy', 'n_init': 2}, {'backend': 'numpy', 'n_init': 2})])
+def test_predict_white_image(saved, expected):
+    predictor = Predictor({'model': ConstantModel(), 'classes': ['classic', 'vanguard'], 'clustering': saved})
+    image = np.full((60, 80, 3), 255, dtype=np.uint8)
+    image[20:40] = (30, 60, 200)
+
+    try:
+        prediction = predictor.predict(cv2.imencode('.png', image)[1].tobytes())
+    finally:
+        predictor.close()
+
+    assert predictor.clustering == expected
+    assert prediction['label'] == 'vanguard'
+
+
+# CLASSES
+class ConstantModel:
+    """
+    Model predicting the second class for every vector.
+    """
+    def predict(self, matrix):
+        return np.ones(len(matrix), dtype=int)
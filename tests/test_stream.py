@@ -0,0 +1,79 @@
+"""
+Checks that utils.stream keeps selecting frames from cameras whose backend doesn't report frame positions
+"""
+# IMPORTS
+import time
+
+import numpy as np
+import pytest
+
+from utils.stream import _FrameClock, _SequentialReader, _ThreadedReader
+
+
+# FUNCTIONS
+def select_frames(reader, period):
+    """
+    Read frames as stream_predictions does, returning the timestamps of the frames selected.
+    """
+    timestamps = []
+    next_timestamp = 0.
+
+    while True:
+        frame = reader.read(lambda timestamp: timestamp + 1e-6 >= next_timestamp)
+        if frame is None:
+            break
+
+        next_timestamp = frame[2] + period
+        timestamps.append(frame[2])
+
+    reader.close()
+
+    return timestamps
+
+
+@pytest.mark.parametrize('position', [0., -1.])
+@pytest.mark.parametrize('realtime', [False, True])
+def test_camera_frames_selected(position, realtime):
+    capture = FakeCapture(position, frames=40, interval=0.005)
+    reader = _ThreadedReader(capture, paced=False) if realtime else _SequentialReader(capture, live=False)
+
+    timestamps = select_frames(reader, period=40.)
+
+    assert len(timestamps) >= 3
+    assert np.all(np.diff(timestamps) >= 40.)
+
+
+def test_file_positions_kept():
+    capture = FakeCapture(None, frames=10)
+    clock = _FrameClock(capture)
+    timestamps = []
+
+    for _ in range(10):
+        capture.grab()
+        timestamps.append(clock.timestamp())
+
+    assert timestamps == [100.*i for i in range(10)]
+
+
+# CLASSES
+class FakeCapture:
+    """
+    Video capture delivering blank frames every interval seconds, at a fixed position or at 100 ms per frame.
+    """
+    def __init__(self, position, frames, interval=0.):
+        self.position = position
+        self.frames = frames
+        self.interval = interval
+        self.index = -1
+
+    def grab(self):
+        time.sleep(self.interval)
+        self.index += 1
+
+        return self.index < self.frames
+
+    def retrieve(self, frame=None):
+        return True, np.zeros((4, 4, 3), dtype=np.uint8)
+
+    def get(self, prop):
+        return 100.*self.index if self.position is None else self.position
@@ -0,0 +1,249 @@
+"""
+Contains the functions used to keep running statistics of every collection without rereading its rows
+
+Usage:
+    python -m utils.aggregates build data/processed_img
+    python -m utils.aggregates summary data/processed_img --labels goya caravaggio --top 10
+"""
+# IMPORTS
+import argparse
+import json
+import os
+from csv import reader
+
+import numpy as np
+
+from utils.data_handling import get_packed_colors
+from utils.image_processing import get_palette, packed_to_hex, packed_to_rgb, palette_index, rgb_to_packed
+
+
+# FUNCTIONS
+def get_stats_path(save_dir, label):
+    """
+    Path of the statistics saved by process_collection along "<label>.csv".
+    """
+    return os.path.join(save_dir, f'{label}_stats.json')
+
+
+def build_stats(csv_path, label=None):
+    """
+    Compute the statistics of a collection CSV streaming its rows, e.g. for collections processed before statistics
+    were kept.
+
+    Parameters
+    ----------
+    csv_path : str
+        Path of a "<label>.csv" file saved by process_collection
+    label : str
+        Label of the collection. Defaults to the name of the file
+
+    Returns
+    -------
+    stats : CollectionStats
+        Statistics of every row
+    """
+    stats = CollectionStats(label or os.path.splitext(os.path.basename(csv_path))[0])
+
+    with open(csv_path, newline='') as file:
+        for row in reader(file):
+            if row:
+                stats.add(row)
+
+    return stats
+
+
+def read_stats(path, labels=None):
+    """
+    Read the statistics saved in every label folder.
+
+    Parameters
+    ----------
+    path : str
+        Folder with one sub folder per label, each one with a "<label>_stats.json" file
+    labels : list
+        Labels to read. Defaults to every folder with statistics
+
+    Returns
+    -------
+    stats : dict
+        CollectionStats of every label
+    """
+    stats = {}
+
+    for label in (labels or sorted(os.listdir(path))):
+        stats_path = get_stats_path(os.path.join(path, label), label)
+
+        if os.path.isfile(stats_path):
+            stats[label] = CollectionStats.load(stats_path)
+
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Keep and show the statistics of every collection.')
+    operations = parser.add_subparsers(dest='operation', required=True)
+
+    p_build = operations.add_parser('build', help='compute the statistics of the CSV file of every label folder')
+    p_build.add_argument('path', help='folder with one sub folder per label')
+
+    p_summary = operations.add_parser('summary', help='show the statistics of every label')
+    p_summary.add_argument('path', help='folder with one sub folder per label')
+    p_summary.add_argument('--labels', nargs='+', default=None)
+    p_summary.add_argument('--top', type=int, default=10, help='number of most frequent colors')
+
+    args = parser.parse_args()
+
+    if args.operation == 'build':
+        for label in sorted(os.listdir(args.path)):
+            csv_path = os.path.join(args.path, label, f'{label}.csv')
+
+            if os.path.isfile(csv_path):
+                stats = build_stats(csv_path, label)
+                stats.save(get_stats_path(os.path.join(args.path, label), label))
+
+                # Inform user
+                print(f'{label}: {stats.count} rows.')
+
+    else:
+        for stats in read_stats(args.path, args.labels).values():
+            print(json.dumps(stats.summary(args.top), indent=4))
+
+
+# CLASSES
+class CollectionStats:
+    """
+    Running statistics of the features rows of a collection.
+
+    Count, mean, variance, minimum and maximum of every ratio are updated with Welford's algorithm, and every color
+    found is counted by its code in the reduced palette. Adding a row or reading a summary takes the same time
+    whatever the size of the collection.
+
+    Parameters
+    ----------
+    label : str
+        Label of the collection
+    max_values : int
+        Number of possible values for each RGB channel of the colors, see get_palette
+    """
+    def __init__(self, label, max_values=5):
+        self.label = label
+        self.max_values = max_values
+        self.count = 0
+        self.mean = np.zeros(len(RATIOS))
+        self.m2 = np.zeros(len(RATIOS))
+        self.minimum = np.full(len(RATIOS), np.inf)
+        self.maximum = np.full(len(RATIOS), -np.inf)
+        self.color_counts = np.zeros(max_values**3, dtype=np.int64)
+
+    def add(self, row):
+        """
+        Add a features row, as returned by process_collection or read from its CSV file.
+        """
+        values = np.array(row[2:2 + len(RATIOS)], dtype=float)
+
+        self.count += 1
+        delta = values - self.mean
+        self.mean += delta/self.count
+        self.m2 += delta*(values - self.mean)
+        np.minimum(self.minimum, values, out=self.minimum)
+        np.maximum(self.maximum, values, out=self.maximum)
+
+        colors = packed_to_rgb(get_packed_colors([row])).astype(np.uint8)
+        np.add.at(self.color_counts, palette_index(colors, self.max_values).ravel(), 1)
+
+    def merge(self, other):
+        """
+        Add the rows of other statistics, e.g. gathered in another process.
+        """
+        if not other.count:
+            return self
+
+        count = self.count + other.count
+        delta = other.mean - self.mean
+        self.mean += delta*other.count/count
+        self.m2 += other.m2 + delta**2*self.count*other.count/count
+        self.count = count
+        np.minimum(self.minimum, other.minimum, out=self.minimum)
+        np.maximum(self.maximum, other.maximum, out=self.maximum)
+        self.color_counts += other.color_counts
+
+        return self
+
+    def variance(self, ddof=0):
+        """
+        Variance of every ratio, as numpy.var.
+        """
+        if self.count <= ddof:
+            return np.full(len(RATIOS), np.nan)
+
+        return self.m2/(self.count - ddof)
+
+    def top_colors(self, n=10):
+        """
+        Most frequent colors as (HEX color, count) tuples.
+        """
+        codes = np.argsort(-self.color_counts, kind='stable')[:n]
+        codes = codes[self.color_counts[codes] > 0]
+        colors = packed_to_hex(rgb_to_packed(get_palette(self.max_values)[codes]))
+
+        return [(color, int(count)) for color, count in zip(colors.tolist(), self.color_counts[codes])]
+
+    def summary(self, top=10):
+        """
+        Summary of the collection: number of rows, statistics of every ratio and most frequent colors.
+        """
+        summary = {'label': self.label, 'count': self.count}
+        std = np.sqrt(self.variance())
+
+        for i, name in enumerate(RATIOS):
+            summary[name] = {'mean': round(float(self.mean[i]), ndigits=5),
+                             'std': round(float(std[i]), ndigits=5),
+                             'min': float(self.minimum[i]) if self.count else None,
+                             'max': float(self.maximum[i]) if self.count else None}
+        summary['colors'] = self.top_colors(top)
+
+        return summary
+
+    @classmethod
+    def load(cls, stats_path):
+        """
+        Load statistics saved with save.
+        """
+        with open(stats_path) as file:
+            data = json.load(file)
+
+        stats = cls(data['label'], data['max_values'])
+        stats.count = data['count']
+        for name in ('mean', 'm2', 'minimum', 'maximum'):
+            setattr(stats, name, np.array(data[name], dtype=float))
+        stats.color_counts = np.array(data['color_counts'], dtype=np.int64)
+
+        return stats
+
+    def save(self, stats_path):
+        """
+        Save the statistics as a JSON file. The file is replaced at once, so readers never see it half written.
+        """
+        data = {'label': self.label, 'max_values': self.max_values, 'ratios': RATIOS, 'count': self.count,
+                'mean': self.mean.tolist(), 'm2': self.m2.tolist(), 'minimum': self.minimum.tolist(),
+                'maximum': self.maximum.tolist(), 'color_counts': self.color_counts.tolist()}
+
+        with open(stats_path + '.tmp', 'w') as file:
+            json.dump(data, file)
+        os.replace(stats_path + '.tmp', stats_path)
+
+
+# VARIABLES
+# Ratios of every features row, after label and img_name
+RATIOS = ['dim_ratio', 'chiaroscuro', 'whitespace_ratio']
+
+
+# EXECUTION
+if __name__ == '__main__':
+    main()
+
+
+# OUTPUT
+
+
+# END OF FILE
@@ -0,0 +1,234 @@
+"""
+Contains the functions used to read collections straight from zip and tar archives, without extracting them
+
+Images inside an archive are addressed as "<archive path>::<member name>", e.g.
+"data/wikiart.zip::wikiart/goya/goya_0001.jpg", and can be used wherever a path to an image is expected
+"""
+# IMPORTS
+import io
+import mmap
+import os
+import struct
+import tarfile
+import threading
+import zipfile
+from functools import lru_cache
+
+import cv2
+import numpy as np
+
+
+# FUNCTIONS
+def is_archive(path):
+    """
+    Whether a path is a zip or tar archive, judging by its extension.
+    """
+    return str(path).lower().endswith(ARCHIVE_EXTENSIONS)
+
+
+def is_archive_member(path):
+    """
+    Whether a path points to a member inside an archive.
+    """
+    return ARCHIVE_SEPARATOR in str(path)
+
+
+def split_member_path(path):
+    """
+    Split an "<archive path>::<member name>" path into the archive path and the member name.
+    """
+    archive_path, _, member = str(path).partition(ARCHIVE_SEPARATOR)
+
+    return archive_path, member
+
+
+def list_archive(path, extensions=None):
+    """
+    Generate the paths of the images inside an archive.
+
+    Members are listed while the archive is read: zip files from their central directory, without reading any member,
+    and tar files header by header, so the first images are available before the whole archive has been scanned.
+
+    Parameters
+    ----------
+    path : str
+        Path of the archive. "<archive path>::<folder>" lists only the members inside that folder
+    extensions : list
+        Extensions to be found. Defaults to every file
+
+    Yield
+    -----
+    member_path : str
+        "<archive path>::<member name>" of every member with a valid extension
+    """
+    archive_path, prefix = split_member_path(path)
+
+    for member in get_archive(archive_path).members():
+        if member.startswith(prefix) and (extensions is None or os.path.splitext(member)[1].lower() in extensions):
+            yield f'{archive_path}{ARCHIVE_SEPARATOR}{member}'
+
+
+def read_member(path):
+    """
+    Read the bytes of an archive member.
+
+    Parameters
+    ----------
+    path : str
+        "<archive path>::<member name>"
+
+    Returns
+    -------
+    data : memoryview or bytes
+        Content of the member. Stored (uncompressed) members are a view of the memory-mapped archive, without any copy
+    """
+    archive_path, member = split_member_path(path)
+
+    return get_archive(archive_path).read(member)
+
+
+def read_img(image_path, flags=cv2.IMREAD_COLOR):
+    """
+    Import an image in BGR mode as cv2.imread does, from a file or from an archive member.
+
+    Parameters
+    ----------
+    image_path : str
+        Path of the image, or "<archive path>::<member name>"
+    flags : int
+        cv2.imread flags, e.g. cv2.IMREAD_REDUCED_COLOR_2
+
+    Returns
+    -------
+    image : numpy.ndarray
+        Image in BGR color mode, None if it can't be decoded
+    """
+    if not is_archive_member(image_path):
+        return cv2.imread(str(image_path), flags)
+
+    return cv2.imdecode(np.frombuffer(read_member(image_path), dtype=np.uint8), flags)
+
+
+def open_img_file(image_path):
+    """
+    Open an image, or an archive member, as a binary file object, e.g. for PIL.
+    """
+    if not is_archive_member(image_path):
+        return open(image_path, 'rb')
+
+    return io.BytesIO(read_member(image_path))
+
+
+@lru_cache(maxsize=8)
+def get_archive(archive_path):
+    """
+    Open an archive once per process. Archives are kept open for the images that follow.
+    """
+    return Archive(archive_path)
+
+
+# CLASSES
+class Archive:
+    """
+    Random access to the members of a zip or tar archive.
+
+    The archive is memory-mapped, so members stored without compression (the usual case for JPEG files, which don't
+    compress) are read as views of the mapping: no system call nor copy per image, and the pages are shared between
+    the processes reading the same archive. Compressed members are decompressed from the archive on every read.
+    Members of compressed tar files can only be reached by decompressing the archive up to them, so those are best
+    read in archive order.
+
+    Parameters
+    ----------
+    archive_path : str
+        Path of a .zip, .tar, .tar.gz, .tgz, .tar.bz2 or .tar.xz file
+    """
+    def __init__(self, archive_path):
+        self.path = archive_path
+        self._file = open(archive_path, 'rb')
+        self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ) \
+            if os.path.getsize(archive_path) else None
+        self._lock = threading.Lock()
+        self._tar_members = {}
+
+        if zipfile.is_zipfile(archive_path):
+            self._zip = zipfile.ZipFile(self._file)
+            self._tar = None
+            self._compressed = False
+        else:
+            self._zip = None
+            self._tar = tarfile.open(fileobj=self._file, mode='r:*')
+            self._compressed = self._mmap is not None and self._mmap[:6].startswith(COMPRESSED_MAGIC)
+
+    def members(self):
+        """
+        Generate the names of the files in the archive, in archive order.
+        """
+        if self._zip is not None:
+            for info in self._zip.infolist():
+                if not info.is_dir():
+                    yield info.filename
+            return
+
+        with self._lock:
+            headers = iter(self._tar)
+
+        while True:
+            # Headers are read one at a time, members are read in between
+            with self._lock:
+                member = next(headers, None)
+            if member is None:
+                return
+
+            if member.isfile():
+                self._tar_members[member.name] = member
+                yield member.name
+
+    def read(self, member):
+        """
+        Read the content of a member, as a view of the archive if it is stored without compression.
+        """
+        if self._zip is not None:
+            info = self._zip.getinfo(member)
+            if info.compress_type == zipfile.ZIP_STORED and not info.flag_bits & 1:
+                # Data starts after the local header, whose extra field may differ from the central directory one
+                header = struct.unpack('<4s5H3L2H', self._mmap[info.header_offset:info.header_offset + 30])
+                start = info.header_offset + 30 + header[9] + header[10]
+
+                return memoryview(self._mmap)[start:start + info.file_size]
+
+            return self._zip.read(member)
+
+        with self._lock:
+            info = self._tar_members.get(member) or self._tar.getmember(member)
+            if not self._compressed:
+                return memoryview(self._mmap)[info.offset_data:info.offset_data + info.size]
+
+            return self._tar.extractfile(info).read()
+
+    def close(self):
+        """
+        Close the archive. Views returned by read must not be used afterwards.
+        """
+        (self._zip or self._tar).close()
+        if self._mmap is not None:
+            self._mmap.close()
+        self._file.close()
+
+
+# VARIABLES
+ARCHIVE_SEPARATOR = '::'
+
+ARCHIVE_EXTENSIONS = ('.zip', '.tar', '.tar.gz', '.tgz', '.tar.bz2', '.tbz2', '.tar.xz', '.txz')
+
+# First bytes of gzip, bzip2 and xz streams
+COMPRESSED_MAGIC = (b'\x1f\x8b', b'BZh', b'\xfd7zXZ')
+
+
+# EXECUTION
+
+
+# OUTPUT
+
+
+# END OF FILE
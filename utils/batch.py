@@ -0,0 +1,307 @@
+"""
+Contains the command-line entry point to process a whole museum, optionally split across machines
+
+Usage:
+    python -m utils.batch process SOURCE OUTPUT --shard 0/4 --workers 8
+    python -m utils.batch merge OUTPUT
+"""
+# IMPORTS
+import argparse
+import os
+import shutil
+from concurrent.futures import ProcessPoolExecutor
+from csv import reader, writer
+
+from utils.data_handling import get_collection, process_image, save_processed_img
+from utils.image_processing import get_img_rgb, resize_img, square_img
+
+
+# FUNCTIONS
+def list_museum(source, extensions=None):
+    """
+    List every image of every artist folder with its final name.
+
+    Images are sorted by path inside every artist folder so their "label_XXXX" names don't depend on the machine nor
+    on the shard that processes them.
+
+    Parameters
+    ----------
+    source : str
+        Folder with one sub folder per artist
+    extensions : list
+        Extensions to be found
+
+    Returns
+    -------
+    items : list
+        Tuples (label, img_name, img_path)
+    """
+    items = []
+
+    for label in sorted(os.listdir(source)):
+        folder = os.path.join(source, label)
+        if not os.path.isdir(folder):
+            continue
+
+        collection = sorted(str(i) for i in get_collection(folder, extensions or EXTENSIONS))
+        items.extend((label, f'{label}_{i:04d}', img_path) for i, img_path in enumerate(collection))
+
+    return items
+
+
+def shard_items(items, shard, num_of_shards):
+    """
+    Select the items processed by one shard.
+
+    Items are dealt round robin, so every shard gets a similar share of every artist.
+
+    Parameters
+    ----------
+    items : list
+        Items returned by list_museum
+    shard : int
+        Index of the shard, from 0 to num_of_shards - 1
+    num_of_shards : int
+        Number of shards the work is split into
+
+    Returns
+    -------
+    items : list
+        Items of the shard
+    """
+    return items[shard::num_of_shards]
+
+
+def process_museum(source, output, shard=0, num_of_shards=1, workers=1, resize_height=150, square=False,
+                   color_mode='HEX', save_format=None, extensions=None, grid=None, features=None, color_space='RGB'):
+    """
+    Process the images of one shard of a museum.
+
+    Processed images and a "<label>.csv" per artist are saved in "<output>/shard-<shard>-of-<num_of_shards>/<label>".
+    Use merge_shards once every shard is done.
+
+    Parameters
+    ----------
+    source : str
+        Folder with one sub folder per artist
+    output : str
+        Folder in which to save the shard output
+    shard : int
+        Index of the shard, from 0 to num_of_shards - 1
+    num_of_shards : int
+        Number of shards the work is split into
+    workers : int
+        Number of processes
+    resize_height : int
+        Desired height in pixels
+    square : bool
+        Whether to transform images into squares
+    color_mode : str
+        Whether to use RGB, HEX or PACKED color mode
+    save_format : str
+        'png' or 'npy' to save palette indexes, see save_img_indexed
+    extensions : list
+        Extensions to be found
+    grid : tuple
+        Number of rows and columns of the grid features, see process_collection
+    features : list
+        Names of the feature extractors, see utils.features
+    color_space : str
+        Space in which colors are clustered, RGB or LAB, see color_clustering
+
+    Returns
+    -------
+    errors_log : list
+        Names of the images that raised an exception
+    """
+    shard_dir = os.path.join(output, _shard_name(shard, num_of_shards))
+    items = shard_items(list_museum(source, extensions), shard, num_of_shards)
+
+    for label in {label for label, _, _ in items}:
+        os.makedirs(os.path.join(shard_dir, label), exist_ok=True)
+
+    tasks = [(label, img_name, img_path, os.path.join(shard_dir, label), resize_height, square, color_mode,
+              save_format, grid, features, color_space) for label, img_name, img_path in items]
+
+    if workers > 1:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            results = list(executor.map(_process_item, tasks, chunksize=16))
+    else:
+        results = [_process_item(task) for task in tasks]
+
+    collection_data = {}
+    errors_log = []
+    for label, img_name, img_data in results:
+        if img_data is None:
+            errors_log.append(img_name)
+        else:
+            collection_data.setdefault(label, []).append(img_data)
+
+    for label, rows in collection_data.items():
+        with open(os.path.join(shard_dir, label, f'{label}.csv'), 'w', newline='') as file:
+            writer(file).writerows(rows)
+
+    # Inform user
+    print(f'Shard {shard + 1} of {num_of_shards}: {len(items)} images, {len(errors_log)} exceptions raised.')
+
+    return errors_log
+
+
+def merge_shards(output, keep_shards=False):
+    """
+    Merge the output of every shard into one folder per artist.
+
+    Rows of every artist are sorted by the index in their image name, so the result is the same whatever the number
+    of shards, also past label_9999.
+
+    Parameters
+    ----------
+    output : str
+        Folder with the "shard-i-of-n" folders
+    keep_shards : bool
+        Whether to keep the shard folders. Images are copied instead of moved
+
+    Returns
+    -------
+    collection_data : dict
+        Merged rows by label
+    """
+    shard_dirs = sorted(name for name in os.listdir(output) if name.startswith('shard-'))
+
+    # Check no shard is missing
+    counts = {int(name.split('-of-')[1]) for name in shard_dirs}
+    if len(counts) > 1:
+        raise ValueError(f'Shards of different splits found in {output}: {sorted(counts)}')
+    if counts and len(shard_dirs) != counts.pop():
+        print(f'Warning: only {len(shard_dirs)} shards found, the merge will be incomplete.')
+
+    collection_data = {}
+    for shard_name in shard_dirs:
+        shard_dir = os.path.join(output, shard_name)
+
+        for label in os.listdir(shard_dir):
+            label_dir = os.path.join(shard_dir, label)
+            merged_dir = os.path.join(output, label)
+            os.makedirs(merged_dir, exist_ok=True)
+
+            for name in os.listdir(label_dir):
+                if name == f'{label}.csv':
+                    with open(os.path.join(label_dir, name), newline='') as file:
+                        collection_data.setdefault(label, []).extend(row for row in reader(file) if row)
+                elif keep_shards:
+                    shutil.copy2(os.path.join(label_dir, name), os.path.join(merged_dir, name))
+                else:
+                    shutil.move(os.path.join(label_dir, name), os.path.join(merged_dir, name))
+
+    for label, rows in collection_data.items():
+        rows.sort(key=lambda row: int(row[1].rpartition('_')[2]))
+        with open(os.path.join(output, label, f'{label}.csv'), 'w', newline='') as file:
+            writer(file).writerows(rows)
+
+    if not keep_shards:
+        for shard_name in shard_dirs:
+            shutil.rmtree(os.path.join(output, shard_name))
+
+    # Inform user
+    print(f'{len(shard_dirs)} shards merged into {len(collection_data)} labels.')
+
+    return collection_data
+
+
+def _process_item(task):
+    """
+    Process and save one image. Runs in the worker processes.
+    """
+    label, img_name, img_path, save_dir, resize_height, square, color_mode, save_format, grid, features, \
+        color_space = task
+
+    try:
+        img = get_img_rgb(img_path)
+        img = square_img(img, resize_height) if square else resize_img(img, resize_height)
+        img, values = process_image(img, color_mode=color_mode, grid=grid, features=features,
+                                    clustering={'color_space': color_space})
+
+        save_processed_img(save_dir, img_name, img, img_path.split(sep='.')[-1], save_format)
+
+    except (BaseException, Exception):
+        return label, img_name, None
+
+    return label, img_name, [label, img_name] + values
+
+
+def _parse_shard(value):
+    """
+    Parse a "i/n" shard argument.
+    """
+    shard, num_of_shards = (int(i) for i in value.split('/'))
+    if not 0 <= shard < num_of_shards:
+        raise argparse.ArgumentTypeError(f'Shard index must be between 0 and {num_of_shards - 1}')
+
+    return shard, num_of_shards
+
+
+def _parse_grid(value):
+    """
+    Parse a "rowsxcols" grid argument.
+    """
+    return tuple(int(i) for i in value.lower().split('x'))
+
+
+def _shard_name(shard, num_of_shards):
+    """
+    Name of the folder of a shard.
+    """
+    return f'shard-{shard:04d}-of-{num_of_shards:04d}'
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Process every artist folder of a museum.')
+    operations = parser.add_subparsers(dest='operation', required=True)
+
+    p_process = operations.add_parser('process', help='process the images of one shard')
+    p_process.add_argument('source', help='folder with one sub folder per artist')
+    p_process.add_argument('output', help='folder in which to save the results')
+    p_process.add_argument('--shard', type=_parse_shard, default=(0, 1),
+                           help='shard to process as i/n, from 0/n to (n-1)/n (default: 0/1)')
+    p_process.add_argument('--workers', type=int, default=os.cpu_count(), help='processes on this machine')
+    p_process.add_argument('--resize-height', type=int, default=150)
+    p_process.add_argument('--square', default=False, action='store_true')
+    p_process.add_argument('--color-mode', default='HEX', choices=('RGB', 'HEX', 'PACKED'))
+    p_process.add_argument('--save-format', default=None, choices=('png', 'npy'),
+                           help='save palette indexes instead of the original format')
+    p_process.add_argument('--extensions', nargs='+', default=EXTENSIONS)
+    p_process.add_argument('--grid', type=_parse_grid, default=None,
+                           help='add color features of a rowsxcols grid, e.g. 3x3')
+    p_process.add_argument('--features', nargs='+', default=None,
+                           help='feature extractors to run (default: ratio color_stats palette)')
+    p_process.add_argument('--color-space', default='RGB', choices=('RGB', 'LAB'),
+                           help='space in which colors are clustered')
+
+    p_merge = operations.add_parser('merge', help='merge the output of every shard')
+    p_merge.add_argument('output', help='folder with the shard folders')
+    p_merge.add_argument('--keep-shards', default=False, action='store_true')
+
+    args = parser.parse_args()
+
+    if args.operation == 'process':
+        process_museum(args.source, args.output, shard=args.shard[0], num_of_shards=args.shard[1],
+                       workers=args.workers, resize_height=args.resize_height, square=args.square,
+                       color_mode=args.color_mode, save_format=args.save_format, extensions=args.extensions,
+                       grid=args.grid, features=args.features, color_space=args.color_space)
+    else:
+        merge_shards(args.output, keep_shards=args.keep_shards)
+
+
+# VARIABLES
+EXTENSIONS = ['.jpg', '.jpeg', '.png']
+
+
+# EXECUTION
+if __name__ == '__main__':
+    main()
+
+
+# OUTPUT
+
+
+# END OF FILE
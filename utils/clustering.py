@@ -0,0 +1,558 @@
+"""
+Contains the k-means backends used to cluster image colors and the tools to pick the fastest one
+"""
+# IMPORTS
+import argparse
+import json
+import os
+import time
+
+import cv2
+import numpy as np
+
+
+# FUNCTIONS
+def kmeans(pixels, num_of_colors, backend=None, max_iter=300, tol=1e-4, n_init=10, seed=None, init=None,
+           sample_weight=None):
+    """
+    Cluster pixels with one of the available k-means backends.
+
+    Parameters
+    ----------
+    pixels : numpy.ndarray
+        Array of shape (N, 3) with the pixels to cluster
+    num_of_colors : int
+        Number of clusters
+    backend : str
+        Name of the backend (see CLUSTERING_BACKENDS). Defaults to the one recorded by calibrate, or sklearn
+    max_iter : int
+        Maximum number of iterations of a run
+    tol : float
+        Convergence tolerance, relative to the mean variance of the pixels as in sklearn
+    n_init : int
+        Number of runs with different initial centroids. The best one is kept
+    seed : int
+        Seed of the initial centroids
+    init : numpy.ndarray
+        Initial centroids of shape (num_of_colors, 3). If given, a single run starts from them
+    sample_weight : numpy.ndarray
+        Weight of every pixel, e.g. the pixel count of every unique color. cv2 has no weights, so it is replaced by
+        the numpy backend, as fast on a few hundred unique colors
+
+    Returns
+    -------
+    labels : numpy.ndarray
+        Cluster of every pixel
+    centers : numpy.ndarray
+        Array of shape (num_of_colors, 3) with the centroids
+    """
+    backend = backend or get_default_backend()
+
+    if sample_weight is not None:
+        sample_weight = np.asarray(sample_weight, dtype=np.float64)
+
+    if init is not None:
+        init = np.asarray(init, dtype=np.float64)
+        n_init = 1
+
+    return CLUSTERING_BACKENDS[backend](np.asarray(pixels), num_of_colors, max_iter, tol, n_init, seed, init,
+                                        sample_weight)
+
+
+def sampled_kmeans(pixels, num_of_colors, sample_size, adaptive=False, sample_tol=1.0, seed=None, **kwargs):
+    """
+    Cluster a stratified random sample of pixels and assign every pixel to the closest centroid.
+
+    The pixels are split in sample_size consecutive strata (bands of rows for an image) and one random pixel is taken
+    from each one. In adaptive mode the sample doubles, starting every round from the previous centroids, until
+    centroids move less than sample_tol or the sample holds every pixel.
+
+    Parameters
+    ----------
+    pixels : numpy.ndarray
+        Array of shape (N, 3) with the pixels to cluster
+    num_of_colors : int
+        Number of clusters
+    sample_size : int
+        Number of pixels sampled, or of the first sample in adaptive mode
+    adaptive : bool
+        Whether to grow the sample until centroids are stable
+    sample_tol : float
+        Maximum centroid movement between rounds, in RGB units, to stop growing the sample
+    seed : int
+        Seed of the sample and of the initial centroids
+    **kwargs
+        Settings passed to kmeans (backend, max_iter, tol, n_init, init)
+
+    Returns
+    -------
+    labels : numpy.ndarray
+        Cluster of every pixel
+    centers : numpy.ndarray
+        Array of shape (num_of_colors, 3) with the centroids
+    info : dict
+        Final sample size, number of rounds and last centroid movement
+    """
+    pixels = np.asarray(pixels)
+    rng = np.random.default_rng(seed)
+    size = max(num_of_colors, min(sample_size, len(pixels)))
+    rounds = 0
+    movement = None
+
+    while True:
+        sample = pixels[_stratified_sample(len(pixels), size, rng)]
+        _, new_centers = kmeans(sample, num_of_colors, seed=seed, **kwargs)
+        rounds += 1
+
+        if rounds > 1:
+            movement = float(np.sqrt(_assign(new_centers, centers)[1]).max())
+        centers = new_centers
+
+        if not adaptive or size == len(pixels) or (movement is not None and movement < sample_tol):
+            break
+
+        # Next round starts from the centroids found
+        kwargs['init'] = centers
+        size = min(2*size, len(pixels))
+
+    labels, _ = _assign(pixels.astype(np.float64), centers)
+
+    return labels, centers, {'sample_size': size, 'rounds': rounds, 'movement': movement}
+
+
+def sampling_error(pixels, labels, centers, seed=None, **kwargs):
+    """
+    Measure the error of sampled clustering against clustering every pixel.
+
+    Parameters
+    ----------
+    pixels : numpy.ndarray
+        Array of shape (N, 3) with all the pixels
+    labels : numpy.ndarray
+        Cluster of every pixel found with sampled_kmeans
+    centers : numpy.ndarray
+        Centroids found with sampled_kmeans
+    seed : int
+        Seed of the full clustering
+    **kwargs
+        Settings passed to kmeans for the full clustering
+
+    Returns
+    -------
+    error : dict
+        Mean and max distance, in RGB units, from every full-pixel centroid to the closest sampled one, and relative
+        increase of the within-cluster sum of squares
+    """
+    data = np.asarray(pixels, dtype=np.float64)
+    full_labels, full_centers = kmeans(data, len(centers), seed=seed, **kwargs)
+
+    distances = np.sqrt(_assign(full_centers, np.asarray(centers, dtype=np.float64))[1])
+    inertia = ((data - centers[labels])**2).sum()
+    full_inertia = ((data - full_centers[full_labels])**2).sum()
+
+    return {'centroid_error_mean': float(distances.mean()),
+            'centroid_error_max': float(distances.max()),
+            'inertia_increase': float(inertia/full_inertia - 1) if full_inertia else 0.}
+
+
+def get_default_backend(config_path=None):
+    """
+    Get the backend recorded as default by calibrate.
+
+    Parameters
+    ----------
+    config_path : str
+        Path of the calibration file. Defaults to CALIBRATION_PATH
+
+    Returns
+    -------
+    backend : str
+        Name of the backend, sklearn if no calibration was recorded
+    """
+    global _default_backend
+
+    if config_path is None and _default_backend is not None:
+        return _default_backend
+
+    try:
+        with open(config_path or CALIBRATION_PATH) as file:
+            backend = json.load(file)['backend']
+    except (OSError, KeyError, ValueError):
+        backend = 'sklearn'
+
+    if backend not in CLUSTERING_BACKENDS:
+        backend = 'sklearn'
+
+    if config_path is None:
+        _default_backend = backend
+
+    return backend
+
+
+def palette_agreement(colors_a, counts_a, colors_b):
+    """
+    Measure how much of a palette is found in another one.
+
+    Parameters
+    ----------
+    colors_a : numpy.ndarray
+        Reference palette, with reduced colors
+    counts_a : numpy.ndarray
+        Number of pixels of every color of the reference palette
+    colors_b : numpy.ndarray
+        Palette to compare, with reduced colors
+
+    Returns
+    -------
+    agreement : float
+        Share of the reference pixels whose color is also present in the other palette
+    """
+    found = (colors_a[:, None, :] == colors_b[None, :, :]).all(axis=2).any(axis=1)
+
+    return float(counts_a[found].sum()/counts_a.sum())
+
+
+def calibrate(images, num_of_colors=5, max_values=5, threshold=0.9, backends=None, config_path=None, **kwargs):
+    """
+    Time every backend on sample images and record the fastest accurate one as default.
+
+    Palettes are compared after reducing the centroids as color_clustering does, against sklearn KMeans with its
+    default settings. sklearn is that reference, so it is timed on the reference runs and not compared with itself.
+
+    Parameters
+    ----------
+    images : list
+        Images in RGB color mode, already resized and with a reduced palette
+    num_of_colors : int
+        Number of clusters
+    max_values : int
+        Number of possible values for each RGB channel
+    threshold : float
+        Minimum mean palette agreement with the reference for a backend to be chosen
+    backends : list
+        Names of the backends to compare with the reference. Defaults to all the others
+    config_path : str
+        Path in which to record the result. Defaults to CALIBRATION_PATH
+    **kwargs
+        Settings passed to every backend (max_iter, tol, n_init)
+
+    Returns
+    -------
+    results : dict
+        Chosen backend with the mean time and agreement of every backend
+    """
+    from utils.image_processing import reduce_col_palette
+
+    pixels = [img.reshape(-1, 3) for img in images]
+    reference = []
+    start = time.perf_counter()
+    for data in pixels:
+        labels, centers = _kmeans_sklearn(data, num_of_colors, 300, 1e-4, 10, 0, None)
+        reference.append((reduce_col_palette(centers, max_values), np.bincount(labels, minlength=num_of_colors)))
+
+    results = {'sklearn': {'seconds': (time.perf_counter() - start)/max(1, len(pixels)), 'agreement': 1.,
+                           'reference': True}}
+    for backend in backends or CLUSTERING_BACKENDS:
+        if backend == 'sklearn':
+            continue
+
+        elapsed = 0.
+        agreement = []
+
+        for data, (ref_colors, ref_counts) in zip(pixels, reference):
+            start = time.perf_counter()
+            labels, centers = kmeans(data, num_of_colors, backend=backend, seed=0, **kwargs)
+            elapsed += time.perf_counter() - start
+
+            agreement.append(palette_agreement(ref_colors, ref_counts, reduce_col_palette(centers, max_values)))
+
+        results[backend] = {'seconds': elapsed/max(1, len(pixels)), 'agreement': float(np.mean(agreement))}
+
+    accurate = [backend for backend, result in results.items() if result['agreement'] >= threshold]
+    chosen = min(accurate, key=lambda backend: results[backend]['seconds']) if accurate else 'sklearn'
+
+    calibration = {'backend': chosen, 'threshold': threshold, 'settings': kwargs, 'results': results}
+    with open(config_path or CALIBRATION_PATH, 'w') as file:
+        json.dump(calibration, file, indent=4)
+
+    global _default_backend
+    _default_backend = None
+
+    return calibration
+
+
+def _stratified_sample(num_pixels, sample_size, rng):
+    """
+    Pick one random index in each of sample_size equal strata of range(num_pixels).
+    """
+    bounds = np.linspace(0, num_pixels, sample_size + 1)
+    starts = bounds[:-1].astype(np.int64)
+    widths = np.maximum(bounds[1:].astype(np.int64) - starts, 1)
+
+    return np.minimum(starts + (rng.random(sample_size)*widths).astype(np.int64), num_pixels - 1)
+
+
+def _kmeans_cv2(pixels, num_of_colors, max_iter, tol, n_init, seed, init, sample_weight=None):
+    """
+    k-means with cv2.kmeans and k-means++ initialization.
+    """
+    if sample_weight is not None:
+        # cv2.kmeans has no weights
+        return _kmeans_numpy(pixels, num_of_colors, max_iter, tol, n_init, seed, init, sample_weight)
+
+    if seed is not None:
+        cv2.setRNGSeed(seed)
+
+    data = pixels.astype(np.float32)
+    tol = tol*float(data.var(axis=0).mean())
+    criteria = (cv2.TERM_CRITERIA_EPS + cv2.TERM_CRITERIA_MAX_ITER, max_iter, tol)
+
+    if init is None:
+        _, labels, centers = cv2.kmeans(data, num_of_colors, None, criteria, n_init, cv2.KMEANS_PP_CENTERS)
+    else:
+        # cv2 starts from labels, not centers
+        labels = _assign(data.astype(np.float64), init)[0].astype(np.int32)[:, None]
+        _, labels, centers = cv2.kmeans(data, num_of_colors, labels, criteria, 1, cv2.KMEANS_USE_INITIAL_LABELS)
+
+    return labels.ravel(), centers.astype(np.float64)
+
+
+def _kmeans_sklearn(pixels, num_of_colors, max_iter, tol, n_init, seed, init, sample_weight=None):
+    """
+    k-means with sklearn KMeans.
+    """
+    from sklearn.cluster import KMeans
+
+    model_kmeans = KMeans(n_clusters=num_of_colors, max_iter=max_iter, tol=tol, n_init=n_init, random_state=seed,
+                          init='k-means++' if init is None else init)
+    labels = model_kmeans.fit_predict(pixels, sample_weight=sample_weight)
+
+    return labels, model_kmeans.cluster_centers_
+
+
+def _kmeans_minibatch(pixels, num_of_colors, max_iter, tol, n_init, seed, init, sample_weight=None):
+    """
+    k-means with sklearn MiniBatchKMeans.
+    """
+    from sklearn.cluster import MiniBatchKMeans
+
+    model_kmeans = MiniBatchKMeans(n_clusters=num_of_colors, max_iter=max_iter, tol=tol, n_init=n_init,
+                                   random_state=seed, batch_size=1024, init='k-means++' if init is None else init)
+    labels = model_kmeans.fit_predict(pixels, sample_weight=sample_weight)
+
+    return labels, model_kmeans.cluster_centers_
+
+
+def _kmeans_numpy(pixels, num_of_colors, max_iter, tol, n_init, seed, init, sample_weight=None):
+    """
+    k-means with Lloyd's algorithm and k-means++ initialization written in NumPy.
+    """
+    data = pixels.astype(np.float64)
+    rng = np.random.default_rng(seed)
+    weights = np.ones(len(data)) if sample_weight is None else sample_weight
+    mean = np.average(data, axis=0, weights=weights)
+    tol = tol*float(np.average((data - mean)**2, axis=0, weights=weights).mean())
+
+    best = None
+    for _ in range(n_init):
+        centers = _kmeans_plusplus(data, num_of_colors, rng, sample_weight) if init is None else init
+        labels, centers, inertia = _lloyd(data, centers, max_iter, tol, weights)
+
+        if best is None or inertia < best[2]:
+            best = labels, centers, inertia
+
+    return best[0], best[1]
+
+
+def _assign(data, centers):
+    """
+    Get the closest center of every point and its squared distance.
+    """
+    distances = (data**2).sum(axis=1)[:, None] - 2*data @ centers.T + (centers**2).sum(axis=1)[None, :]
+    labels = distances.argmin(axis=1)
+
+    return labels, np.maximum(distances[np.arange(len(data)), labels], 0)
+
+
+def _kmeans_plusplus(data, num_of_colors, rng, weights=None):
+    """
+    Choose initial centers spread according to k-means++.
+    """
+    if weights is None:
+        centers = [data[rng.integers(len(data))]]
+    else:
+        centers = [data[rng.choice(len(data), p=weights/weights.sum())]]
+
+    for _ in range(1, num_of_colors):
+        _, distances = _assign(data, np.array(centers))
+        distances = distances if weights is None else distances*weights
+        total = distances.sum()
+        index = rng.choice(len(data), p=distances/total) if total > 0 else rng.integers(len(data))
+        centers.append(data[index])
+
+    return np.array(centers)
+
+
+def _lloyd(data, centers, max_iter, tol, weights=None):
+    """
+    Run Lloyd's iterations from the given centers until they move less than tol.
+    """
+    num_of_colors = len(centers)
+    weights = np.ones(len(data)) if weights is None else weights
+
+    for _ in range(max_iter):
+        labels, _ = _assign(data, centers)
+        counts = np.bincount(labels, weights=weights, minlength=num_of_colors)
+        sums = np.stack([np.bincount(labels, weights=data[:, i]*weights, minlength=num_of_colors)
+                         for i in range(data.shape[1])], axis=1)
+
+        # Empty clusters keep their center
+        new_centers = np.where(counts[:, None] > 0, sums/np.maximum(counts, 1e-12)[:, None], centers)
+        shift = ((new_centers - centers)**2).sum()
+        centers = new_centers
+
+        if shift <= tol:
+            break
+
+    labels, distances = _assign(data, centers)
+
+    return labels, centers, (distances*weights).sum()
+
+
+# CLASSES
+class WarmStart:
+    """
+    Initial centroids for color_clustering shared across the images of a collection.
+
+    Paintings by one artist share palettes, so starting k-means from centroids found in previous images converges in
+    far fewer iterations than starting from scratch. Every clustered image also updates an artist-level prior palette
+    with an online (mini-batch) k-means step over its centroids weighted by pixel counts, which is available
+    afterwards as the palette of the whole collection.
+
+    Parameters
+    ----------
+    mode : str
+        Where the initial centroids come from: 'prior' for the artist palette learnt so far, 'previous' for the
+        centroids of the previous image
+    num_of_colors : int
+        Number of colors of the artist palette
+    """
+    def __init__(self, mode='prior', num_of_colors=5):
+        if mode not in ('prior', 'previous'):
+            raise ValueError(f'Unknown warm start mode: {mode}')
+
+        self.mode = mode
+        self.num_of_colors = num_of_colors
+        self.previous = None
+        self.centers = None
+        self.weights = None
+
+    def init(self, num_of_colors):
+        """
+        Get the initial centroids for the next image.
+
+        Returns
+        -------
+        init : numpy.ndarray
+            Initial centroids, None if there are none yet or they don't match num_of_colors
+        """
+        init = self.previous if self.mode == 'previous' else self.centers
+
+        if init is None or len(init) != num_of_colors:
+            return None
+
+        return init
+
+    def update(self, centers, counts):
+        """
+        Learn from the centroids found in an image.
+
+        Parameters
+        ----------
+        centers : numpy.ndarray
+            Centroids found in the image
+        counts : numpy.ndarray
+            Number of pixels of every centroid
+        """
+        self.previous = np.asarray(centers, dtype=np.float64)
+        self.partial_fit(centers, counts)
+
+    def partial_fit(self, centers, counts):
+        """
+        Update the artist palette with weighted centroids.
+        """
+        centers = np.asarray(centers, dtype=np.float64)
+        counts = np.asarray(counts, dtype=np.float64)
+
+        if self.centers is None:
+            # Start from the heaviest colors of the first image
+            order = np.argsort(-counts)[:self.num_of_colors]
+            self.centers = centers[order].copy()
+            self.weights = counts[order].copy()
+            return self
+
+        labels, _ = _assign(centers, self.centers)
+        for center, count, label in zip(centers, counts, labels):
+            self.weights[label] += count
+            self.centers[label] += (count/self.weights[label])*(center - self.centers[label])
+
+        return self
+
+    def palette(self):
+        """
+        Get the artist palette learnt so far.
+
+        Returns
+        -------
+        centers : numpy.ndarray
+            Colors of the palette, most common first
+        shares : numpy.ndarray
+            Share of the pixels of every color
+        """
+        if self.centers is None:
+            return np.empty((0, 3)), np.empty(0)
+
+        order = np.argsort(-self.weights)
+
+        return self.centers[order], self.weights[order]/self.weights.sum()
+
+
+# VARIABLES
+CLUSTERING_BACKENDS = {'cv2': _kmeans_cv2,
+                       'sklearn': _kmeans_sklearn,
+                       'minibatch': _kmeans_minibatch,
+                       'numpy': _kmeans_numpy}
+
+# File in which calibrate records the default backend
+CALIBRATION_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'clustering_backend.json')
+
+_default_backend = None
+
+
+# EXECUTION
+if __name__ == '__main__':
+    from utils.data_handling import get_collection
+    from utils.image_processing import get_img_rgb, reduce_col_palette, resize_img
+
+    parser = argparse.ArgumentParser(description='Time every clustering backend and record the fastest accurate one.')
+    parser.add_argument('path', help='folder with sample images')
+    parser.add_argument('--resize-height', type=int, default=150)
+    parser.add_argument('--num-of-colors', type=int, default=5)
+    parser.add_argument('--threshold', type=float, default=0.9, help='minimum palette agreement')
+    parser.add_argument('--max-iter', type=int, default=300)
+    parser.add_argument('--tol', type=float, default=1e-4)
+    parser.add_argument('--n-init', type=int, default=10)
+    args = parser.parse_args()
+
+    samples = [reduce_col_palette(resize_img(get_img_rgb(str(i)), args.resize_height), 5)
+               for i in get_collection(args.path, ['.jpg', '.jpeg', '.png'])]
+    calibration = calibrate(samples, num_of_colors=args.num_of_colors, threshold=args.threshold,
+                            max_iter=args.max_iter, tol=args.tol, n_init=args.n_init)
+
+    print(json.dumps(calibration, indent=4))
+
+
+# OUTPUT
+
+
+# END OF FILE
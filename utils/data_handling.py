@@ -3,15 +3,23 @@ Contains the functions used to handle data
 """
 # IMPORTS
 import os
-from csv import writer
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from csv import reader, writer
 from pathlib import PurePath
 
-import matplotlib.pyplot as plt
-from cv2 import COLOR_RGB2BGR, cvtColor, imwrite as save_img
-from mpl_toolkits.axes_grid1 import ImageGrid
+import numpy as np
+from cv2 import COLOR_RGB2BGR, INTER_AREA, cvtColor, imwrite as save_img, resize
 
-from utils.image_processing import color_clustering, get_img_rgb, reduce_col_palette, resize_img, square_img
-from utils.misc import infinite_sequence
+from utils.archives import is_archive, is_archive_member, list_archive
+# get_color_features now lives in utils.features, it is still importable from here
+from utils.features import DEFAULT_FEATURES, NUM_OF_COLORS, extract_features, get_color_features
+from utils.image_processing import get_img_indexed, get_img_rgb, get_palette, hex_to_packed, pad_img, \
+    packed_to_hex, palette_index, reduce_col_palette, resize_img, rgb_to_packed, save_img_indexed, \
+    square_img
+from utils.large_images import load_img_resized
+from utils.misc import get_pyplot, infinite_sequence, is_headless
+from utils.pipeline import Stage, format_metrics, run_pipeline
 
 
 # FUNCTIONS
@@ -23,10 +31,13 @@ def get_collection(path, extensions=None):
     extension. If the extension matches one of the list passed to the function it will add the file path to the
     result.
 
+    Zip and tar archives are listed without extracting them, and their images are returned as
+    "<archive path>::<member name>" paths, which every function reading images accepts.
+
     Parameters
     ----------
     path : str
-        Path to inspect.
+        Path to inspect. A zip or tar archive, or "<archive path>::<folder>" for a folder inside one.
     extensions : list
         Extensions to be found.
 
@@ -38,6 +49,13 @@ def get_collection(path, extensions=None):
     # Get last folder name
     folder = path.split('/')[-1]
 
+    if is_archive(path) or is_archive_member(path):
+        # List the archive members, the archive is never extracted
+        collection = list(list_archive(path, extensions))
+        print(f'{len(collection)} images found in {path.rstrip("/").split("/")[-1]}')
+
+        return collection
+
     # Empty list to append valid files path
     collection = []
 
@@ -57,38 +75,200 @@ def get_collection(path, extensions=None):
     return collection
 
 
-def get_color_features(image):
+def parse_features(row):
     """
-    Extract color features from one image.
+    Transform a features row of a collection CSV into a numeric vector.
+
+    Rows are [label, img_name, dim_ratio, chiaroscuro, whitespace_ratio, color_1, ..., color_5] plus the grid columns
+    if any. Colors may be RGB lists, HEX strings or packed integers and are expanded into their three RGB channels.
 
     Parameters
     ----------
-    image
+    row : list
+        Features row as read from a collection CSV
 
     Returns
     -------
+    features : numpy.ndarray
+        float32 array with the ratios, the RGB channels of every color and the grid columns
+    """
+    features = [float(value) for value in row[2:5]]
+
+    for color in row[5:5 + NUM_OF_COLORS]:
+        features.extend(_parse_color(color))
+
+    features.extend(float(value) for value in row[5 + NUM_OF_COLORS:])
 
+    return np.array(features, dtype=np.float32)
+
+
+def get_packed_colors(collection_data):
     """
-    img = image
-
-    # Set color counter
-    black_px = 0
-    white_px = 0
-    color_px = 0
-
-    for row in range(img.shape[0]):
-        for col in range(img.shape[1]):
-            if (img[row][col] <= 50).all():
-                black_px += 1
-            elif (img[row][col] >= 206).all():
-                white_px += 1
-            else:
-                color_px += 1
+    Get the colors of a collection as a packed 0xRRGGBB matrix.
+
+    HEX and packed colors are converted for the whole collection at once.
+
+    Parameters
+    ----------
+    collection_data : list
+        Features rows, as returned by process_collection or read_collection_data
+
+    Returns
+    -------
+    colors : numpy.ndarray
+        uint32 array of shape (N, num_of_colors)
+    """
+    rows = [row[5:5 + NUM_OF_COLORS] for row in collection_data]
+
+    if not rows or not len(rows[0]):
+        return np.zeros((len(rows), NUM_OF_COLORS if rows else 0), dtype=np.uint32)
+
+    if isinstance(rows[0][0], (list, tuple, np.ndarray)):
+        # RGB colors of rows returned by process_collection
+        return rgb_to_packed(np.array(rows, dtype=np.float64))
+
+    colors = np.array(rows, dtype=object)
+    first = str(colors.flat[0])
+    if first.startswith('#'):
+        return hex_to_packed(colors.astype('U7'))
+
+    if first.startswith('['):
+        return rgb_to_packed([[_parse_color(color) for color in row] for row in colors])
+
+    return colors.astype(np.int64).astype(np.uint32)
+
+
+def read_collection_data(path):
+    """
+    Read the features rows saved by process_collection in every artist folder.
+
+    Parameters
+    ----------
+    path : str
+        Folder with one sub folder per label, each one with a "<label>.csv" file
+
+    Returns
+    -------
+    rows : list
+        Features rows of all labels, as strings
+    """
+    rows = []
+
+    for folder in sorted(os.listdir(path)):
+        csv_path = os.path.join(path, folder, f'{folder}.csv')
+
+        if os.path.isfile(csv_path):
+            with open(csv_path, newline='') as file:
+                rows.extend(row for row in reader(file) if row)
+
+    return rows
+
+
+def _parse_color(color):
+    """
+    Get the RGB channels of a color saved as RGB list, HEX string or packed integer.
+    """
+    color = str(color).strip()
+
+    if color.startswith('['):
+        return [float(channel) for channel in color.strip('[]').split(',')]
+
+    value = int(color[1:], 16) if color.startswith('#') else int(float(color))
+
+    return [float((value >> 16) & 255), float((value >> 8) & 255), float(value & 255)]
+
+
+def load_memmap(memmap_path):
+    """
+    Load images exported by process_collection as a memory-mapped array.
+
+    Nothing is read until the array is sliced, so batches are served straight from the page cache.
+
+    Parameters
+    ----------
+    memmap_path : str
+        Path of the .npy file passed to process_collection
+
+    Returns
+    -------
+    images : numpy.memmap
+        Read-only array of shape (N, H, W, 3)
+    labels : numpy.ndarray
+        Structured array with the label and name of every image, aligned with images
+    """
+    images = np.load(memmap_path, mmap_mode='r')
+    labels = np.load(_memmap_labels_path(memmap_path))
+
+    return images, labels
+
+
+def _memmap_labels_path(memmap_path):
+    """
+    Path of the labels array saved along a memory-mapped images array.
+    """
+    return os.path.splitext(memmap_path)[0] + '_labels.npy'
 
-    chiaroscuro = round(white_px/black_px, ndigits=5)
-    whitespace_ratio = round((white_px*100)/(img.size//3), ndigits=5)
 
-    return chiaroscuro, whitespace_ratio
+def _truncate_npy(npy_path, rows):
+    """
+    Shrink the first dimension of a .npy file in place.
+
+    The header is rewritten with the same length, so the data doesn't move and the file is just truncated.
+    """
+    with open(npy_path, 'r+b') as file:
+        version = np.lib.format.read_magic(file)
+        shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(file) if version == (1, 0) \
+            else np.lib.format.read_array_header_2_0(file)
+        data_offset = file.tell()
+
+        # Header length is stored right after magic string and version
+        len_size = 2 if version == (1, 0) else 4
+        header_start = 8 + len_size
+
+        new_shape = (rows,) + tuple(shape[1:])
+        header = str({'descr': np.lib.format.dtype_to_descr(dtype),
+                      'fortran_order': fortran_order,
+                      'shape': new_shape})
+        header = header.ljust(data_offset - header_start - 1) + '\n'
+
+        file.seek(header_start)
+        file.write(header.encode('latin1'))
+        file.truncate(data_offset + rows*int(np.prod(shape[1:]))*dtype.itemsize)
+
+
+def process_image(image, color_mode='HEX', warm_start=None, grid=None, features=None, clustering=None):
+    """
+    Reduce the palette of a resized image and extract its color data.
+
+    Parameters
+    ----------
+    image : numpy.ndarray
+        Image in RGB color mode, already resized
+    color_mode : str
+        Whether to use RGB, HEX or PACKED (0xRRGGBB integers) color mode
+    warm_start : WarmStart
+        Initial centroids for the color clustering, see utils.clustering.WarmStart
+    grid : tuple
+        Number of rows and columns of a grid whose cell features are added, see utils.features.get_grid_columns
+    features : list
+        Names of the feature extractors to run, see utils.features. By default dim_ratio, chiaroscuro,
+        whitespace_ratio and the colors found, most common first
+    clustering : dict
+        Other arguments of color_clustering (backend, n_init, sample_size...)
+
+    Returns
+    -------
+    img : numpy.ndarray
+        Image with a reduced color palette
+    features : list
+        Values of every feature extractor, followed by the grid columns if a grid is given
+    """
+    features = list(features or DEFAULT_FEATURES)
+    if grid is not None and 'grid' not in features:
+        features.append('grid')
+
+    return extract_features(image, features, color_mode=color_mode, warm_start=warm_start, grid=grid,
+                            clustering=clustering or {})
 
 
 def process_collection(collection,
@@ -97,7 +277,20 @@ def process_collection(collection,
                        color_mode='HEX',
                        label='new_label',
                        save=False,
-                       save_path=False):
+                       save_path=False,
+                       dedup_index=None,
+                       memmap_path=None,
+                       memmap_width=None,
+                       sink=None,
+                       save_format=None,
+                       warm_start=None,
+                       pipelined=False,
+                       readers=2,
+                       queue_size=8,
+                       memory_budget=None,
+                       grid=None,
+                       features=None,
+                       color_space='RGB'):
     """
     Process images of a collection and extracts color data.
 
@@ -107,19 +300,61 @@ def process_collection(collection,
     Parameters
     ----------
     collection : list
-        List with paths to images
+        List with paths to images. Images inside zip or tar archives as "<archive path>::<member name>", see
+        get_collection
     resize_height : int
         Desired height in pixels
     square : bool,
         Whether to transform images into squares
     color_mode:
-        Whether to use RGB or HEX color mode
+        Whether to use RGB, HEX or PACKED (0xRRGGBB integers) color mode
     label : str
         Label for the images and data
     save : bool
         Whether to save data and images
     save_path: str
         Path in which save data and images
+    dedup_index : HashIndex
+        Perceptual hash index from utils.image_hashing. If given, images that are near-duplicates of one already in
+        the index are skipped before the palette reduction and clustering. Check dedup_index.clusters() afterwards
+    memmap_path : str
+        Path of a .npy file in which to write all processed images as one uint8 array of shape
+        (N, resize_height, W, 3), plus an aligned labels array next to it. Load them with load_memmap
+    memmap_width : int
+        Width of the images in the memory-mapped array. Defaults to resize_height. Images are fitted keeping ratio
+        and padded with black
+    sink : ShardWriter
+        Sink from utils.shards. If given, processed images and their features rows are packed into its tar shards.
+        It is not closed, so one sink can gather several collections
+    save_format : str
+        Format of the saved images. By default images keep their original extension, which is lossy for JPEG. Use
+        'png' for 8-bit palette-indexed PNGs or 'npy' for raw uint8 index maps plus a shared "<label>_palette.npy".
+        Both are lossless and several times smaller. Load them with get_img_indexed
+    warm_start : WarmStart
+        Seeds the color clustering of every image with centroids from the previous image or from an artist palette
+        learnt incrementally (see utils.clustering.WarmStart). The artist palette is saved as
+        "<label>_artist_palette.csv" along the collection data
+    pipelined : bool
+        Whether to overlap reading, processing and saving of images in separate threads. Stages are connected by
+        bounded queues and a summary of their busy time and queue depths is printed to find the bottleneck
+    readers : int
+        Number of threads reading and decoding images in pipelined mode
+    queue_size : int
+        Maximum number of images waiting before every stage in pipelined mode
+    memory_budget : MemoryBudget
+        Memory budget from utils.large_images shared by the images being decoded. Useful with several readers and
+        very large scans, which are decoded at a reduced JPEG scale when they don't fit
+    grid : tuple
+        Number of rows and columns of a grid over every image. Black, white and color shares and the dominant palette
+        code of every cell are added after the colors, see utils.features.get_grid_columns
+    features : list
+        Names of the feature extractors giving the columns after label and img_name, see utils.features. Rows are
+        read back by parse_features only if they start with the default ones. Then running statistics of the ratios
+        and colors are saved as "<label>_stats.json" every STATS_SAVE_INTERVAL images and at the end, see
+        utils.aggregates
+    color_space : str
+        Space in which colors are clustered: RGB, or LAB for perceptually closer palettes at a lower cost, see
+        color_clustering
 
     Returns
     -------
@@ -132,6 +367,7 @@ def process_collection(collection,
     collection_data = []
     errors = 0
     errors_log = []
+    duplicates = 0
     index = infinite_sequence()
 
     if save:
@@ -165,62 +401,177 @@ def process_collection(collection,
             return print(f'FileExistsError: "{label}" folder already exists in your saving path.'), \
                    print("Remove it or type a different label name.\n")
 
-    for img in collection:
-        img_path = str(img)
-        img_name = label + '_' + str(next(index))
-        img_extension = img_path.split(sep='/')[-1].split(sep='.')[-1]
-
-        try:
-            # Get image RGB and resize
-            img = get_img_rgb(img_path)
-            if square:
-                img = square_img(img, resize_height)
-            else:
-                img = resize_img(img, resize_height)
-
-            # Get ratio
-            dim_ratio = round(img.shape[0]/img.shape[1], ndigits=5)
-
-            # Reduce palette of colors
-            img = reduce_col_palette(img, 5)
+    if memmap_path:
+        # Allocate space for every image, it is shrunk to the images processed at the end
+        collection = list(collection)
+        memmap_width = resize_height if square else (memmap_width or resize_height)
+        memmap = np.lib.format.open_memmap(memmap_path, mode='w+', dtype=np.uint8,
+                                           shape=(len(collection), resize_height, memmap_width, 3))
+        memmap_labels = []
 
-            # Get color features
-            chiaroscuro, whitespace_ratio = get_color_features(img)
+    if save:
+        # Rows are written as soon as every image is processed
+        csv_file = open(f'{save_dir}/{label}.csv', "w", newline="")
+        quill = writer(csv_file)
+
+        # Statistics are kept for rows starting with the default columns, which they know
+        stats = None
+        if list(features or DEFAULT_FEATURES)[:len(DEFAULT_FEATURES)] == list(DEFAULT_FEATURES):
+            # utils.aggregates builds on the functions of this module
+            from utils.aggregates import CollectionStats, get_stats_path
+
+            stats = CollectionStats(label)
+            stats_path = get_stats_path(save_dir, label)
+
+    def read(task):
+        # Get image RGB and resize
+        img_path, img_name, img_extension = task
+        if memory_budget is not None:
+            img = load_img_resized(img_path, resize_height, square, memory_budget)
+        elif square:
+            img = square_img(get_img_rgb(img_path), resize_height)
+        else:
+            img = resize_img(get_img_rgb(img_path), resize_height)
+
+        return img_path, img_name, img_extension, img
+
+    def compute(task):
+        nonlocal duplicates
+        img_path, img_name, img_extension, img = task
+
+        # Skip near-duplicates of images already processed
+        if dedup_index is not None and dedup_index.add(img_path, img) is not None:
+            duplicates += 1
+            return None
+
+        # Reduce palette and extract features
+        img, values = process_image(img, color_mode=color_mode, warm_start=warm_start, grid=grid, features=features,
+                                    clustering={'color_space': color_space})
+
+        # Gather image data
+        return img_name, img_extension, img, [label, img_name] + values
+
+    def write(task):
+        img_name, img_extension, img, img_data = task
+
+        # Add img_data to collection_data
+        collection_data.append(img_data)
+
+        if memmap_path:
+            memmap[len(memmap_labels)] = pad_img(img, resize_height, memmap_width)
+            memmap_labels.append((label, img_name))
+
+        if sink is not None:
+            sink.write(img_name, img, img_data)
+
+        if save:
+            quill.writerow(img_data)
+            save_processed_img(save_dir, img_name, img, img_extension, save_format)
+
+            if stats is not None:
+                stats.add(img_data)
+                if stats.count % STATS_SAVE_INTERVAL == 0:
+                    stats.save(stats_path)
+
+        return img_name
+
+    tasks = ((str(img), label + '_' + str(next(index)), str(img).split(sep='/')[-1].split(sep='.')[-1])
+             for img in collection)
+
+    try:
+        if pipelined:
+            # Read, compute and write in their own threads. Compute and write keep one thread each and get images
+            # in collection order, so dedup_index and warm_start see them as in sequential mode
+            metrics = run_pipeline(((task[1], task) for task in tasks),
+                                   [Stage('read', read, workers=readers), Stage('compute', compute),
+                                    Stage('write', write)],
+                                   queue_size=queue_size)
+            errors_log = sorted(img_name for img_name, _, _ in metrics['errors'])
+            errors = len(errors_log)
+
+            # Inform user
+            print(format_metrics(metrics))
+
+        else:
+            for task in tasks:
+                try:
+                    processed = compute(read(task))
+                    if processed is not None:
+                        write(processed)
+
+                except (BaseException, Exception):
+                    errors += 1
+                    errors_log.append(task[1])
+                    continue
+
+    finally:
+        if save:
+            # Close collection data and save statistics, also if a stage raised
+            csv_file.close()
+
+            if stats is not None:
+                stats.save(stats_path)
 
-            # Apply color clustering
-            colors = color_clustering(img, color_mode=color_mode, num_of_colors=5, show_chart=False)
+    if save:
+        if warm_start is not None:
+            # Save artist palette as HEX colors with their share of pixels
+            artist_colors, artist_shares = warm_start.palette()
+            artist_colors = packed_to_hex(rgb_to_packed(reduce_col_palette(artist_colors, 5)))
+            with open(f'{save_dir}/{label}_artist_palette.csv', "w", newline="") as file:
+                quill = writer(file)
+                quill.writerows([color, round(float(share), ndigits=5)]
+                                for color, share in zip(artist_colors, artist_shares))
+
+        if save_format == 'npy':
+            # Save the palette shared by all index maps
+            np.save(f'{save_dir}/{label}_palette.npy', get_palette(5))
+
+    if memmap_path:
+        # Drop the space left by skipped images and save aligned labels
+        memmap.flush()
+        del memmap
+        _truncate_npy(memmap_path, len(memmap_labels))
+        np.save(_memmap_labels_path(memmap_path),
+                np.array(memmap_labels, dtype=[('label', 'U64'), ('name', 'U64')]))
 
-            # Gather image data
-            img_data = [label, img_name, dim_ratio, chiaroscuro, whitespace_ratio]
-            for i in colors:
-                img_data.append(i)
+    # Inform user
+    if dedup_index is not None:
+        print(f'{duplicates} near-duplicates skipped. Check dedup_index.clusters() for more info.')
+    print(f'{errors} exceptions raised during the process. Check errors_log for more info.\n')
 
-            # Add img_data to collection_data
-            collection_data.append(img_data)
+    return collection_data, errors_log
 
-            if save:
-                # Revert img to BGR before saving
-                img_to_save = cvtColor(img, COLOR_RGB2BGR)
 
-                # Save image
-                filename = img_name + '.' + img_extension
-                save_img(f'{save_dir}/{filename}', img_to_save)
+def save_processed_img(save_dir, img_name, image, img_extension='jpg', save_format=None):
+    """
+    Save a processed image as process_collection does.
 
-        except (BaseException, Exception):
-            errors += 1
-            errors_log.append(img_name)
-            continue
+    Parameters
+    ----------
+    save_dir : str
+        Folder in which to save the image
+    img_name : str
+        Name of the image without extension
+    image : numpy.ndarray
+        Image in RGB color mode with a reduced palette
+    img_extension : str
+        Extension of the original image, used if no save_format is given
+    save_format : str
+        'png' or 'npy' to save palette indexes, see save_img_indexed
+    """
+    if save_format:
+        # Save palette indexes instead of colors
+        save_img_indexed(f'{save_dir}/{img_name}.{save_format}', image, 5)
 
-    if save:
-        # Save collection data
-        with open(f'{save_dir}/{label}.csv', "w", newline="") as file:
-            quill = writer(file)
-            quill.writerows(collection_data)
+    else:
+        # Revert img to BGR before saving
+        img_to_save = cvtColor(image, COLOR_RGB2BGR)
 
-    # Inform user
-    print(f'{errors} exceptions raised during the process. Check errors_log for more info.\n')
+        # Save image
+        filename = img_name + '.' + img_extension
+        save_img(f'{save_dir}/{filename}', img_to_save)
 
-    return collection_data, errors_log
+    return None
 
 
 def show_collection(collection):
@@ -230,8 +581,11 @@ def show_collection(collection):
     Parameters
     ----------
     collection: list
-        Paths of the files to be shown.
+        Paths of the files to be shown. Images inside archives as "<archive path>::<member name>", see get_collection
     """
+    plt = get_pyplot()
+    from mpl_toolkits.axes_grid1 import ImageGrid
+
     fig = plt.figure(figsize=(20, 20))
 
     grid = ImageGrid(fig,
@@ -249,11 +603,139 @@ def show_collection(collection):
 
         ax.imshow(img_res)
 
-    plt.show()
+    if not is_headless():
+        plt.show()
 
     return None
 
+# CLASSES
+class BatchLoader:
+    """
+    Shuffled batches of processed images, features and labels across label folders.
+
+    Images are decoded by a pool of threads while the previous batches are consumed. Decoded images are written into
+    preallocated batch buffers that are reused, so a yielded batch is only valid until the next one is requested.
+    Copy it if you need to keep it.
+
+    Parameters
+    ----------
+    path : str
+        Folder with the output of process_collection, one sub folder per label
+    batch_size : int
+        Number of images per batch
+    height : int
+        Height in pixels of the images in a batch
+    width : int
+        Width in pixels of the images in a batch. Images with a different size are resized
+    prefetch : int
+        Number of batches decoded ahead
+    workers : int
+        Number of decoding threads
+    shuffle : bool
+        Whether to shuffle images every epoch
+    seed : int
+        Seed of the shuffling. Epoch n of two loaders with the same seed yields the same batches
+    drop_last : bool
+        Whether to skip the last batch if it is smaller than batch_size
+
+    Attributes
+    ----------
+    classes : list
+        Label names, the label of an image is its position in this list
+    """
+    def __init__(self, path, batch_size=32, height=150, width=150, prefetch=2, workers=4, shuffle=True, seed=None,
+                 drop_last=False):
+        self.batch_size = batch_size
+        self.height = height
+        self.width = width
+        self.prefetch = max(1, prefetch)
+        self.workers = workers
+        self.shuffle = shuffle
+        self.seed = seed
+        self.drop_last = drop_last
+        self.epoch = 0
+
+        rows = read_collection_data(path)
+
+        # Find the image file of every row, whatever its extension
+        files = {}
+        for folder in sorted(os.listdir(path)):
+            folder_path = os.path.join(path, folder)
+            if os.path.isdir(folder_path):
+                for name in os.listdir(folder_path):
+                    stem, extension = os.path.splitext(name)
+                    if extension.lower() != '.csv' and not stem.endswith('_palette'):
+                        files[stem] = os.path.join(folder_path, name)
+
+        rows = [row for row in rows if row[1] in files]
+        features = [parse_features(row) for row in rows]
+        num_of_features = max((len(i) for i in features), default=0)
+
+        self.classes = sorted({row[0] for row in rows})
+        self.paths = [files[row[1]] for row in rows]
+        self.labels = np.array([self.classes.index(row[0]) for row in rows], dtype=np.int64)
+        self.features = np.zeros((len(rows), num_of_features), dtype=np.float32)
+        for i, vector in enumerate(features):
+            self.features[i, :len(vector)] = vector
+
+    def __len__(self):
+        if self.drop_last:
+            return len(self.paths)//self.batch_size
+
+        return -(-len(self.paths)//self.batch_size)
+
+    def __iter__(self):
+        if self.shuffle:
+            rng = np.random.default_rng(None if self.seed is None else [self.seed, self.epoch])
+            order = rng.permutation(len(self.paths))
+        else:
+            order = np.arange(len(self.paths))
+        self.epoch += 1
+
+        batches = [order[i:i + self.batch_size] for i in range(0, len(order), self.batch_size)]
+        if self.drop_last and batches and len(batches[-1]) < self.batch_size:
+            batches.pop()
+
+        # One more buffer than batches in flight, the extra one is being consumed
+        buffers = [(np.zeros((self.batch_size, self.height, self.width, 3), dtype=np.uint8),
+                    np.zeros((self.batch_size, self.features.shape[1]), dtype=np.float32),
+                    np.zeros(self.batch_size, dtype=np.int64))
+                   for _ in range(self.prefetch + 1)]
+
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            in_flight = deque()
+
+            for i, batch in enumerate(batches + [None]*self.prefetch):
+                if batch is not None:
+                    images, features, labels = buffers[i % len(buffers)]
+                    tasks = [executor.submit(self._load_image, self.paths[index], images, slot)
+                             for slot, index in enumerate(batch)]
+                    features[:len(batch)] = self.features[batch]
+                    labels[:len(batch)] = self.labels[batch]
+                    in_flight.append((tasks, len(batch), buffers[i % len(buffers)]))
+
+                if len(in_flight) > self.prefetch or (batch is None and in_flight):
+                    tasks, size, (images, features, labels) = in_flight.popleft()
+                    for task in tasks:
+                        task.result()
+
+                    yield images[:size], features[:size], labels[:size]
+
+    def _load_image(self, image_path, images, slot):
+        """
+        Decode an image into a slot of a batch buffer.
+        """
+        img = get_img_indexed(image_path) if image_path.endswith('.npy') else get_img_rgb(image_path)
+
+        if img.shape[:2] != (self.height, self.width):
+            img = resize(img, dsize=(self.width, self.height), interpolation=INTER_AREA)
+
+        images[slot] = img
+
+
 # VARIABLES
+# Images between two saves of the collection statistics
+STATS_SAVE_INTERVAL = 100
 
 
 # EXECUTION
@@ -0,0 +1,392 @@
+"""
+Contains the registry of feature extractors and the functions used to run them over shared intermediates
+"""
+# IMPORTS
+import cv2
+import numpy as np
+
+from utils.image_processing import color_clustering, palette_index, reduce_col_palette
+
+
+# FUNCTIONS
+def register_intermediate(name, function):
+    """
+    Register an intermediate result shared by feature extractors.
+
+    Parameters
+    ----------
+    name : str
+        Name the extractors use to require it
+    function : callable
+        Function receiving the FeatureContext, which gives access to other intermediates and the options
+    """
+    INTERMEDIATES[name] = function
+
+
+def register_extractor(name, requires, columns, function):
+    """
+    Register a feature extractor.
+
+    Parameters
+    ----------
+    name : str
+        Name used to choose the extractor, e.g. in process_collection(features=...)
+    requires : tuple
+        Names of the intermediates it needs, computed once per image for all extractors
+    columns : callable
+        Function receiving the options and returning the (name, type) tuples of the columns it adds
+    function : callable
+        Function receiving the FeatureContext and returning the list of values it adds
+    """
+    unknown = set(requires) - set(INTERMEDIATES)
+    if unknown:
+        raise KeyError(f'Unknown intermediates required by {name}: {sorted(unknown)}')
+
+    EXTRACTORS[name] = {'requires': tuple(requires), 'columns': columns, 'function': function}
+
+
+def extract_features(image, features=None, **options):
+    """
+    Run a set of feature extractors over one image.
+
+    Intermediates required by the extractors (reduced palette, gray image, HSV...) are computed once, before any
+    extractor runs, and shared.
+
+    Parameters
+    ----------
+    image : numpy.ndarray
+        Image in RGB color mode, already resized
+    features : list
+        Names of the extractors to run, in column order. Defaults to DEFAULT_FEATURES, which gives the rows of
+        process_collection
+    options
+        Options of the extractors: color_mode, warm_start, grid and clustering, a dict of color_clustering arguments
+        (backend, n_init, sample_size...)
+
+    Returns
+    -------
+    img : numpy.ndarray
+        Image with a reduced color palette
+    values : list
+        Values of every extractor, in the order of features
+    """
+    features = features or DEFAULT_FEATURES
+    unknown = [name for name in features if name not in EXTRACTORS]
+    if unknown:
+        raise KeyError(f'Unknown feature extractors: {unknown}')
+
+    # Intermediates may have been unregistered since the extractors were
+    required = get_required_intermediates(features)
+    missing = [name for name in required if name not in INTERMEDIATES]
+    if missing:
+        raise KeyError(f'Intermediates required by {list(features)} are not registered: {missing}')
+
+    context = FeatureContext(image, **options)
+    for name in required:
+        context[name]
+
+    values = []
+    for name in features:
+        values.extend(EXTRACTORS[name]['function'](context))
+
+    return context['reduced'], values
+
+
+def get_feature_columns(features=None, **options):
+    """
+    Name and type of the columns added by a set of feature extractors.
+
+    Parameters
+    ----------
+    features : list
+        Names of the extractors. Defaults to DEFAULT_FEATURES
+    options
+        Options of the extractors, as passed to extract_features
+
+    Returns
+    -------
+    columns : list
+        Tuples (name, type)
+    """
+    columns = []
+
+    for name in (features or DEFAULT_FEATURES):
+        columns.extend(EXTRACTORS[name]['columns'](options))
+
+    return columns
+
+
+def get_color_features(image, classes=None):
+    """
+    Extract color features from one image.
+
+    Parameters
+    ----------
+    image : numpy.ndarray
+        Image in RGB color mode
+    classes : numpy.ndarray
+        Pixel classes of the image if already computed, see get_pixel_classes
+
+    Returns
+    -------
+    chiaroscuro : float
+        Ratio of white pixels to black pixels. Images without black pixels count as having one, so the ratio stays
+        finite and grows with the white pixels
+    whitespace_ratio : float
+        Percentage of white pixels
+    """
+    # Count black, white and color pixels
+    if classes is None:
+        classes = get_pixel_classes(image)
+    black_px, white_px, color_px = (int(i) for i in np.bincount(classes.ravel(), minlength=3))
+
+    chiaroscuro = round(white_px/max(black_px, 1), ndigits=5)
+    whitespace_ratio = round((white_px*100)/(image.size//3), ndigits=5)
+
+    return chiaroscuro, whitespace_ratio
+
+
+def get_grid_columns(grid):
+    """
+    Name and type of the columns added by get_grid_features.
+
+    Parameters
+    ----------
+    grid : tuple
+        Number of rows and columns of the grid
+
+    Returns
+    -------
+    columns : list
+        Tuples (name, type), cells in row-major order
+    """
+    columns = []
+
+    for row in range(grid[0]):
+        for col in range(grid[1]):
+            cell = f'cell_{row}_{col}'
+            columns.extend([(f'{cell}_black', float), (f'{cell}_white', float), (f'{cell}_color', float),
+                            (f'{cell}_dominant', int)])
+
+    return columns
+
+
+def get_grid_features(image, grid=(3, 3), max_values=5, classes=None, codes=None):
+    """
+    Extract color features from every cell of a grid over one image.
+
+    Every pixel gets the index of its cell, so black, white and color pixels and palette codes of all cells are
+    counted at once with a single bincount each. Cells split the image as evenly as possible.
+
+    Parameters
+    ----------
+    image : numpy.ndarray
+        Image in RGB color mode with a reduced palette
+    grid : tuple
+        Number of rows and columns of the grid
+    max_values : int
+        Number of possible values for each RGB channel, see palette_index
+    classes : numpy.ndarray
+        Pixel classes of the image if already computed, see get_pixel_classes
+    codes : numpy.ndarray
+        Palette codes of the image if already computed, see palette_index
+
+    Returns
+    -------
+    shares : numpy.ndarray
+        Shares of black, white and color pixels of shape (cells, 3), cells in row-major order
+    dominant : numpy.ndarray
+        Most common palette code of every cell, see get_palette
+    """
+    rows, cols = grid
+    num_of_cells = rows*cols
+    num_of_codes = max_values**3
+
+    # Cell of every pixel
+    cell_rows = np.arange(image.shape[0])*rows//image.shape[0]
+    cell_cols = np.arange(image.shape[1])*cols//image.shape[1]
+    cells = (cell_rows[:, None]*cols + cell_cols[None, :]).ravel()
+
+    # Count pixel classes and palette codes by cell
+    if classes is None:
+        classes = get_pixel_classes(image)
+    class_counts = np.bincount(cells*3 + classes.ravel(), minlength=num_of_cells*3).reshape(num_of_cells, 3)
+
+    if codes is None:
+        codes = palette_index(image, max_values)
+    code_counts = np.bincount(cells*num_of_codes + codes.ravel(), minlength=num_of_cells*num_of_codes)
+    dominant = code_counts.reshape(num_of_cells, num_of_codes).argmax(axis=1)
+
+    return class_counts/class_counts.sum(axis=1, keepdims=True), dominant
+
+
+def get_pixel_classes(image):
+    """
+    Classify the pixels of an image as black (0), white (1) or color (2).
+
+    Black pixels have every channel at 50 or less and white pixels at 206 or more.
+
+    Parameters
+    ----------
+    image : numpy.ndarray
+        Image in RGB color mode
+
+    Returns
+    -------
+    classes : numpy.ndarray
+        uint8 array with the shape of the image without channels
+    """
+    classes = np.full(image.shape[:2], 2, dtype=np.uint8)
+    classes[(image >= 206).all(axis=2)] = 1
+    classes[(image <= 50).all(axis=2)] = 0
+
+    return classes
+
+
+def get_required_intermediates(features=None):
+    """
+    Intermediates declared by a set of feature extractors, not counting the ones they build on.
+    """
+    return sorted({i for name in (features or DEFAULT_FEATURES) for i in EXTRACTORS[name]['requires']})
+
+
+def _edges(context):
+    """
+    Share of edge pixels found by Canny.
+    """
+    return [round(float(np.count_nonzero(context['edges']))/context['edges'].size, ndigits=5)]
+
+
+def _grid(context):
+    """
+    Black, white and color shares and dominant palette code of every cell, as get_grid_features.
+    """
+    values = []
+    shares, dominant = get_grid_features(context['reduced'], _grid_option(context.options), max_values=5,
+                                         classes=context['pixel_classes'], codes=context['palette_codes'])
+    for cell_shares, code in zip(np.round(shares, decimals=5).tolist(), dominant.tolist()):
+        values.extend(cell_shares + [code])
+
+    return values
+
+
+def _grid_option(options):
+    """
+    Grid of the grid extractor, which has no default size.
+    """
+    if options.get('grid') is None:
+        raise ValueError('The grid extractor needs the number of rows and columns, e.g. grid=(3, 3)')
+
+    return options['grid']
+
+
+def _palette(context):
+    """
+    Colors found by color clustering, most common first.
+    """
+    color_mode = context.options.get('color_mode', 'HEX')
+    colors = color_clustering(context['reduced'], color_mode=color_mode, num_of_colors=NUM_OF_COLORS,
+                              show_chart=False, warm_start=context.options.get('warm_start'),
+                              **context.options.get('clustering', {}))
+
+    return colors.tolist() if color_mode == 'PACKED' else list(colors)
+
+
+def _saturation(context):
+    """
+    Mean and standard deviation of the saturation, from 0 to 1.
+    """
+    saturation = context['hsv'][..., 1]
+
+    return [round(float(saturation.mean())/255, ndigits=5), round(float(saturation.std())/255, ndigits=5)]
+
+
+def _texture(context):
+    """
+    Mean and standard deviation of the Sobel gradient magnitude, a proxy of brushstroke texture.
+    """
+    gradient = context['gradient']
+
+    return [round(float(gradient.mean()), ndigits=5), round(float(gradient.std()), ndigits=5)]
+
+
+def _gradient(context):
+    """
+    Sobel gradient magnitude of the gray image.
+    """
+    gray = context['gray']
+    dx = cv2.Sobel(gray, cv2.CV_32F, 1, 0, ksize=3)
+    dy = cv2.Sobel(gray, cv2.CV_32F, 0, 1, ksize=3)
+
+    return cv2.magnitude(dx, dy)
+
+
+# CLASSES
+class FeatureContext:
+    """
+    Intermediates of one image, computed on first use and kept for the other extractors.
+
+    Parameters
+    ----------
+    image : numpy.ndarray
+        Image in RGB color mode, already resized
+    options
+        Options of the extractors
+    """
+    def __init__(self, image, **options):
+        self.image = image
+        self.options = options
+        self._values = {}
+
+    def __getitem__(self, name):
+        if name not in self._values:
+            self._values[name] = INTERMEDIATES[name](self)
+
+        return self._values[name]
+
+
+# VARIABLES
+# Colors in every features row
+NUM_OF_COLORS = 5
+
+INTERMEDIATES = {}
+EXTRACTORS = {}
+
+# Extractors giving the rows of process_collection
+DEFAULT_FEATURES = ('ratio', 'color_stats', 'palette')
+
+# Type of the color columns by color mode
+COLOR_TYPES = {'HEX': str, 'RGB': list, 'PACKED': int}
+
+
+# EXECUTION
+register_intermediate('rgb', lambda context: context.image)
+register_intermediate('reduced', lambda context: reduce_col_palette(context['rgb'], 5))
+register_intermediate('pixel_classes', lambda context: get_pixel_classes(context['reduced']))
+register_intermediate('palette_codes', lambda context: palette_index(context['reduced'], 5))
+register_intermediate('gray', lambda context: cv2.cvtColor(context['rgb'], cv2.COLOR_RGB2GRAY))
+register_intermediate('hsv', lambda context: cv2.cvtColor(context['rgb'], cv2.COLOR_RGB2HSV))
+register_intermediate('gradient', _gradient)
+register_intermediate('edges', lambda context: cv2.Canny(context['gray'], 100, 200))
+
+register_extractor('ratio', ('rgb',), lambda options: [('dim_ratio', float)],
+                   lambda context: [round(context['rgb'].shape[0]/context['rgb'].shape[1], ndigits=5)])
+register_extractor('color_stats', ('reduced', 'pixel_classes'),
+                   lambda options: [('chiaroscuro', float), ('whitespace_ratio', float)],
+                   lambda context: list(get_color_features(context['reduced'], classes=context['pixel_classes'])))
+register_extractor('palette', ('reduced',),
+                   lambda options: [(f'color_{i + 1}', COLOR_TYPES[options.get('color_mode', 'HEX')])
+                                    for i in range(NUM_OF_COLORS)], _palette)
+register_extractor('grid', ('reduced', 'pixel_classes', 'palette_codes'),
+                   lambda options: get_grid_columns(_grid_option(options)), _grid)
+register_extractor('edges', ('edges',), lambda options: [('edge_density', float)], _edges)
+register_extractor('texture', ('gradient',),
+                   lambda options: [('gradient_mean', float), ('gradient_std', float)], _texture)
+register_extractor('saturation', ('hsv',),
+                   lambda options: [('saturation_mean', float), ('saturation_std', float)], _saturation)
+
+
+# OUTPUT
+
+
+# END OF FILE
@@ -0,0 +1,250 @@
+"""
+Contains the functions used to find near-duplicate images by perceptual hashing
+"""
+# IMPORTS
+import cv2
+import numpy as np
+
+from utils.image_processing import get_img_rgb, resize_img
+
+
+# FUNCTIONS
+def average_hash(image, hash_size=8):
+    """
+    Compute the average hash (aHash) of an image.
+
+    The image is shrunk to hash_size x hash_size gray pixels and every bit of the hash tells whether a pixel is
+    brighter than the mean.
+
+    Parameters
+    ----------
+    image : numpy.ndarray
+        Image in RGB color mode
+    hash_size : int
+        Side of the shrunk image. At most 8 so the hash fits in 64 bits
+
+    Returns
+    -------
+    img_hash : int
+        Perceptual hash of the image
+    """
+    gray = cv2.cvtColor(image, cv2.COLOR_RGB2GRAY)
+    small = cv2.resize(gray, (hash_size, hash_size), interpolation=cv2.INTER_AREA)
+
+    return _pack_bits(small > small.mean())
+
+
+def difference_hash(image, hash_size=8):
+    """
+    Compute the difference hash (dHash) of an image.
+
+    The image is shrunk to (hash_size + 1) x hash_size gray pixels and every bit of the hash tells whether a pixel is
+    brighter than its right neighbour. It is more robust than aHash to global brightness and contrast changes.
+
+    Parameters
+    ----------
+    image : numpy.ndarray
+        Image in RGB color mode
+    hash_size : int
+        Rows of the shrunk image. At most 8 so the hash fits in 64 bits
+
+    Returns
+    -------
+    img_hash : int
+        Perceptual hash of the image
+    """
+    gray = cv2.cvtColor(image, cv2.COLOR_RGB2GRAY)
+    small = cv2.resize(gray, (hash_size + 1, hash_size), interpolation=cv2.INTER_AREA)
+
+    return _pack_bits(small[:, :-1] < small[:, 1:])
+
+
+def hamming_distance(hash_a, hash_b):
+    """
+    Count the bits that differ between two hashes.
+
+    Parameters
+    ----------
+    hash_a : int
+        First hash
+    hash_b : int
+        Second hash
+
+    Returns
+    -------
+    distance : int
+        Number of different bits
+    """
+    return bin(int(hash_a) ^ int(hash_b)).count('1')
+
+
+def dedup_collection(collection, max_distance=4, method='dhash', resize_height=150):
+    """
+    Remove near-duplicate images from a collection.
+
+    Images are compared by perceptual hash in collection order, so the first copy of every artwork is kept.
+
+    Parameters
+    ----------
+    collection : list
+        List with paths to images
+    max_distance : int
+        Maximum Hamming distance between hashes of duplicates
+    method : str
+        Hash to use (ahash, dhash)
+    resize_height : int
+        Height in pixels the images are resized to before hashing
+
+    Returns
+    -------
+    unique : list
+        Paths of the images that are not duplicates
+    clusters : list
+        Lists of paths of duplicated images. The first path of each one is the copy kept
+    """
+    index = HashIndex(max_distance=max_distance, method=method)
+    unique = []
+
+    for img in collection:
+        try:
+            img_rgb = resize_img(get_img_rgb(str(img)), resize_height)
+        except (BaseException, Exception):
+            # Let the processing stage report unreadable files
+            unique.append(img)
+            continue
+
+        if index.add(img, img_rgb) is None:
+            unique.append(img)
+
+    clusters = index.clusters()
+
+    print(f'{len(collection) - len(unique)} near-duplicates found in {len(clusters)} clusters')
+
+    return unique, clusters
+
+
+def _pack_bits(bits):
+    """
+    Pack a boolean array into an integer, first element as the most significant bit.
+    """
+    return int.from_bytes(np.packbits(bits.flatten()).tobytes(), 'big') >> (-bits.size % 8)
+
+
+# CLASSES
+class HashIndex:
+    """
+    Index of perceptual hashes with fast Hamming distance lookup.
+
+    Hashes are kept in a contiguous uint64 array so a lookup compares a hash against the whole index in one
+    vectorized pass.
+
+    Parameters
+    ----------
+    max_distance : int
+        Maximum Hamming distance between hashes of duplicates
+    method : str
+        Hash to use (ahash, dhash)
+    hash_size : int
+        Size passed to the hash function
+    """
+    def __init__(self, max_distance=4, method='dhash', hash_size=8):
+        self.max_distance = max_distance
+        self.hash_function = HASH_FUNCTIONS[method]
+        self.hash_size = hash_size
+
+        self.keys = []
+        self.duplicates = {}
+        self._hashes = np.zeros(64, dtype=np.uint64)
+
+    def __len__(self):
+        return len(self.keys)
+
+    def hash(self, image):
+        """
+        Hash an image with the index method.
+        """
+        return self.hash_function(image, self.hash_size)
+
+    def distances(self, img_hash):
+        """
+        Hamming distances from a hash to every hash in the index.
+        """
+        xor = self._hashes[:len(self.keys)] ^ np.uint64(img_hash)
+
+        return POPCOUNT[xor.view(np.uint8)].reshape(-1, 8).sum(axis=1)
+
+    def query(self, img_hash):
+        """
+        Find the closest hash in the index.
+
+        Returns
+        -------
+        key : object
+            Key of the closest image within max_distance, None if there is none
+        """
+        if not self.keys:
+            return None
+
+        distances = self.distances(img_hash)
+        closest = int(distances.argmin())
+
+        return self.keys[closest] if distances[closest] <= self.max_distance else None
+
+    def add(self, key, image):
+        """
+        Add an image to the index unless it is a near-duplicate.
+
+        Parameters
+        ----------
+        key : object
+            Identifier of the image, usually its path
+        image : numpy.ndarray
+            Image in RGB color mode
+
+        Returns
+        -------
+        original : object
+            Key of the image it duplicates, None if it was added to the index
+        """
+        img_hash = self.hash(image)
+        original = self.query(img_hash)
+
+        if original is not None:
+            self.duplicates.setdefault(original, []).append(key)
+            return original
+
+        if len(self.keys) == len(self._hashes):
+            self._hashes = np.concatenate([self._hashes, np.zeros_like(self._hashes)])
+
+        self._hashes[len(self.keys)] = img_hash
+        self.keys.append(key)
+
+        return None
+
+    def clusters(self):
+        """
+        Report the groups of near-duplicates found so far.
+
+        Returns
+        -------
+        clusters : list
+            Lists of keys, the first one is the image kept in the index
+        """
+        return [[original] + copies for original, copies in self.duplicates.items()]
+
+
+# VARIABLES
+HASH_FUNCTIONS = {'ahash': average_hash,
+                  'dhash': difference_hash}
+
+# Number of set bits of every byte value
+POPCOUNT = np.array([bin(i).count('1') for i in range(256)], dtype=np.uint8)
+
+
+# EXECUTION
+
+
+# OUTPUT
+
+
+# END OF FILE
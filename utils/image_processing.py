@@ -1,74 +1,123 @@
 """
 Contains the functions used to process raw images for ML algorithms
 """
-from collections import Counter
-
 # IMPORTS
+from functools import lru_cache
+
 import cv2
-import matplotlib.pyplot as plt
 import numpy as np
-from matplotlib.patches import Rectangle
-from sklearn.cluster import KMeans
+
+from utils.archives import read_img
+from utils.clustering import kmeans, sampled_kmeans, sampling_error
+from utils.misc import get_pyplot, is_headless
 
 
 # FUNCTIONS
-def color_clustering(image, color_mode='HEX', max_values=5, num_of_colors=10, show_chart=True):
+def color_clustering(image, color_mode='HEX', max_values=5, num_of_colors=10, show_chart=True, backend=None,
+                     max_iter=300, tol=1e-4, n_init=10, warm_start=None, sample_size=None, adaptive=False,
+                     sample_tol=1.0, info=False, color_space='RGB'):
     """
     Extract a number of colors from an image.
 
-    This function applies a color quantization based on cv2.kmeans function
-    as described in the OpenCV docs to reduce the colors present on an image.
+    This function applies a color quantization based on k-means to reduce the
+    colors present on an image. The k-means implementation is chosen by
+    backend, see utils.clustering.
 
     Parameters
     ----------
     image : numpy.ndarray
         Image to extract color from
     color_mode : str
-        Color mode to return colors (RGB, HEX)
+        Color mode to return colors (RGB, HEX, PACKED)
     max_values : int
         Number of possible values for each RGB channel
     num_of_colors : int
         Number of clusters
     show_chart : bool
-        Whether to show a chart with found colors
+        Whether to show a chart with found colors. Ignored in headless mode
+    backend : str
+        k-means backend (cv2, sklearn, minibatch, numpy). Defaults to the one
+        recorded by utils.clustering.calibrate, or sklearn
+    max_iter : int
+        Maximum number of k-means iterations
+    tol : float
+        k-means convergence tolerance
+    n_init : int
+        Number of k-means runs with different initial centroids
+    warm_start : WarmStart
+        Initial centroids shared across images, see utils.clustering.WarmStart.
+        It is updated with the centroids found
+    sample_size : int
+        Number of pixels to cluster, picked by stratified sampling. Every pixel
+        is then assigned to the closest centroid. By default all pixels are
+        clustered
+    adaptive : bool
+        Whether to double the sample until centroids move less than sample_tol
+    sample_tol : float
+        Centroid movement, in RGB units, under which the sample stops growing
+    info : bool
+        Whether to inform the user the sample used and its error against
+        clustering every pixel. Computing the error clusters every pixel too
+    color_space : str
+        Space in which colors are clustered: RGB, or LAB (CIELAB) where
+        distances match perceived color differences. LAB clusters the unique
+        colors of the reduced palette weighted by their pixel counts, with
+        their LAB values taken from a cached table, so sampling settings are
+        ignored and it is faster than RGB
 
     Returns
     -------
     colors : list
-        List of colors in specified color mode
+        List of colors in specified color mode, most common first. PACKED
+        mode returns a uint32 numpy.ndarray of 0xRRGGBB values instead
     """
     # Collapse image into one dimension (KMeans requirement)
     img = image.reshape(image.shape[0]*image.shape[1], 3)
 
-    # Use KMeans to generate num_of_colors number of clusters
-    model_kmeans = KMeans(n_clusters=num_of_colors)
-    labels = model_kmeans.fit_predict(img)  # This returns a number of cluster for each pixel
-    color_clusters = model_kmeans.cluster_centers_  # This are the RGB values of the centroids
+    # Use k-means to generate num_of_colors number of clusters
+    init = warm_start.init(num_of_colors) if warm_start is not None else None
+    settings = {'backend': backend, 'max_iter': max_iter, 'tol': tol, 'n_init': n_init}
+
+    if color_space == 'LAB':
+        labels, color_clusters = _lab_kmeans(img, num_of_colors, max_values, init, settings)
+    elif sample_size and sample_size < len(img):
+        labels, color_clusters, sample = sampled_kmeans(img, num_of_colors, sample_size, adaptive=adaptive,
+                                                        sample_tol=sample_tol, init=init, **settings)
+        # Inform user
+        if info:
+            error = sampling_error(img, labels, color_clusters, **settings)
+            print(f'Clustered {sample["sample_size"]} of {len(img)} pixels in {sample["rounds"]} rounds. '
+                  f'Centroid error: {error["centroid_error_mean"]:.2f} (max {error["centroid_error_max"]:.2f}), '
+                  f'inertia increase: {error["inertia_increase"]:.2%}')
+    else:
+        labels, color_clusters = kmeans(img, num_of_colors, init=init,
+                                        **settings)  # Cluster of each pixel and RGB values of the centroids
+
+    if warm_start is not None:
+        warm_start.update(color_clusters, np.bincount(labels, minlength=num_of_colors))
 
-    # Transform color clusters to a discrete variable and its type to list
-    color_clusters = np.array(color_clusters)  # Needed for reduce_col_palette
+    # Transform color clusters to a discrete variable packed as 0xRRGGBB
     color_clusters = reduce_col_palette(np.array(color_clusters), max_values=max_values)
-    color_clusters = color_clusters.tolist()
+    color_clusters = rgb_to_packed(color_clusters)
 
     # Count and sort the pixels in each cluster to order colors by most common
-    color_counts = Counter(labels)  # Get color as keys and counts as values
-    color_counts = color_counts.most_common()  # Order color by counts
+    color_counts = np.bincount(labels, minlength=num_of_colors)
+    ordered_colors = color_clusters[np.argsort(-color_counts, kind='stable')]
 
-    # Get RGB and HEX indexes
-    ordered_RGB_colors = [color_clusters[i[0]] for i in color_counts]
-    ordered_HEX_colors = [rgb_to_hex(i).upper() for i in ordered_RGB_colors]
+    if show_chart and not is_headless():
+        plot_colors(packed_to_hex(ordered_colors).tolist())
+        get_pyplot().show()
 
-    if show_chart:
-        plot_colors(ordered_HEX_colors)
-        plt.show()
+    if color_mode == 'PACKED':
+        colors = ordered_colors
 
-    if color_mode == 'RGB':
-        colors = ordered_RGB_colors
+    elif color_mode == 'RGB':
+        colors = packed_to_rgb(ordered_colors).astype(float).tolist()
 
     else:
-        colors = ordered_HEX_colors
+        colors = packed_to_hex(ordered_colors).tolist()
 
-    return color_clusters
+    return colors
 
 
 def get_img_rgb(image_path):
@@ -80,19 +129,157 @@ def get_img_rgb(image_path):
     Parameters
     ----------
     image_path : str
-        Path of the image
+        Path of the image, or "<archive path>::<member name>" for an image inside a zip or tar archive
 
     Returns
     -------
     image : numpy.ndarray
         Image in RGB color mode
     """
-    img = cv2.imread(image_path)
+    img = read_img(image_path)
     img = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
 
     return img
 
 
+def get_img_indexed(image_path, max_values=5):
+    """
+    Import a palette-indexed image in RGB mode.
+
+    Reads images saved by save_img_indexed and maps every index back to its RGB color.
+
+    Parameters
+    ----------
+    image_path : str
+        Path of the image (.png or .npy)
+    max_values : int
+        Number of possible values for each RGB channel. Only used for .npy index maps, PNG files carry their palette
+
+    Returns
+    -------
+    image : numpy.ndarray
+        Image in RGB color mode
+    """
+    if image_path.endswith('.npy'):
+        return index_to_rgb(np.load(image_path), max_values)
+
+    from PIL import Image
+
+    with Image.open(image_path) as img:
+        palette = np.array(img.getpalette(), dtype=np.uint8).reshape(-1, 3)
+
+        return palette[np.asarray(img)]
+
+
+def get_palette(max_values):
+    """
+    Generate the palette of an image reduced with reduce_col_palette.
+
+    Colors are ordered by red, green and blue levels, so the index of a color is R*max_values**2 + G*max_values + B,
+    being R, G and B the level of each channel.
+
+    Parameters
+    ----------
+    max_values : int
+        Number of possible values for each RGB channel
+
+    Returns
+    -------
+    palette : numpy.ndarray
+        Array of shape (max_values**3, 3) with every RGB color of the reduced palette
+    """
+    values = _channel_values(max_values).astype(np.uint8)
+    red, green, blue = np.meshgrid(values, values, values, indexing='ij')
+
+    return np.stack([red.ravel(), green.ravel(), blue.ravel()], axis=1)
+
+
+@lru_cache(maxsize=None)
+def get_palette_lab(max_values):
+    """
+    Get the CIELAB values of the palette of reduce_col_palette, computed once per max_values.
+
+    Parameters
+    ----------
+    max_values : int
+        Number of possible values for each RGB channel
+
+    Returns
+    -------
+    palette : numpy.ndarray
+        Read-only array of shape (max_values**3, 3) with the L, a and b values of every color of get_palette
+    """
+    palette = rgb_to_lab(get_palette(max_values))
+    palette.setflags(write=False)
+
+    return palette
+
+
+def hex_to_packed(HEX_colors):
+    """
+    Transform HEX colors into packed 0xRRGGBB integers.
+
+    Works on whole arrays at once, the leading '#' is optional.
+
+    Parameters
+    ----------
+    HEX_colors : array_like
+        HEX color references
+
+    Returns
+    -------
+    packed : numpy.ndarray
+        uint32 array with the shape of HEX_colors
+    """
+    HEX_colors = np.char.lstrip(np.asarray(HEX_colors, dtype='U7'), '#')
+    digits = HEX_DIGITS_VALUES[HEX_colors.astype('S6').view(np.uint8).reshape(HEX_colors.shape + (6,))]
+
+    packed = np.zeros(HEX_colors.shape, dtype=np.uint32)
+    for i in range(6):
+        packed = (packed << np.uint32(4)) | digits[..., i]
+
+    return packed
+
+
+def index_to_rgb(index_map, max_values):
+    """
+    Map a palette index map back to RGB colors.
+
+    Parameters
+    ----------
+    index_map : numpy.ndarray
+        Palette indexes as returned by palette_index
+    max_values : int
+        Number of possible values for each RGB channel
+
+    Returns
+    -------
+    image : numpy.ndarray
+        Image in RGB color mode
+    """
+    return get_palette(max_values)[index_map]
+
+
+def lab_to_rgb(colors):
+    """
+    Convert CIELAB colors to RGB, as rgb_to_lab does the opposite.
+
+    Parameters
+    ----------
+    colors : array_like
+        CIELAB colors, channels in the last dimension
+
+    Returns
+    -------
+    colors : numpy.ndarray
+        float64 RGB colors from 0 to 255
+    """
+    colors = np.asarray(colors, dtype=np.float32)
+    rgb = cv2.cvtColor(colors.reshape(-1, 1, 3), cv2.COLOR_Lab2RGB).reshape(colors.shape)
+
+    return np.clip(rgb.astype(np.float64)*255, 0, 255)
+
+
 def map_channel(channel_value, max_values):
     """
     Map an RGB channel value (0 to 255) to a limited options.
@@ -135,12 +322,116 @@ def map_channel(channel_value, max_values):
     return mapped_value
 
 
+def packed_to_hex(packed):
+    """
+    Transform packed 0xRRGGBB colors into HEX.
+
+    Works on whole arrays at once, without formatting colors one by one.
+
+    Parameters
+    ----------
+    packed : array_like
+        Packed colors
+
+    Returns
+    -------
+    HEX_colors : numpy.ndarray
+        Array of '#RRGGBB' strings with the shape of packed
+    """
+    packed = np.asarray(packed, dtype=np.uint32)
+
+    chars = np.empty(packed.shape + (7,), dtype=np.uint8)
+    chars[..., 0] = ord('#')
+    for i in range(6):
+        chars[..., 6 - i] = HEX_DIGITS[(packed >> np.uint32(4*i)) & np.uint32(15)]
+
+    return chars.view('S7')[..., 0].astype('U7')
+
+
+def packed_to_rgb(packed):
+    """
+    Transform packed 0xRRGGBB colors into RGB channels.
+
+    Parameters
+    ----------
+    packed : array_like
+        Packed colors
+
+    Returns
+    -------
+    colors : numpy.ndarray
+        uint8 array with an extra last dimension for the RGB channels
+    """
+    packed = np.asarray(packed, dtype=np.uint32)
+    shifts = np.array([16, 8, 0], dtype=np.uint32)
+
+    return ((packed[..., None] >> shifts) & np.uint32(255)).astype(np.uint8)
+
+
+def pad_img(image, height, width):
+    """
+    Fit an image into a fixed size box keeping ratio.
+
+    The image is resized to the largest size that fits in the box and centered on a black background.
+
+    Parameters
+    ----------
+    image : numpy.ndarray
+        Image to fit
+    height : int
+        Height of the box in pixels
+    width : int
+        Width of the box in pixels
+
+    Returns
+    -------
+    img_pad : numpy.ndarray
+        Image with the dimensions of the box
+    """
+    scale = min(height/image.shape[0], width/image.shape[1])
+    new_height = max(1, min(height, round(image.shape[0]*scale)))
+    new_width = max(1, min(width, round(image.shape[1]*scale)))
+
+    img = image
+    if (new_height, new_width) != image.shape[:2]:
+        img = cv2.resize(image, dsize=(new_width, new_height), interpolation=cv2.INTER_AREA)
+
+    # Center the image in the box
+    img_pad = np.zeros((height, width) + image.shape[2:], dtype=image.dtype)
+    top = (height - new_height)//2
+    left = (width - new_width)//2
+    img_pad[top:top + new_height, left:left + new_width] = img
+
+    return img_pad
+
+
+def palette_index(image, max_values):
+    """
+    Map every pixel of an image to its index in the reduced palette.
+
+    Parameters
+    ----------
+    image : numpy.ndarray
+        Image in RGB color mode
+    max_values : int
+        Number of possible values for each RGB channel. At most 6 so indexes fit in one byte
+
+    Returns
+    -------
+    index_map : numpy.ndarray
+        uint8 array with the shape of the image without channels. See get_palette
+    """
+    levels = _channel_levels(image, max_values).astype(np.uint8)
+
+    return (levels[..., 0]*max_values + levels[..., 1])*max_values + levels[..., 2]
+
+
 def reduce_col_palette(image, max_values, info=False):
     """
     Map all pixels of an image to a reduced palette.
 
-    This function iterates through every pixel of an image to map each
-    color to a reduced palette.
+    This function maps every channel of every pixel of an image to the
+    closest value of a reduced palette, the same way map_channel does.
 
     In standard RGB color mode, every channel has a value between 0 and 255.
     This results in 256x256x256 colors, this is more than 16M.
@@ -162,15 +453,8 @@ def reduce_col_palette(image, max_values, info=False):
     img : numpy.ndarray
         Image with a reduced color palette
     """
-    # Collapse image into one dimension
-    img = image.flatten()
-
-    # Iterate the array to transform the value of each channel in the pixels
-    for i, channel_val in enumerate(img):
-        img[i] = map_channel(channel_val, max_values)
-
-    # Restore image shape
-    img = np.reshape(img, image.shape)
+    # Map every channel value to the closest value in one pass
+    img = _channel_values(max_values)[_channel_levels(image, max_values)].astype(image.dtype)
 
     # Inform user
     if info:
@@ -179,6 +463,38 @@ def reduce_col_palette(image, max_values, info=False):
     return img
 
 
+def save_img_indexed(image_path, image, max_values=5):
+    """
+    Save a reduced palette image as palette-indexed data.
+
+    Images reduced with reduce_col_palette have at most max_values**3 colors, so they are saved losslessly as one
+    byte per pixel: an 8-bit indexed PNG (.png) or a raw uint8 index map (.npy) that uses the palette returned by
+    get_palette. Load them back with get_img_indexed.
+
+    Parameters
+    ----------
+    image_path : str
+        Path of the image (.png or .npy)
+    image : numpy.ndarray
+        Image in RGB color mode with a reduced palette
+    max_values : int
+        Number of possible values for each RGB channel
+    """
+    index_map = palette_index(image, max_values)
+
+    if image_path.endswith('.npy'):
+        np.save(image_path, index_map)
+        return None
+
+    from PIL import Image
+
+    img = Image.frombytes('P', (index_map.shape[1], index_map.shape[0]), np.ascontiguousarray(index_map).tobytes())
+    img.putpalette(get_palette(max_values).ravel().tolist())
+    img.save(image_path, optimize=True)
+
+    return None
+
+
 def resize_img(image, height):
     """
     Resize image keeping ratio.
@@ -221,6 +537,48 @@ def rgb_to_hex(color):
     return HEX_color
 
 
+def rgb_to_lab(colors):
+    """
+    Convert RGB colors to CIELAB (D65 white point), where euclidean distances match perceived color differences.
+
+    Parameters
+    ----------
+    colors : array_like
+        RGB colors from 0 to 255, channels in the last dimension
+
+    Returns
+    -------
+    colors : numpy.ndarray
+        float64 L (0 to 100), a and b values
+    """
+    colors = np.asarray(colors, dtype=np.float32)/255
+    lab = cv2.cvtColor(colors.reshape(-1, 1, 3), cv2.COLOR_RGB2Lab).reshape(colors.shape)
+
+    return lab.astype(np.float64)
+
+
+def rgb_to_packed(colors):
+    """
+    Pack RGB colors into 0xRRGGBB integers.
+
+    A packed color takes 4 bytes instead of three float64 channels and two
+    palettes are compared with single integer operations.
+
+    Parameters
+    ----------
+    colors : array_like
+        RGB colors, channels in the last dimension
+
+    Returns
+    -------
+    packed : numpy.ndarray
+        uint32 array with the shape of colors without the last dimension
+    """
+    channels = np.clip(np.rint(np.asarray(colors, dtype=np.float64)), 0, 255).astype(np.uint32)
+
+    return (channels[..., 0] << np.uint32(16)) | (channels[..., 1] << np.uint32(8)) | channels[..., 2]
+
+
 def square_img(image, height):
     """
     Resize image to a square ratio.
@@ -256,6 +614,9 @@ def plot_colors(HEX_indexes):
     fig : Figure
         Color chart
     """
+    plt = get_pyplot()
+    from matplotlib.patches import Rectangle
+
     # Get HEX colors names without '#'
     color_names = HEX_indexes
 
@@ -315,7 +676,60 @@ def plot_colors(HEX_indexes):
 
     return fig
 
+
+def _channel_levels(image, max_values):
+    """
+    Get the position of the closest reduced palette value for every channel of an image.
+    """
+    values = _channel_values(max_values)
+
+    if image.dtype == np.uint8:
+        # Look-up table with the level of every possible channel value
+        lut = np.abs(np.arange(256)[:, None] - values).argmin(axis=1)
+        return lut[image]
+
+    return np.abs(np.asarray(image)[..., None] - values).argmin(axis=-1)
+
+
+def _channel_values(max_values):
+    """
+    Get the possible values of a channel in a reduced palette, as map_channel does.
+    """
+    step = (255/(max_values - 1))
+
+    return np.fix(np.arange(0, 256, step))
+
+
+def _lab_kmeans(pixels, num_of_colors, max_values, init, settings):
+    """
+    Cluster pixels in CIELAB through the unique colors of the reduced palette, weighted by their pixel counts.
+    """
+    codes = palette_index(pixels, max_values).ravel()
+    counts = np.bincount(codes, minlength=max_values**3)
+    present = np.flatnonzero(counts)
+    palette = get_palette_lab(max_values)
+
+    if len(present) <= num_of_colors:
+        # Every unique color is a cluster, the clusters left are empty
+        unique_labels = np.arange(len(present))
+        centers = palette[np.resize(present, num_of_colors)]
+    else:
+        unique_labels, centers = kmeans(palette[present], num_of_colors,
+                                        init=None if init is None else rgb_to_lab(init),
+                                        sample_weight=counts[present], **settings)
+
+    # Pixels take the cluster of their color
+    lookup = np.zeros(len(counts), dtype=np.int64)
+    lookup[present] = unique_labels
+
+    return lookup[codes], lab_to_rgb(centers)
+
 # VARIABLES
+# ASCII codes of the HEX digits and value of every ASCII code as HEX digit
+HEX_DIGITS = np.frombuffer(b'0123456789ABCDEF', dtype=np.uint8)
+HEX_DIGITS_VALUES = np.zeros(256, dtype=np.uint32)
+HEX_DIGITS_VALUES[HEX_DIGITS] = np.arange(16)
+HEX_DIGITS_VALUES[np.frombuffer(b'abcdef', dtype=np.uint8)] = np.arange(10, 16)
 
 
 # EXECUTION
@@ -0,0 +1,289 @@
+"""
+Contains the functions used to load and downsample very large images within a memory budget
+"""
+# IMPORTS
+import struct
+import threading
+from contextlib import contextmanager
+
+import cv2
+
+from utils.archives import open_img_file, read_img
+
+
+# FUNCTIONS
+def get_img_size(image_path):
+    """
+    Read the size of an image from its header, without decoding it.
+
+    JPEG and PNG headers are parsed directly, so scans above the decompression bomb limit of PIL are measured too.
+    Other formats are opened with PIL with the limit lifted.
+
+    Parameters
+    ----------
+    image_path : str
+        Path of the image, or "<archive path>::<member name>"
+
+    Returns
+    -------
+    size : tuple
+        Width, height and format of the image (JPEG, PNG...)
+    """
+    with open_img_file(image_path) as file:
+        size = _read_header_size(file)
+        if size is not None:
+            return size
+
+        file.seek(0)
+        with _unlimited_pixels():
+            from PIL import Image
+
+            with Image.open(file) as img:
+                return img.width, img.height, img.format
+
+
+def decoded_bytes(width, height, reduction=1):
+    """
+    Memory needed to decode an image in BGR color mode.
+
+    Parameters
+    ----------
+    width : int
+        Width of the image in pixels
+    height : int
+        Height of the image in pixels
+    reduction : int
+        Scale denominator of the decoding (1, 2, 4 or 8)
+
+    Returns
+    -------
+    nbytes : int
+        Size of the decoded array
+    """
+    return -(-width // reduction) * -(-height // reduction) * 3
+
+
+def get_reduction(width, height, img_format, max_bytes, min_width=0, min_height=0):
+    """
+    Choose the smallest decoding scale that fits an image in max_bytes.
+
+    Only JPEG images are decoded at a reduced scale, by skipping high frequencies of the DCT, so they never exist in
+    memory at full resolution. Other formats are always decoded whole. Scales that would leave the image smaller than
+    the final size are not used.
+
+    Parameters
+    ----------
+    width : int
+        Width of the image in pixels
+    height : int
+        Height of the image in pixels
+    img_format : str
+        Format returned by get_img_size
+    max_bytes : int
+        Maximum size of the decoded image
+    min_width : int
+        Width of the downsampled image
+    min_height : int
+        Height of the downsampled image
+
+    Returns
+    -------
+    reduction : int
+        Scale denominator of the decoding (1, 2, 4 or 8)
+    """
+    if img_format != 'JPEG':
+        return 1
+
+    reduction = 1
+    for candidate in REDUCED_FLAGS:
+        if width // candidate < min_width or height // candidate < min_height:
+            break
+
+        reduction = candidate
+        if decoded_bytes(width, height, candidate) <= max_bytes:
+            break
+
+    return reduction
+
+
+def load_img_resized(image_path, height, square=False, budget=None):
+    """
+    Import an image in RGB mode and resize it as resize_img or square_img do, keeping memory bounded.
+
+    The image is resized in the BGR mode OpenCV decodes to and only the small result is converted to RGB, so no
+    second full-size copy is made. With a budget, the image waits until its decoded size fits in the memory left and
+    images too big for budget.max_image_bytes are decoded at a reduced JPEG scale. Images decoded at full scale give
+    the same result as get_img_rgb followed by resize_img; reduced ones differ by a few intensity levels.
+
+    Parameters
+    ----------
+    image_path : str
+        Path of the image, or "<archive path>::<member name>"
+    height : int
+        Desired height in pixels
+    square : bool
+        Whether to transform the image into a square
+    budget : MemoryBudget
+        Memory shared by the images being loaded
+
+    Returns
+    -------
+    image : numpy.ndarray
+        Image in RGB color mode with desired height
+    """
+    if budget is None:
+        img = read_img(image_path)
+        return cv2.cvtColor(_resize(img, height, square), cv2.COLOR_BGR2RGB)
+
+    img_width, img_height, img_format = get_img_size(image_path)
+    width = height if square else int(height/(img_height/img_width))
+    reduction = get_reduction(img_width, img_height, img_format, budget.max_image_bytes, width, height)
+
+    with budget.reserve(decoded_bytes(img_width, img_height, reduction)):
+        img = read_img(image_path, REDUCED_FLAGS[reduction])
+        img = _resize(img, height, square)
+
+    return cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
+
+
+def _resize(image, height, square):
+    """
+    Resize with the same rounding as resize_img and square_img.
+    """
+    if square:
+        width = height
+    else:
+        width = int(height/(image.shape[0]/image.shape[1]))
+
+    return cv2.resize(image, dsize=(width, height), interpolation=cv2.INTER_AREA)
+
+
+def _read_header_size(file):
+    """
+    Width, height and format of a JPEG or PNG file from its header, None for other formats.
+    """
+    signature = file.read(8)
+
+    if signature == PNG_SIGNATURE:
+        # The IHDR chunk always comes first: length, type, width and height
+        chunk = file.read(16)
+        if len(chunk) == 16 and chunk[4:8] == b'IHDR':
+            width, height = struct.unpack('>2L', chunk[8:16])
+            return width, height, 'PNG'
+        return None
+
+    if signature[:2] != b'\xff\xd8':
+        return None
+
+    file.seek(2)
+    while True:
+        byte = file.read(1)
+        if byte != b'\xff':
+            return None
+        while byte == b'\xff':
+            # Markers may be padded with fill bytes
+            byte = file.read(1)
+        if not byte:
+            return None
+
+        marker = byte[0]
+        if marker in JPEG_STANDALONE_MARKERS:
+            continue
+
+        length = file.read(2)
+        if len(length) < 2:
+            return None
+
+        if marker in JPEG_SOF_MARKERS:
+            frame = file.read(5)
+            if len(frame) < 5:
+                return None
+            height, width = struct.unpack('>2H', frame[1:5])
+            return width, height, 'JPEG'
+
+        file.seek(struct.unpack('>H', length)[0] - 2, 1)
+
+
+@contextmanager
+def _unlimited_pixels():
+    """
+    Lift the decompression bomb limit of PIL while the block runs.
+    """
+    from PIL import Image
+
+    with _PIL_LIMIT_LOCK:
+        limit, Image.MAX_IMAGE_PIXELS = Image.MAX_IMAGE_PIXELS, None
+        try:
+            yield
+        finally:
+            Image.MAX_IMAGE_PIXELS = limit
+
+
+# CLASSES
+class MemoryBudget:
+    """
+    Limit the memory used by images decoded at the same time.
+
+    Threads reserve the decoded size of an image before reading it and wait while the reservations in flight would
+    exceed max_bytes. An image bigger than the whole budget runs alone.
+
+    Parameters
+    ----------
+    max_bytes : int
+        Memory shared by all the images in flight
+    max_image_bytes : int
+        Maximum decoded size of one image, bigger JPEG images are decoded at a reduced scale. Defaults to max_bytes
+    """
+    def __init__(self, max_bytes=512 * 2**20, max_image_bytes=None):
+        self.max_bytes = max_bytes
+        self.max_image_bytes = max_image_bytes or max_bytes
+
+        self.in_use = 0
+        self.peak = 0
+        self.waits = 0
+        self._condition = threading.Condition()
+
+    @contextmanager
+    def reserve(self, nbytes):
+        """
+        Hold nbytes of the budget while the block runs.
+        """
+        with self._condition:
+            if self.in_use and self.in_use + nbytes > self.max_bytes:
+                self.waits += 1
+                self._condition.wait_for(lambda: not self.in_use or self.in_use + nbytes <= self.max_bytes)
+
+            self.in_use += nbytes
+            self.peak = max(self.peak, self.in_use)
+
+        try:
+            yield
+        finally:
+            with self._condition:
+                self.in_use -= nbytes
+                self._condition.notify_all()
+
+
+# VARIABLES
+# OpenCV reading flags by scale denominator
+REDUCED_FLAGS = {1: cv2.IMREAD_COLOR,
+                 2: cv2.IMREAD_REDUCED_COLOR_2,
+                 4: cv2.IMREAD_REDUCED_COLOR_4,
+                 8: cv2.IMREAD_REDUCED_COLOR_8}
+
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+
+# Start of frame markers of every JPEG coding process, and markers without a length
+JPEG_SOF_MARKERS = {0xc0, 0xc1, 0xc2, 0xc3, 0xc5, 0xc6, 0xc7, 0xc9, 0xca, 0xcb, 0xcd, 0xce, 0xcf}
+JPEG_STANDALONE_MARKERS = {0x01, *range(0xd0, 0xd9)}
+
+_PIL_LIMIT_LOCK = threading.Lock()
+
+
+# EXECUTION
+
+
+# OUTPUT
+
+
+# END OF FILE
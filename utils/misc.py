@@ -2,9 +2,71 @@
 Contains handy functions written for this project
 """
 # IMPORTS
+import os
+import subprocess
+import sys
 
 
 # FUNCTIONS
+def get_pyplot():
+    """
+    Import matplotlib.pyplot on demand
+
+    Plotting is only needed to show charts, so it is not imported until then.
+    In headless mode the non-interactive Agg backend is selected first.
+
+    Returns
+    -------
+    plt : module
+        matplotlib.pyplot
+    """
+    import matplotlib
+
+    if is_headless():
+        matplotlib.use('Agg')
+
+    import matplotlib.pyplot as plt
+
+    return plt
+
+
+def import_time(module_name):
+    """
+    Measure the time needed to import a module in a fresh interpreter
+
+    Parameters
+    ----------
+    module_name : str
+        Module to import, e.g. utils.data_handling
+
+    Returns
+    -------
+    seconds : float
+        Import time in seconds
+    """
+    code = ('import time; start = time.perf_counter(); '
+            f'import {module_name}; print(time.perf_counter() - start)')
+    output = subprocess.run([sys.executable, '-c', code], capture_output=True, check=True, text=True,
+                            cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+    return float(output.stdout.strip())
+
+
+def is_headless():
+    """
+    Whether charts must not be shown
+
+    Headless mode is set with the MUSEUM_HEADLESS environment variable or by
+    assigning utils.misc.HEADLESS.
+
+    Returns
+    -------
+    headless : bool
+        True on headless mode
+    """
+    return HEADLESS
+
+
 def infinite_sequence():
     """
     Yields an infinite sequence of numbers
@@ -41,6 +103,7 @@ def mklist(n):
 
 
 # VARIABLES
+HEADLESS = os.environ.get('MUSEUM_HEADLESS', '0').lower() not in ('', '0', 'false')
 
 
 # EXECUTION
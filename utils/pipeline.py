@@ -0,0 +1,240 @@
+"""
+Contains the functions used to run processing stages as a pipeline of threads with bounded queues
+"""
+# IMPORTS
+import queue
+import threading
+import time
+
+
+# FUNCTIONS
+def run_pipeline(items, stages, queue_size=8, ordered=True):
+    """
+    Run items through a sequence of stages, every stage in its own threads.
+
+    Stages are connected by bounded queues: a stage that gets ahead blocks when the next queue is full
+    (back-pressure), so memory stays bounded and every stage works while the others wait on I/O. OpenCV, NumPy and
+    file I/O release the GIL, so a reader stage overlaps with the compute stage even on one core.
+
+    Parameters
+    ----------
+    items : iterable
+        Tuples (key, payload) to process
+    stages : list
+        Stage objects. The payload returned by a stage is the input of the next one. A stage returning None drops
+        the item
+    queue_size : int
+        Maximum number of items waiting before every stage
+    ordered : bool
+        Whether stages with one worker get items in input order, even if previous stages have several workers. The
+        last stage must then have one worker
+
+    Returns
+    -------
+    metrics : dict
+        Metrics of every stage by name, plus the errors raised as (key, stage name, exception) tuples
+    """
+    queues = [queue.Queue(maxsize=queue_size) for _ in stages]
+    errors = []
+    threads = []
+
+    for i, stage in enumerate(stages):
+        stage.reset()
+        next_queue = queues[i + 1] if i + 1 < len(stages) else None
+        next_workers = stages[i + 1].workers if next_queue is not None else 0
+        unordered = any(s.workers > 1 for s in stages[:i])
+        if ordered and unordered and next_queue is None and stage.workers > 1:
+            raise ValueError('The last stage of an ordered pipeline must have one worker')
+        reorder = ordered and unordered and stage.workers == 1
+        pending = [stage.workers]
+
+        for _ in range(stage.workers):
+            threads.append(threading.Thread(target=_run_stage, daemon=True,
+                                            args=(stage, queues[i], next_queue, next_workers, pending, errors,
+                                                  reorder)))
+
+    for thread in threads:
+        thread.start()
+
+    # Feed the first stage, blocking when it is full
+    first = stages[0]
+    for seq, (key, payload) in enumerate(items):
+        first.put(queues[0], (seq, key, payload))
+    for _ in range(first.workers):
+        queues[0].put(_END)
+
+    for thread in threads:
+        thread.join()
+
+    metrics = {stage.name: stage.metrics() for stage in stages}
+    metrics['errors'] = errors
+
+    return metrics
+
+
+def format_metrics(metrics):
+    """
+    Summarize pipeline metrics in a few lines, bottleneck first.
+
+    Parameters
+    ----------
+    metrics : dict
+        Metrics returned by run_pipeline
+
+    Returns
+    -------
+    summary : str
+        One line per stage
+    """
+    stages = {name: value for name, value in metrics.items() if name != 'errors'}
+    lines = []
+
+    for name, value in sorted(stages.items(), key=lambda item: -item[1]['utilization']):
+        lines.append(f'{name}: {value["items"]} items, busy {value["utilization"]:.0%}, '
+                     f'waiting for input {value["starved_secs"]:.2f}s, '
+                     f'blocked by next stage {value["blocked_secs"]:.2f}s, '
+                     f'queue depth {value["queue_depth_mean"]:.1f} (max {value["queue_depth_max"]})')
+
+    return '\n'.join(lines)
+
+
+def _run_stage(stage, in_queue, out_queue, out_workers, pending, errors, reorder):
+    """
+    Worker thread of a stage.
+    """
+    waiting = {}
+    next_seq = [0]
+
+    while True:
+        start = time.perf_counter()
+        depth = in_queue.qsize()
+        task = in_queue.get()
+        stage.record_wait(time.perf_counter() - start, depth)
+
+        if task is _END:
+            break
+
+        seq, key, payload = task
+        if reorder:
+            # Hold items until all previous ones arrived
+            waiting[seq] = (key, payload)
+            while next_seq[0] in waiting:
+                _process(stage, next_seq[0], *waiting.pop(next_seq[0]), out_queue, errors)
+                next_seq[0] += 1
+        else:
+            _process(stage, seq, key, payload, out_queue, errors)
+
+    # Items dropped upstream leave gaps, flush what is left in order
+    for seq in sorted(waiting):
+        _process(stage, seq, *waiting[seq], out_queue, errors)
+
+    with stage.lock:
+        pending[0] -= 1
+        last = pending[0] == 0
+
+    if last and out_queue is not None:
+        for _ in range(out_workers):
+            out_queue.put(_END)
+
+
+def _process(stage, seq, key, payload, out_queue, errors):
+    """
+    Apply a stage function to one item and pass the result on.
+    """
+    result = None
+
+    if payload is not _DROPPED:
+        start = time.perf_counter()
+        try:
+            result = stage.function(payload)
+        except (BaseException, Exception) as error:
+            errors.append((key, stage.name, error))
+        stage.record_busy(time.perf_counter() - start)
+
+    if out_queue is not None:
+        # Dropped items still move on so ordered stages don't wait for them
+        stage.put(out_queue, (seq, key, _DROPPED if result is None else result))
+
+
+# CLASSES
+class Stage:
+    """
+    A step of a pipeline.
+
+    Parameters
+    ----------
+    name : str
+        Name of the stage in the metrics
+    function : callable
+        Function applied to the payload of every item
+    workers : int
+        Number of threads running the stage
+    """
+    def __init__(self, name, function, workers=1):
+        self.name = name
+        self.function = function
+        self.workers = workers
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        """
+        Clear the metrics before a new run.
+        """
+        self.items = 0
+        self.busy = 0.
+        self.starved = 0.
+        self.blocked = 0.
+        self.depth_sum = 0
+        self.depth_max = 0
+        self.started = time.perf_counter()
+
+    def put(self, out_queue, task):
+        """
+        Put a task in the next queue, recording the time blocked by back-pressure.
+        """
+        start = time.perf_counter()
+        out_queue.put(task)
+        with self.lock:
+            self.blocked += time.perf_counter() - start
+
+    def record_wait(self, seconds, depth):
+        with self.lock:
+            self.starved += seconds
+            self.depth_sum += depth
+            self.depth_max = max(self.depth_max, depth)
+
+    def record_busy(self, seconds):
+        with self.lock:
+            self.items += 1
+            self.busy += seconds
+
+    def metrics(self):
+        """
+        Metrics of the stage since the pipeline started.
+        """
+        elapsed = max(time.perf_counter() - self.started, 1e-9)
+
+        return {'items': self.items,
+                'workers': self.workers,
+                'busy_secs': round(self.busy, 4),
+                'starved_secs': round(self.starved, 4),
+                'blocked_secs': round(self.blocked, 4),
+                'utilization': self.busy/(elapsed*self.workers),
+                'queue_depth_mean': self.depth_sum/max(1, self.items),
+                'queue_depth_max': self.depth_max}
+
+
+# VARIABLES
+# Markers of the end of the items and of items dropped by a stage
+_END = object()
+_DROPPED = object()
+
+
+# EXECUTION
+
+
+# OUTPUT
+
+
+# END OF FILE
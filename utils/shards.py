@@ -0,0 +1,239 @@
+"""
+Contains the functions used to pack processed collections into sequential tar shards
+"""
+# IMPORTS
+import io
+import json
+import os
+import tarfile
+from csv import reader, writer
+
+import cv2
+import numpy as np
+
+
+# FUNCTIONS
+def iter_shards(shard_paths):
+    """
+    Stream the samples of a list of shards.
+
+    Shards are read as tar streams, so files are only read forward in big sequential chunks. Members of a sample
+    are grouped by their name without extension, WebDataset style.
+
+    Parameters
+    ----------
+    shard_paths : list
+        Paths of the shards, in reading order
+
+    Yield
+    -----
+    sample : tuple
+        Key, image in RGB color mode and features row of a sample
+    """
+    for shard_path in shard_paths:
+        with tarfile.open(shard_path, mode='r|') as tar:
+            key, members = None, {}
+
+            for member in tar:
+                member_key, extension = os.path.splitext(member.name)
+
+                if member_key != key and members:
+                    yield _decode_sample(key, members)
+                    members = {}
+
+                key = member_key
+                members[extension] = tar.extractfile(member).read()
+
+            if members:
+                yield _decode_sample(key, members)
+
+
+def load_shard_index(index_path):
+    """
+    Load the index written by a ShardWriter.
+
+    Parameters
+    ----------
+    index_path : str
+        Path of the index file
+
+    Returns
+    -------
+    index : dict
+        Shard, offset and size of every member of every sample, by key. Shard paths are absolute
+    """
+    with open(index_path) as file:
+        index = json.load(file)
+
+    shard_dir = os.path.dirname(os.path.abspath(index_path))
+    for members in index.values():
+        for member in members.values():
+            member['shard'] = os.path.join(shard_dir, member['shard'])
+
+    return index
+
+
+def read_sample(index, key):
+    """
+    Read one sample from its shard without scanning it.
+
+    Parameters
+    ----------
+    index : dict
+        Index returned by load_shard_index
+    key : str
+        Key of the sample (the image name)
+
+    Returns
+    -------
+    sample : tuple
+        Key, image in RGB color mode and features row of the sample
+    """
+    members = {}
+
+    for extension, member in index[key].items():
+        with open(member['shard'], 'rb') as file:
+            file.seek(member['offset'])
+            members[extension] = file.read(member['size'])
+
+    return _decode_sample(key, members)
+
+
+def _decode_sample(key, members):
+    """
+    Decode the raw members of a sample.
+    """
+    img = None
+    features = None
+
+    for extension, data in members.items():
+        if extension == '.csv':
+            features = next(reader(io.StringIO(data.decode('utf-8'))))
+        else:
+            img = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_COLOR)
+            img = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
+
+    return key, img, features
+
+
+def _tar_padded(size):
+    """
+    Size of a member's data once padded to tar blocks.
+    """
+    return -(-size // 512) * 512
+
+
+# CLASSES
+class ShardWriter:
+    """
+    Sink that packs processed images and their features rows into fixed-size tar shards.
+
+    Every sample is stored as two consecutive members, "<key><image_format>" and "<key>.csv". A new shard is started
+    when the current one would exceed max_size bytes or max_count samples. An index with the position of every member
+    is written next to the shards when the writer is closed, so samples can also be read randomly with read_sample.
+
+    Parameters
+    ----------
+    path : str
+        Path prefix of the shards. Shards are named "<path>-000000.tar", "<path>-000001.tar"... and the index
+        "<path>-index.json"
+    max_size : int
+        Maximum size of a shard in bytes
+    max_count : int
+        Maximum number of samples in a shard
+    image_format : str
+        Extension of the format used to encode images (.jpg, .png)
+    """
+    def __init__(self, path, max_size=256 * 2**20, max_count=10000, image_format='.jpg'):
+        self.path = path
+        self.max_size = max_size
+        self.max_count = max_count
+        self.image_format = image_format
+
+        self.shards = []
+        self.index = {}
+        self._tar = None
+        self._count = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def write(self, key, image, features):
+        """
+        Add a sample to the current shard.
+
+        Parameters
+        ----------
+        key : str
+            Key of the sample, usually the image name
+        image : numpy.ndarray
+            Image in RGB color mode
+        features : list
+            Features row of the image
+        """
+        img_bytes = cv2.imencode(self.image_format, cv2.cvtColor(image, cv2.COLOR_RGB2BGR))[1].tobytes()
+
+        row = io.StringIO()
+        writer(row).writerow(features)
+        row_bytes = row.getvalue().encode('utf-8')
+
+        # Two headers plus both members padded to tar blocks
+        sample_size = 2*512 + _tar_padded(len(img_bytes)) + _tar_padded(len(row_bytes))
+
+        if self._tar is None or self._count >= self.max_count or \
+                (self._count and self._tar.offset + sample_size > self.max_size):
+            self._next_shard()
+
+        self.index[key] = {self.image_format: self._add_member(key + self.image_format, img_bytes),
+                           '.csv': self._add_member(key + '.csv', row_bytes)}
+        self._count += 1
+
+    def close(self):
+        """
+        Close the current shard and write the index.
+        """
+        if self._tar is not None:
+            self._tar.close()
+            self._tar = None
+
+        with open(f'{self.path}-index.json', 'w') as file:
+            json.dump(self.index, file)
+
+    def _next_shard(self):
+        """
+        Close the current shard and start a new one.
+        """
+        if self._tar is not None:
+            self._tar.close()
+
+        shard_path = f'{self.path}-{len(self.shards):06d}.tar'
+        self.shards.append(shard_path)
+        self._tar = tarfile.open(shard_path, mode='w', format=tarfile.USTAR_FORMAT)
+        self._count = 0
+
+    def _add_member(self, name, data):
+        """
+        Append a member to the current shard and return its position.
+        """
+        info = tarfile.TarInfo(name)
+        info.size = len(data)
+        self._tar.addfile(info, io.BytesIO(data))
+
+        return {'shard': os.path.basename(self._tar.name),
+                'offset': self._tar.offset - _tar_padded(len(data)),
+                'size': len(data)}
+
+
+# VARIABLES
+
+
+# EXECUTION
+
+
+# OUTPUT
+
+
+# END OF FILE
@@ -0,0 +1,215 @@
+"""
+Contains the functions used to find the paintings of a museum most similar to a given one
+"""
+# IMPORTS
+import numpy as np
+
+from utils.data_handling import parse_features, process_image, read_collection_data
+from utils.image_processing import get_img_rgb, resize_img, square_img
+
+
+# FUNCTIONS
+def get_img_features(image_path, resize_height=150, square=False):
+    """
+    Extract the features vector of an image as process_collection does.
+
+    Parameters
+    ----------
+    image_path : str
+        Path of the image
+    resize_height : int
+        Height in pixels the image is resized to, use the one of the indexed collection
+    square : bool
+        Whether to transform the image into a square
+
+    Returns
+    -------
+    features : numpy.ndarray
+        float32 array as returned by parse_features
+    """
+    img = get_img_rgb(image_path)
+    img = square_img(img, resize_height) if square else resize_img(img, resize_height)
+    _, features = process_image(img, color_mode='PACKED')
+
+    return parse_features(['', ''] + features)
+
+
+# CLASSES
+class SimilarityIndex:
+    """
+    Nearest neighbour index over the features of processed collections.
+
+    Vectors are dim_ratio, chiaroscuro, whitespace_ratio and the RGB channels of the ordered palette. Every column
+    is standardized so ratios and colors weigh the same, then multiplied by its weight. Queries are answered by
+    brute force with one matrix product per batch of queries, or with a scikit-learn KD-tree or ball tree.
+
+    Parameters
+    ----------
+    features : numpy.ndarray
+        Features vectors of shape (N, num_of_features), shorter vectors padded with zeros
+    keys : list
+        Image names of the vectors
+    labels : list
+        Labels of the vectors
+    weights : array_like
+        Weight of every column after standardization. Defaults to ones
+    tree : str
+        None for brute force, 'kd' or 'ball' for a scikit-learn tree
+    """
+    def __init__(self, features, keys, labels=None, weights=None, tree=None):
+        features = np.asarray(features, dtype=np.float32)
+
+        self.keys = np.asarray(keys)
+        self.labels = np.asarray(labels if labels is not None else [''] * len(keys))
+        self.mean = features.mean(axis=0)
+        self.scale = features.std(axis=0)
+        self.scale[self.scale == 0] = 1
+        self.weights = np.ones(features.shape[1], dtype=np.float32) if weights is None else \
+            np.asarray(weights, dtype=np.float32)
+        self.tree = tree
+
+        self.features = features
+        self.vectors = self.transform(features)
+        self._norms = np.einsum('ij,ij->i', self.vectors, self.vectors)
+        self._tree = None
+
+        if tree is not None:
+            from sklearn.neighbors import BallTree, KDTree
+
+            self._tree = (KDTree if tree == 'kd' else BallTree)(self.vectors)
+
+    def __len__(self):
+        return len(self.keys)
+
+    @classmethod
+    def from_collection(cls, path, **kwargs):
+        """
+        Build an index from the CSV files saved by process_collection.
+
+        Parameters
+        ----------
+        path : str
+            Folder with one sub folder per label, as read by read_collection_data
+        kwargs
+            Arguments of SimilarityIndex
+
+        Returns
+        -------
+        index : SimilarityIndex
+            Index of every row
+        """
+        rows = read_collection_data(path)
+        vectors = [parse_features(row) for row in rows]
+        features = np.zeros((len(rows), max((len(i) for i in vectors), default=0)), dtype=np.float32)
+        for i, vector in enumerate(vectors):
+            features[i, :len(vector)] = vector
+
+        return cls(features, [row[1] for row in rows], [row[0] for row in rows], **kwargs)
+
+    @classmethod
+    def load(cls, index_path):
+        """
+        Load an index saved with save.
+        """
+        with np.load(index_path) as data:
+            tree = str(data['tree']) or None
+            index = cls(data['features'], data['keys'], data['labels'], data['weights'], tree)
+
+        return index
+
+    def save(self, index_path):
+        """
+        Save the index as a .npz file. Trees are rebuilt when loading.
+        """
+        np.savez(index_path, features=self.features, keys=self.keys, labels=self.labels, weights=self.weights,
+                 tree=self.tree or '')
+
+    def transform(self, features):
+        """
+        Standardize and weigh raw features vectors, padding or cutting them to the index size.
+        """
+        features = np.atleast_2d(np.asarray(features, dtype=np.float32))
+        vectors = np.zeros((len(features), len(self.mean)), dtype=np.float32)
+        size = min(features.shape[1], vectors.shape[1])
+        vectors[:, :size] = features[:, :size]
+
+        return (vectors - self.mean) / self.scale * self.weights
+
+    def query(self, features, k=20, batch_size=256):
+        """
+        Find the k closest paintings of every features vector.
+
+        Parameters
+        ----------
+        features : array_like
+            Raw features vectors of shape (M, num_of_features), or a single vector
+        k : int
+            Number of neighbours
+        batch_size : int
+            Queries compared at once in brute force mode, bounds memory to batch_size x N distances
+
+        Returns
+        -------
+        distances : numpy.ndarray
+            Euclidean distances of shape (M, k), closest first
+        keys : numpy.ndarray
+            Image names of the neighbours of shape (M, k)
+        """
+        distances, indexes = self._search(self.transform(features), min(k, len(self)), batch_size)
+
+        return distances, self.keys[indexes]
+
+    def query_image(self, image_path, k=20, resize_height=150, square=False):
+        """
+        Find the k paintings closest to an image, extracting its features once.
+
+        Returns
+        -------
+        neighbours : list
+            Tuples (image name, label, distance), closest first
+        """
+        queries = self.transform(get_img_features(image_path, resize_height, square))
+        distances, indexes = self._search(queries, min(k, len(self)))
+
+        return [(str(self.keys[i]), str(self.labels[i]), float(distance))
+                for i, distance in zip(indexes[0], distances[0])]
+
+    def _search(self, queries, k, batch_size=256):
+        """
+        Distances and positions of the k closest vectors to standardized queries.
+        """
+        if self._tree is not None:
+            distances, indexes = self._tree.query(queries, k=k)
+            return distances.astype(np.float32), indexes
+
+        distances = np.empty((len(queries), k), dtype=np.float32)
+        indexes = np.empty((len(queries), k), dtype=np.int64)
+
+        for start in range(0, len(queries), batch_size):
+            batch = queries[start:start + batch_size]
+
+            # Squared distances as |q|^2 + |x|^2 - 2 q.x
+            squared = self._norms[None, :] - 2 * batch @ self.vectors.T
+            squared += np.einsum('ij,ij->i', batch, batch)[:, None]
+
+            closest = np.argpartition(squared, k - 1, axis=1)[:, :k]
+            closest_squared = np.take_along_axis(squared, closest, axis=1)
+            order = np.argsort(closest_squared, axis=1)
+
+            indexes[start:start + len(batch)] = np.take_along_axis(closest, order, axis=1)
+            distances[start:start + len(batch)] = np.sqrt(np.maximum(np.take_along_axis(closest_squared, order,
+                                                                                        axis=1), 0))
+
+        return distances, indexes
+
+
+# VARIABLES
+
+
+# EXECUTION
+
+
+# OUTPUT
+
+
+# END OF FILE
@@ -0,0 +1,331 @@
+"""
+Contains the functions used to predict continuously from a video file or a camera
+
+Usage:
+    python -m utils.stream VIDEO MODEL --fps 2
+    python -m utils.stream 0 MODEL --fps 2 --realtime
+"""
+# IMPORTS
+import argparse
+import json
+import sys
+import threading
+import time
+
+import cv2
+import numpy as np
+
+from utils.service import Predictor, load_model
+
+
+# FUNCTIONS
+def stream_predictions(source, predictor, target_fps=2., realtime=False, max_frames=None):
+    """
+    Predict frames of a video source at a target rate.
+
+    Frames between two predictions are skipped with grab, without being decoded. In realtime mode frames are read
+    by their own thread at the pace of the source (a camera, or a video file played at its frame rate): if
+    predicting takes longer than the frames keep coming, the frames not taken in time are dropped and the next
+    prediction uses the latest one. Frame, resized and RGB buffers are reused between frames. Camera frames are
+    timestamped with the time they are grabbed, see _FrameClock.
+
+    Parameters
+    ----------
+    source : str or int
+        Path of a video file or index of a camera
+    predictor : Predictor
+        Model and features settings, see utils.service
+    target_fps : float
+        Predictions per second of video. None to predict every frame
+    realtime : bool
+        Whether to read the source at its own pace, dropping frames under load
+    max_frames : int
+        Maximum number of frames to read
+
+    Yield
+    -----
+    prediction : dict
+        Frame index, timestamp in milliseconds, label and probability of every class, latency in milliseconds from
+        the frame being read to its prediction, and the frames skipped and dropped so far. Frames that can't be
+        predicted have an error instead of label and probabilities
+    """
+    capture = cv2.VideoCapture(source)
+    if not capture.isOpened():
+        raise ValueError(f'Video source {source} could not be opened')
+
+    reader = _ThreadedReader(capture, max_frames, paced=isinstance(source, str)) if realtime else \
+        _SequentialReader(capture, max_frames, live=not isinstance(source, str))
+    buffers = {}
+    period = 1000/target_fps if target_fps else 0.
+    next_timestamp = 0.
+
+    try:
+        while True:
+            frame = reader.read(lambda timestamp: timestamp + 1e-6 >= next_timestamp)
+            if frame is None:
+                break
+
+            image, index, timestamp, read_at = frame
+            next_timestamp = timestamp + period
+            prediction = {'frame': index, 'timestamp_ms': round(timestamp, 1)}
+
+            try:
+                vector = predictor.image_features(_resize_frame(image, predictor, buffers), resized=True)
+                probabilities = predictor.probabilities(predictor.feature_matrix([vector]))[0]
+                prediction['label'] = predictor.classes[int(probabilities.argmax())]
+                prediction['probabilities'] = {name: round(float(p), 5)
+                                               for name, p in zip(predictor.classes, probabilities)}
+            except (BaseException, Exception) as error:
+                prediction['error'] = str(error)
+
+            prediction.update({'latency_ms': round((time.perf_counter() - read_at)*1000, 2),
+                               'skipped': reader.skipped, 'dropped': reader.dropped})
+
+            yield prediction
+
+    finally:
+        reader.close()
+        capture.release()
+
+
+def write_video(video_path, images, fps=1., height=240, width=320):
+    """
+    Write images as the frames of a video file, e.g. to try the stream mode on a local file.
+
+    Parameters
+    ----------
+    video_path : str
+        Path of the video, ".avi" files are encoded as Motion JPEG
+    images : list
+        Images in RGB color mode, resized to the video size
+    fps : float
+        Frames per second of the video
+    height : int
+        Height of the video in pixels
+    width : int
+        Width of the video in pixels
+    """
+    video = cv2.VideoWriter(video_path, cv2.VideoWriter_fourcc(*'MJPG'), fps, (width, height))
+
+    for image in images:
+        video.write(cv2.cvtColor(cv2.resize(image, (width, height), interpolation=cv2.INTER_AREA),
+                                 cv2.COLOR_RGB2BGR))
+
+    video.release()
+
+
+def _resize_frame(frame, predictor, buffers):
+    """
+    Resize a BGR frame and convert it to RGB, reusing the buffers of the previous frame.
+    """
+    height = predictor.resize_height
+    width = height if predictor.square else int(height/(frame.shape[0]/frame.shape[1]))
+
+    if buffers.get('size') != (height, width):
+        buffers['size'] = (height, width)
+        buffers['small'] = np.empty((height, width, 3), dtype=np.uint8)
+        buffers['rgb'] = np.empty((height, width, 3), dtype=np.uint8)
+
+    cv2.resize(frame, (width, height), dst=buffers['small'], interpolation=cv2.INTER_AREA)
+    cv2.cvtColor(buffers['small'], cv2.COLOR_BGR2RGB, dst=buffers['rgb'])
+
+    return buffers['rgb']
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Predict continuously from a video file or a camera.')
+    parser.add_argument('source', help='video file, or index of a camera')
+    parser.add_argument('model', help='model saved with utils.service.save_model')
+    parser.add_argument('--fps', type=float, default=2., help='predictions per second of video')
+    parser.add_argument('--realtime', default=False, action='store_true',
+                        help='read the source at its own pace, dropping frames under load')
+    parser.add_argument('--max-frames', type=int, default=None)
+    parser.add_argument('--backend', default=None, help='k-means backend of the color clustering')
+    parser.add_argument('--n-init', type=int, default=None, help='k-means runs of the color clustering')
+    parser.add_argument('--output', default='-', help='JSON lines file for the predictions, - for stdout')
+
+    args = parser.parse_args()
+
+    clustering = {key: value for key, value in (('backend', args.backend), ('n_init', args.n_init))
+                  if value is not None}
+    predictor = Predictor(load_model(args.model), clustering=clustering)
+    source = int(args.source) if args.source.isdigit() else args.source
+    output = sys.stdout if args.output == '-' else open(args.output, 'w')
+    latencies = []
+    start = time.perf_counter()
+
+    try:
+        for prediction in stream_predictions(source, predictor, target_fps=args.fps, realtime=args.realtime,
+                                             max_frames=args.max_frames):
+            latencies.append(prediction['latency_ms'])
+            output.write(json.dumps(prediction) + '\n')
+            output.flush()
+    finally:
+        if output is not sys.stdout:
+            output.close()
+        predictor.close()
+
+    # Inform user
+    if latencies:
+        print(f'{len(latencies)} frames predicted in {time.perf_counter() - start:.1f}s, '
+              f'latency p50 {np.percentile(latencies, 50):.1f} ms, p99 {np.percentile(latencies, 99):.1f} ms, '
+              f'{prediction["skipped"]} frames skipped, {prediction["dropped"]} dropped.', file=sys.stderr)
+
+
+# CLASSES
+class _FrameClock:
+    """
+    Timestamps in milliseconds of the frames grabbed from a source.
+
+    Video files give the position of every frame. Depending on the backend, cameras report 0 or -1 whatever the
+    frame, so their frames, and those of any source whose position stops increasing, are timestamped with the time
+    they are grabbed since the first frame, continuing from the last position read.
+    """
+    def __init__(self, capture, live=False):
+        self.capture = capture
+        self.live = live
+        self._start = None
+        self._previous = None
+
+    def timestamp(self):
+        now = time.perf_counter()
+        if self._start is None:
+            self._start = now
+
+        if not self.live:
+            position = self.capture.get(cv2.CAP_PROP_POS_MSEC)
+            if position >= 0 and (self._previous is None or position > self._previous):
+                self._previous = position
+                return position
+
+            self.live = True
+            self._start = now - (self._previous or 0.)/1000
+
+        return (now - self._start)*1000
+
+
+class _SequentialReader:
+    """
+    Read frames on demand, decoding only the ones wanted.
+    """
+    def __init__(self, capture, max_frames=None, live=False):
+        self.capture = capture
+        self.max_frames = max_frames
+        self.skipped = 0
+        self.dropped = 0
+        self._clock = _FrameClock(capture, live)
+        self._index = -1
+        self._frame = None
+
+    def read(self, wanted):
+        while self.max_frames is None or self._index + 1 < self.max_frames:
+            if not self.capture.grab():
+                return None
+            self._index += 1
+
+            timestamp = self._clock.timestamp()
+            if not wanted(timestamp):
+                self.skipped += 1
+                continue
+
+            ok, self._frame = self.capture.retrieve(self._frame)
+            if ok:
+                return self._frame, self._index, timestamp, time.perf_counter()
+
+        return None
+
+    def close(self):
+        pass
+
+
+class _ThreadedReader:
+    """
+    Read frames in a thread at the pace of the source, keeping only the latest one.
+
+    Three buffers rotate between the frame being decoded, the latest frame and the frame being predicted, so frames
+    are never copied nor allocated again.
+    """
+    def __init__(self, capture, max_frames=None, paced=True):
+        self.capture = capture
+        self.max_frames = max_frames
+        self.paced = paced
+        self.skipped = 0
+        self.dropped = 0
+
+        self._clock = _FrameClock(capture, live=not paced)
+        self._buffers = [None]*3
+        self._info = [None]*3
+        self._writing, self._ready, self._reading = 0, None, None
+        self._done = False
+        self._condition = threading.Condition()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def read(self, wanted):
+        while True:
+            with self._condition:
+                self._condition.wait_for(lambda: self._ready is not None or self._done)
+                if self._ready is None:
+                    return None
+
+                self._reading, self._ready = self._ready, None
+                index, timestamp, read_at = self._info[self._reading]
+
+            if wanted(timestamp):
+                return self._buffers[self._reading], index, timestamp, read_at
+
+            with self._condition:
+                self.skipped += 1
+
+    def close(self):
+        with self._condition:
+            self._done = True
+            self._condition.notify_all()
+        self._thread.join()
+
+    def _run(self):
+        start = time.perf_counter()
+        index = 0
+
+        while not self._done and (self.max_frames is None or index < self.max_frames):
+            if not self.capture.grab():
+                break
+
+            timestamp = self._clock.timestamp()
+            if self.paced:
+                # Files are played at their frame rate, as a camera would deliver them
+                time.sleep(max(0., start + timestamp/1000 - time.perf_counter()))
+
+            ok, self._buffers[self._writing] = self.capture.retrieve(self._buffers[self._writing])
+            if not ok:
+                break
+            self._info[self._writing] = (index, timestamp, time.perf_counter())
+            index += 1
+
+            with self._condition:
+                if self._ready is not None:
+                    # The latest frame was not taken in time
+                    self.dropped += 1
+                    self._ready, self._writing = self._writing, self._ready
+                else:
+                    self._ready = self._writing
+                    self._writing = ({0, 1, 2} - {self._ready, self._reading}).pop()
+                self._condition.notify_all()
+
+        with self._condition:
+            self._done = True
+            self._condition.notify_all()
+
+
+# VARIABLES
+
+
+# EXECUTION
+if __name__ == '__main__':
+    main()
+
+
+# OUTPUT
+
+
+# END OF FILE
@@ -0,0 +1,229 @@
+"""
+Contains the functions used to process a collection with many parameter combinations, sharing common stages
+
+Usage:
+    python -m utils.sweep SOURCE OUTPUT --resize-height 100 150 --max-values 4 5 6 --num-of-colors 5 10
+"""
+# IMPORTS
+import argparse
+import itertools
+import os
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from csv import writer
+
+from utils.data_handling import get_collection
+from utils.features import get_color_features
+from utils.image_processing import color_clustering, get_img_rgb, reduce_col_palette, resize_img, square_img
+
+
+# FUNCTIONS
+def expand_grid(grid):
+    """
+    List every parameter combination of a grid, in stage order.
+
+    Parameters
+    ----------
+    grid : dict
+        Values of every parameter, e.g. {'resize_height': [100, 150], 'max_values': [4, 5]}. Missing parameters take
+        their default value, see DEFAULTS
+
+    Returns
+    -------
+    combinations : list
+        Dicts with a value for every parameter
+    """
+    unknown = set(grid) - set(DEFAULTS)
+    if unknown:
+        raise KeyError(f'Unknown parameters: {sorted(unknown)}')
+
+    names = [name for _, params, _ in STAGES for name in params]
+    values = [list(grid.get(name, [DEFAULTS[name]])) for name in names]
+
+    return [dict(zip(names, combination)) for combination in itertools.product(*values)]
+
+
+def sweep(collection, grid, label='sweep', color_mode='HEX', workers=1, output_path=None):
+    """
+    Extract the features of a collection for every combination of a parameter grid.
+
+    Runs are arranged as a tree of stages: every image is decoded once, resized once per resize_height and square,
+    reduced once per max_values under each resize and clustered once per num_of_colors under each reduction. Only
+    one image and its branches are in memory at a time.
+
+    Parameters
+    ----------
+    collection : list
+        List with paths to images
+    grid : dict
+        Values of every parameter, see expand_grid
+    label : str
+        Label for the images
+    color_mode : str
+        Whether to use RGB, HEX or PACKED color mode
+    workers : int
+        Number of processes, every one processing whole images
+    output_path : str
+        Path of a CSV file in which to save the table
+
+    Returns
+    -------
+    rows : list
+        One row per image and combination: the parameters in stage order, label, img_name, dim_ratio,
+        chiaroscuro, whitespace_ratio and the colors found. Combinations that raised an exception are skipped
+    counts : collections.Counter
+        Number of runs of every stage
+    """
+    levels = _grid_levels(grid)
+    tasks = [(str(img), f'{label}_{i:04d}', levels, color_mode) for i, img in enumerate(collection)]
+
+    if workers > 1:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            results = list(executor.map(_sweep_image, tasks, chunksize=4))
+    else:
+        results = [_sweep_image(task) for task in tasks]
+
+    rows = []
+    counts = Counter()
+    for img_rows, img_counts in results:
+        rows.extend([*params, label] + values for params, values in img_rows)
+        counts.update(img_counts)
+
+    names = [name for _, params, _ in STAGES for name in params]
+    rows.sort(key=lambda row: tuple(row[:len(names) + 2]))
+
+    if output_path:
+        num_of_colors = max(grid.get('num_of_colors', [DEFAULTS['num_of_colors']]))
+        with open(output_path, 'w', newline='') as file:
+            quill = writer(file)
+            quill.writerow(names + ['label', 'img_name', 'dim_ratio', 'chiaroscuro', 'whitespace_ratio'] +
+                           [f'color_{i + 1}' for i in range(num_of_colors)])
+            quill.writerows(rows)
+
+    # Inform user
+    combinations = len(expand_grid(grid))
+    print(f'{len(collection)} images x {combinations} combinations, stage runs: ' +
+          ', '.join(f'{name} {counts[name]}' for name in ['decode'] + [name for name, _, _ in STAGES]) +
+          f' (instead of {len(collection)*combinations} each without sharing).')
+
+    return rows, counts
+
+
+def _grid_levels(grid):
+    """
+    Values of the parameters of every stage, one list of tuples per stage.
+    """
+    expand_grid(grid)
+
+    return [list(itertools.product(*(grid.get(name, [DEFAULTS[name]]) for name in params)))
+            for _, params, _ in STAGES]
+
+
+def _sweep_image(task):
+    """
+    Walk the stage tree of one image. Runs in the worker processes.
+    """
+    img_path, img_name, levels, color_mode = task
+    counts = Counter()
+    rows = []
+
+    try:
+        img = get_img_rgb(img_path)
+        counts['decode'] += 1
+    except (BaseException, Exception):
+        return rows, counts
+
+    def walk(level, value, settings, outputs):
+        if level == len(STAGES):
+            rows.append((tuple(settings.values())[1:], [img_name] + [i for output in outputs for i in output]))
+            return
+
+        name, params, function = STAGES[level]
+        for values in levels[level]:
+            branch = {**settings, **dict(zip(params, values))}
+            try:
+                result, output = function(value, branch)
+            except (BaseException, Exception):
+                continue
+            counts[name] += 1
+            walk(level + 1, result, branch, outputs + [output])
+
+    walk(0, img, {'color_mode': color_mode}, [])
+
+    return rows, counts
+
+
+def _resize(img, settings):
+    """
+    Resize stage, its features are the dimension ratio.
+    """
+    if settings['square']:
+        img = square_img(img, settings['resize_height'])
+    else:
+        img = resize_img(img, settings['resize_height'])
+
+    return img, [round(img.shape[0]/img.shape[1], ndigits=5)]
+
+
+def _reduce(img, settings):
+    """
+    Palette reduction stage, its features are chiaroscuro and whitespace_ratio.
+    """
+    img = reduce_col_palette(img, settings['max_values'])
+
+    return img, list(get_color_features(img))
+
+
+def _cluster(img, settings):
+    """
+    Color clustering stage, its features are the colors found.
+    """
+    colors = color_clustering(img, color_mode=settings['color_mode'], max_values=settings['max_values'],
+                              num_of_colors=settings['num_of_colors'], show_chart=False)
+
+    return img, colors.tolist() if settings['color_mode'] == 'PACKED' else list(colors)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Extract features for every combination of parameters.')
+    parser.add_argument('source', help='folder with the images')
+    parser.add_argument('output', help='CSV file in which to save the table')
+    parser.add_argument('--label', default='sweep')
+    parser.add_argument('--resize-height', type=int, nargs='+', default=[DEFAULTS['resize_height']])
+    parser.add_argument('--square', choices=('yes', 'no', 'both'), default='no')
+    parser.add_argument('--max-values', type=int, nargs='+', default=[DEFAULTS['max_values']])
+    parser.add_argument('--num-of-colors', type=int, nargs='+', default=[DEFAULTS['num_of_colors']])
+    parser.add_argument('--color-mode', default='HEX', choices=('RGB', 'HEX', 'PACKED'))
+    parser.add_argument('--workers', type=int, default=os.cpu_count())
+    parser.add_argument('--extensions', nargs='+', default=['.jpg', '.jpeg', '.png'])
+
+    args = parser.parse_args()
+
+    grid = {'resize_height': args.resize_height,
+            'square': {'yes': [True], 'no': [False], 'both': [False, True]}[args.square],
+            'max_values': args.max_values,
+            'num_of_colors': args.num_of_colors}
+    collection = sorted(str(i) for i in get_collection(args.source, args.extensions))
+
+    sweep(collection, grid, label=args.label, color_mode=args.color_mode, workers=args.workers,
+          output_path=args.output)
+
+
+# VARIABLES
+# Stages in tree order: name, parameters and function. Functions get the settings of their branch
+STAGES = [('resize', ('resize_height', 'square'), _resize),
+          ('reduce', ('max_values',), _reduce),
+          ('cluster', ('num_of_colors',), _cluster)]
+
+DEFAULTS = {'resize_height': 150, 'square': False, 'max_values': 5, 'num_of_colors': 5}
+
+
+# EXECUTION
+if __name__ == '__main__':
+    main()
+
+
+# OUTPUT
+
+
+# END OF FILE
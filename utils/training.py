@@ -0,0 +1,342 @@
+"""
+Contains the functions used to train classifiers on the features of the museum without loading them in memory
+
+Usage:
+    python -m utils.training train DATA MODEL --target group --epochs 5
+    python -m utils.training cv DATA --target artist --folds 5 --workers 4
+"""
+# IMPORTS
+import argparse
+import os
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+from csv import reader
+
+import numpy as np
+
+from utils.data_handling import parse_features
+from utils.service import load_model, save_model
+
+
+# FUNCTIONS
+def get_classes(target, labels=None):
+    """
+    Classes predicted for a target.
+
+    Parameters
+    ----------
+    target : str
+        'group' for classic or vanguard, 'artist' for the label of every folder
+    labels : list
+        Labels used for training. Defaults to the artists of ARTIST_GROUPS
+
+    Returns
+    -------
+    classes : list
+        Class names, in the order used by the models
+    """
+    if target == 'group':
+        return sorted(ARTIST_GROUPS)
+
+    return sorted(labels or (artist for artists in ARTIST_GROUPS.values() for artist in artists))
+
+
+def get_group(label):
+    """
+    Group of an artist, None if the artist has no group.
+    """
+    for group, artists in ARTIST_GROUPS.items():
+        if label in artists:
+            return group
+
+    return None
+
+
+def get_fold(img_name, n_folds):
+    """
+    Fold of an image. Folds are given by a hash of the image name so they don't depend on the order of the rows.
+    """
+    return zlib.crc32(img_name.encode('utf-8')) % n_folds
+
+
+def iter_batches(path, target='group', labels=None, batch_size=1024, num_of_features=None, fold=None, n_folds=5,
+                 holdout=False, seed=None):
+    """
+    Stream features batches from the CSV files saved by process_collection.
+
+    The CSV file of every label is read row by row. The next row is taken from a random file, with a probability
+    proportional to the rows it has left, so every batch mixes artists as a shuffle would and only one batch is in
+    memory at a time. Rows of every file are counted first with a streaming pass.
+
+    Parameters
+    ----------
+    path : str
+        Folder with one sub folder per label, each one with a "<label>.csv" file
+    target : str
+        'group' for classic or vanguard, 'artist' for the label of every folder
+    labels : list
+        Labels to read. Defaults to the artists of ARTIST_GROUPS
+    batch_size : int
+        Number of rows per batch
+    num_of_features : int
+        Length of the features vectors, shorter ones are padded with zeros. Defaults to the length of the first one
+    fold : int
+        Fold to leave out, or to keep if holdout. None to read every row
+    n_folds : int
+        Number of folds
+    holdout : bool
+        Whether to read only the rows of fold
+    seed : int
+        Seed of the interleaving. Use a different one every epoch
+
+    Yield
+    -----
+    batch : tuple
+        float32 features matrix and int64 class indexes
+    """
+    classes = get_classes(target, labels)
+    labels = labels or [artist for artists in ARTIST_GROUPS.values() for artist in artists]
+    if target == 'group':
+        labels = [label for label in labels if get_group(label) is not None]
+
+    csv_paths = [os.path.join(path, label, f'{label}.csv') for label in sorted(labels)
+                 if os.path.isfile(os.path.join(path, label, f'{label}.csv'))]
+
+    # Count the rows of every file
+    remaining = np.zeros(len(csv_paths), dtype=np.int64)
+    for i, csv_path in enumerate(csv_paths):
+        with open(csv_path, 'rb') as file:
+            remaining[i] = sum(1 for _ in file)
+
+    rng = np.random.default_rng(seed)
+    files = [open(csv_path, newline='') for csv_path in csv_paths]
+    readers = [reader(file) for file in files]
+    features, targets = [], []
+
+    try:
+        while remaining.sum():
+            i = rng.choice(len(readers), p=remaining/remaining.sum())
+            row = next(readers[i], None)
+            remaining[i] = remaining[i] - 1 if row is not None else 0
+
+            if not row or (fold is not None and (get_fold(row[1], n_folds) == fold) != holdout):
+                continue
+
+            vector = parse_features(row)
+            if num_of_features is None:
+                num_of_features = len(vector)
+            features.append(vector[:num_of_features])
+            targets.append(classes.index(get_group(row[0]) if target == 'group' else row[0]))
+
+            if len(features) == batch_size:
+                yield _stack(features, num_of_features), np.array(targets, dtype=np.int64)
+                features, targets = [], []
+
+        if features:
+            yield _stack(features, num_of_features), np.array(targets, dtype=np.int64)
+
+    finally:
+        for file in files:
+            file.close()
+
+
+def fit(path, target='group', labels=None, epochs=5, batch_size=1024, fold=None, n_folds=5, model_path=None,
+        resume=False, seed=0, **settings):
+    """
+    Fit a scaler and an incremental linear classifier streaming the features from disk.
+
+    A first pass fits the scaler, then every epoch streams the batches once more into partial_fit. If model_path is
+    given, the model is checkpointed after every epoch and can be resumed.
+
+    Parameters
+    ----------
+    path : str
+        Folder with one sub folder per label
+    target : str
+        'group' for classic or vanguard, 'artist' for the label of every folder
+    labels : list
+        Labels to train on. Defaults to the artists of ARTIST_GROUPS
+    epochs : int
+        Number of passes over the data
+    batch_size : int
+        Number of rows per batch
+    fold : int
+        Fold left out for validation, None to train on every row
+    n_folds : int
+        Number of folds
+    model_path : str
+        Path of the checkpoint, saved with save_model
+    resume : bool
+        Whether to continue from the checkpoint in model_path
+    seed : int
+        Seed of the classifier
+    settings
+        Features settings saved with the model (resize_height, square, grid, clustering)
+
+    Returns
+    -------
+    model : sklearn.pipeline.Pipeline
+        Fitted scaler and classifier
+    """
+    from sklearn.linear_model import SGDClassifier
+    from sklearn.pipeline import Pipeline
+    from sklearn.preprocessing import StandardScaler
+
+    classes = get_classes(target, labels)
+    batches = {'path': path, 'target': target, 'labels': labels, 'batch_size': batch_size, 'fold': fold,
+               'n_folds': n_folds}
+
+    if resume and model_path and os.path.isfile(model_path):
+        bundle = load_model(model_path)
+        model, first_epoch = bundle['model'], bundle['epoch']
+        scaler, classifier = model.named_steps['scaler'], model.named_steps['classifier']
+    else:
+        scaler = StandardScaler()
+        for features, _ in iter_batches(**batches):
+            scaler.partial_fit(features)
+
+        # Averaged SGD is as accurate as a full batch logistic regression on the museum features
+        classifier = SGDClassifier(loss='log_loss', alpha=1e-4, average=True, random_state=seed)
+        model = Pipeline([('scaler', scaler), ('classifier', classifier)])
+        first_epoch = 0
+
+    for epoch in range(first_epoch, epochs):
+        for features, targets in iter_batches(num_of_features=scaler.n_features_in_, seed=[seed, epoch], **batches):
+            classifier.partial_fit(scaler.transform(features), targets, classes=np.arange(len(classes)))
+
+        if model_path:
+            save_model(model_path, model, classes, target=target, epoch=epoch + 1, **settings)
+
+        # Inform user
+        print(f'Epoch {epoch + 1} of {epochs} done.')
+
+    return model
+
+
+def score(model, path, target='group', labels=None, batch_size=1024, fold=None, n_folds=5):
+    """
+    Accuracy of a model, streaming the features from disk.
+
+    Returns
+    -------
+    accuracy : float
+        Share of rows predicted right, over the rows of fold if given
+    """
+    hits = 0
+    total = 0
+
+    for features, targets in iter_batches(path, target, labels, batch_size, model.n_features_in_, fold, n_folds,
+                                          holdout=fold is not None):
+        hits += int((model.predict(features) == targets).sum())
+        total += len(targets)
+
+    return hits/total if total else float('nan')
+
+
+def cross_validate(path, target='group', labels=None, n_folds=5, workers=None, **kwargs):
+    """
+    Cross-validate the incremental classifier, one process per fold.
+
+    Parameters
+    ----------
+    path : str
+        Folder with one sub folder per label
+    target : str
+        'group' for classic or vanguard, 'artist' for the label of every folder
+    labels : list
+        Labels to train on. Defaults to the artists of ARTIST_GROUPS
+    n_folds : int
+        Number of folds
+    workers : int
+        Number of processes, defaults to the number of cores
+    kwargs
+        Arguments of fit (epochs, batch_size, seed)
+
+    Returns
+    -------
+    scores : list
+        Validation accuracy of every fold
+    """
+    tasks = [(path, target, labels, fold, n_folds, kwargs) for fold in range(n_folds)]
+
+    with ProcessPoolExecutor(max_workers=workers or min(n_folds, os.cpu_count())) as executor:
+        scores = list(executor.map(_run_fold, tasks))
+
+    # Inform user
+    print(f'{target} accuracy: {np.mean(scores):.3f} +/- {np.std(scores):.3f} over {n_folds} folds')
+
+    return scores
+
+
+def _run_fold(task):
+    """
+    Fit and score one fold. Runs in the worker processes.
+    """
+    path, target, labels, fold, n_folds, kwargs = task
+    model = fit(path, target, labels, fold=fold, n_folds=n_folds, **kwargs)
+
+    return score(model, path, target, labels, kwargs.get('batch_size', 1024), fold, n_folds)
+
+
+def _stack(features, num_of_features):
+    """
+    Stack features vectors into a matrix, padding short ones with zeros.
+    """
+    matrix = np.zeros((len(features), num_of_features), dtype=np.float32)
+    for i, vector in enumerate(features):
+        matrix[i, :len(vector)] = vector
+
+    return matrix
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Train classifiers on the features of the museum.')
+    operations = parser.add_subparsers(dest='operation', required=True)
+
+    for name, help_text in (('train', 'train and checkpoint a model'), ('cv', 'cross-validate in parallel')):
+        p_operation = operations.add_parser(name, help=help_text)
+        p_operation.add_argument('data', help='folder with one sub folder per label')
+        if name == 'train':
+            p_operation.add_argument('model', help='path of the model file')
+            p_operation.add_argument('--resume', default=False, action='store_true')
+            p_operation.add_argument('--backend', default=None,
+                                     help='k-means backend the features were extracted with, used by the service')
+            p_operation.add_argument('--n-init', type=int, default=None,
+                                     help='k-means runs the features were extracted with, used by the service')
+        else:
+            p_operation.add_argument('--folds', type=int, default=5)
+            p_operation.add_argument('--workers', type=int, default=None)
+        p_operation.add_argument('--target', default='group', choices=('group', 'artist'))
+        p_operation.add_argument('--labels', nargs='+', default=None, help='labels to train on')
+        p_operation.add_argument('--epochs', type=int, default=5)
+        p_operation.add_argument('--batch-size', type=int, default=1024)
+        p_operation.add_argument('--seed', type=int, default=0)
+
+    args = parser.parse_args()
+
+    if args.operation == 'train':
+        clustering = {key: value for key, value in (('backend', args.backend), ('n_init', args.n_init))
+                      if value is not None}
+        fit(args.data, args.target, args.labels, epochs=args.epochs, batch_size=args.batch_size,
+            model_path=args.model, resume=args.resume, seed=args.seed, clustering=clustering or None)
+    else:
+        cross_validate(args.data, args.target, args.labels, n_folds=args.folds, workers=args.workers,
+                       epochs=args.epochs, batch_size=args.batch_size, seed=args.seed)
+
+
+# VARIABLES
+# Artists of the museum by style
+ARTIST_GROUPS = {'classic': ['caravaggio', 'degas', 'goya', 'hokusai', 'monet', 'sorolla', 'velazquez'],
+                 'vanguard': ['kahlo', 'kandinsky', 'klimt', 'lichtenstein', 'mondrian', 'picasso', 'pollock',
+                              'warhol']}
+
+
+# EXECUTION
+if __name__ == '__main__':
+    main()
+
+
+# OUTPUT
+
+
+# END OF FILE
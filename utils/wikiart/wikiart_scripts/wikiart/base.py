@@ -5,6 +5,9 @@ License: MIT License (c) 2016
 
 """
 import abc
+import bisect
+import collections
+import json
 import time
 
 from . import settings
@@ -18,7 +21,8 @@ class RequestPadder:
     requesting process and pause it for the necessary time.
     """
 
-    def __init__(self):
+    def __init__(self, metrics=None):
+        self.metrics = metrics
         self.n_requests_made = 0
         self.time_spent_requesting = 0
         self.local_elapsed = 0
@@ -41,18 +45,138 @@ class RequestPadder:
             if force or self.time_spent_requesting < settings.REQUEST_PADDING_IN_SECS:
                 # Wait for the necessary time only.
                 time.sleep(settings.REQUEST_PADDING_IN_SECS)
+                if self.metrics is not None:
+                    self.metrics.slept(settings.REQUEST_PADDING_IN_SECS)
 
             self.n_requests_made = 0
             self.time_spent_requesting = 0
             self.local_elapsed = 0
 
 
+class Metrics:
+    """Throughput Metrics of the Requests Made to WikiArt Server.
+
+    Keeps counters of requests, transferred bytes, padding sleeps and errors
+    by status, as well as a latency histogram with fixed buckets. Every
+    `interval` seconds a snapshot is written to `stream` as a json line, so
+    long runs can be inspected while they happen. Recording is a handful of
+    additions and no snapshot is built between emissions.
+    """
+    # Upper bounds (in secs) of the latency histogram buckets.
+    LATENCY_BUCKETS = (.01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10, 30, 60,
+                       float('inf'))
+
+    def __init__(self, stream=None, interval=None):
+        self.stream = stream
+        self.interval = (settings.METRICS_INTERVAL_IN_SECS
+                         if interval is None else interval)
+
+        self.started = self.last_emitted = time.time()
+        self.n_requests = 0
+        self.n_bytes = 0
+        self.time_requesting = 0.
+        self.time_sleeping = 0.
+        self.latencies = [0] * len(self.LATENCY_BUCKETS)
+        self.by_endpoint = collections.Counter()
+        self.by_status = collections.Counter()
+        self.errors = collections.Counter()
+
+        # Counters at the last emission, used for the interval rates.
+        self._last_requests = 0
+        self._last_bytes = 0
+
+    def request(self, endpoint, elapsed, status):
+        """Record a finished request.
+
+        :param endpoint: str, name of the endpoint requested.
+        :param elapsed: float, seconds until the response arrived.
+        :param status: int or str, HTTP status code or the name of the
+            exception that prevented getting one.
+        """
+        self.n_requests += 1
+        self.time_requesting += elapsed
+        self.latencies[bisect.bisect_left(self.LATENCY_BUCKETS, elapsed)] += 1
+        self.by_endpoint[endpoint] += 1
+        self.by_status[status] += 1
+
+        if not isinstance(status, int) or status >= 400:
+            self.errors[status] += 1
+
+        self.maybe_emit()
+
+    def transferred(self, n_bytes):
+        """Record bytes received from the server."""
+        self.n_bytes += n_bytes
+
+    def slept(self, secs):
+        """Record time spent sleeping to pad requests."""
+        self.time_sleeping += secs
+
+    def latency_quantile(self, q):
+        """Upper bound of the bucket holding the `q` latency quantile."""
+        if not self.n_requests:
+            return None
+
+        rank, seen = q * self.n_requests, 0
+        for bound, count in zip(self.LATENCY_BUCKETS, self.latencies):
+            seen += count
+            if seen >= rank:
+                return bound
+
+    def snapshot(self):
+        """Current state of the metrics as a json-serializable dict."""
+        now = time.time()
+        since_last = max(now - self.last_emitted, 1e-9)
+        uptime = max(now - self.started, 1e-9)
+
+        return {
+            'time': round(now, 3),
+            'uptime_secs': round(uptime, 3),
+            'requests': self.n_requests,
+            'bytes': self.n_bytes,
+            'requests_per_sec': round(
+                (self.n_requests - self._last_requests) / since_last, 3),
+            'bytes_per_sec': round(
+                (self.n_bytes - self._last_bytes) / since_last, 3),
+            'avg_requests_per_sec': round(self.n_requests / uptime, 3),
+            'avg_bytes_per_sec': round(self.n_bytes / uptime, 3),
+            'requesting_secs': round(self.time_requesting, 3),
+            'padding_sleep_secs': round(self.time_sleeping, 3),
+            'latency_p50_secs': self.latency_quantile(.5),
+            'latency_p99_secs': self.latency_quantile(.99),
+            'latency_histogram': {str(b): c for b, c in
+                                  zip(self.LATENCY_BUCKETS, self.latencies)},
+            'by_endpoint': dict(self.by_endpoint),
+            'by_status': {str(k): v for k, v in self.by_status.items()},
+            'errors': {str(k): v for k, v in self.errors.items()},
+        }
+
+    def maybe_emit(self):
+        if self.stream is not None and \
+                time.time() - self.last_emitted >= self.interval:
+            self.emit()
+
+    def emit(self):
+        """Write a snapshot to the stream as a json line."""
+        if self.stream is None:
+            return
+
+        snapshot = self.snapshot()
+        self.stream.write(json.dumps(snapshot) + '\n')
+        self.stream.flush()
+
+        self.last_emitted = time.time()
+        self._last_requests = self.n_requests
+        self._last_bytes = self.n_bytes
+
+
 class Logger(metaclass=abc.ABCMeta):
     """Logs Events During Fetching and Conversion."""
     active = False
     keep_messages = False
 
-    messages_ = []
+    # Only the latest messages are kept, so long runs don't grow unbounded.
+    messages_ = collections.deque(maxlen=settings.LOGGER_MAX_MESSAGES)
 
     @classmethod
     def info(cls, message, end='\n', flush=False):
@@ -6,6 +6,7 @@ License: MIT License (c) 2016
 """
 
 import argparse
+import sys
 import time
 
 from . import base, converter, fetcher, settings
@@ -26,6 +27,12 @@ class Console:
                        help='output directory for dataset')
         p.add_argument('--check', type=bool, default=True,
                        help='check downloaded files')
+        p.add_argument('--metrics', default=None,
+                       help='file in which fetching metrics are written as '
+                            'json lines (use - for stdout)')
+        p.add_argument('--metrics-interval', type=float,
+                       default=settings.METRICS_INTERVAL_IN_SECS,
+                       help='seconds between two metrics snapshots')
 
         # Fetch operation.
         sp = p.add_subparsers(
@@ -75,17 +82,30 @@ class Console:
         return self.fetch(args).convert(args)
 
     def fetch(self, args):
-        f = fetcher.WikiArtFetcher(override=args.override)
+        stream = None
+        if args.metrics == '-':
+            stream = sys.stdout
+        elif args.metrics:
+            stream = open(args.metrics, 'a', encoding='utf-8')
+
+        metrics = base.Metrics(stream=stream, interval=args.metrics_interval)
+        f = fetcher.WikiArtFetcher(override=args.override, metrics=metrics)
         f.prepare()
 
-        if not hasattr(args, 'only') or args.only == 'all':
-            args.only = 'all'
-            f.fetch_all()
-        else:
-            f.fetch_artists()
-
-            if args.only == 'paintings':
-                f.fetch_all_paintings()
+        try:
+            if not hasattr(args, 'only') or args.only == 'all':
+                args.only = 'all'
+                f.fetch_all()
+            else:
+                f.fetch_artists()
+
+                if args.only == 'paintings':
+                    f.fetch_all_paintings()
+        finally:
+            # Always leave a last snapshot, even if the run was interrupted.
+            metrics.emit()
+            if stream is not None and stream is not sys.stdout:
+                stream.close()
 
         if args.check: f.check(only=args.only)
 
@@ -23,11 +23,15 @@ class WikiArtFetcher:
     Fetcher for data in WikiArt.org.
     """
 
-    def __init__(self, commit=True, override=False, padder=None):
+    def __init__(self, commit=True, override=False, padder=None, metrics=None):
         self.commit = commit
         self.override = override
 
+        self.metrics = metrics or base.Metrics()
         self.padder = padder or base.RequestPadder()
+        if getattr(self.padder, 'metrics', None) is None:
+            # Padders given by the caller record their sleeps as well.
+            self.padder.metrics = self.metrics
 
         self.artists = None
         self.painting_groups = None
@@ -89,6 +93,26 @@ class WikiArtFetcher:
         except Exception as error:
             Logger.write('Error %s' % str(error))
 
+    def get(self, endpoint, url, **kwargs):
+        """Request `url` and record the request in the fetcher's metrics.
+
+        :param endpoint: str, name under which the request is recorded.
+        """
+        elapsed = time.time()
+        try:
+            response = requests.get(url, **kwargs)
+        except Exception as error:
+            self.metrics.request(endpoint, time.time() - elapsed,
+                                 type(error).__name__)
+            raise
+
+        self.metrics.request(endpoint, time.time() - elapsed,
+                             response.status_code)
+        if not kwargs.get('stream'):
+            self.metrics.transferred(len(response.content))
+
+        return response
+
     def fetch_all(self):
         """Fetch Everything from WikiArt."""
         return (self.fetch_artists()
@@ -112,9 +136,9 @@ class WikiArtFetcher:
         try:
             url = '/'.join((settings.BASE_URL, 'Artist/AlphabetJson'))
             params = {'v' : 'new', 'inPublicDomain' : 'true'}
-            response = requests.get(url,
-                                    timeout=settings.METADATA_REQUEST_TIMEOUT,
-                                    params=params)
+            response = self.get('AlphabetJson', url,
+                                timeout=settings.METADATA_REQUEST_TIMEOUT,
+                                params=params)
             response.raise_for_status()
             self.artists = response.json()
 
@@ -167,8 +191,8 @@ class WikiArtFetcher:
             return data
 
         try:
-            response = requests.get(
-                url, params=params,
+            response = self.get(
+                'PaintingsByArtist', url, params=params,
                 timeout=settings.METADATA_REQUEST_TIMEOUT)
             response.raise_for_status()
             data = response.json()
@@ -180,8 +204,8 @@ class WikiArtFetcher:
                                 str(painting['contentId'])))
 
                 self.padder.request_start()
-                response = requests.get(
-                    url, timeout=settings.METADATA_REQUEST_TIMEOUT)
+                response = self.get(
+                    'ImageJson', url, timeout=settings.METADATA_REQUEST_TIMEOUT)
                 self.padder.request_finished()
 
                 if response.ok:
@@ -244,8 +268,8 @@ class WikiArtFetcher:
         try:
             # Save image.
             self.padder.request_start()
-            response = requests.get(url, stream=True,
-                                    timeout=settings.PAINTINGS_REQUEST_TIMEOUT)
+            response = self.get('image', url, stream=True,
+                                timeout=settings.PAINTINGS_REQUEST_TIMEOUT)
             self.padder.request_finished()
 
             response.raise_for_status()
@@ -253,6 +277,7 @@ class WikiArtFetcher:
             with open(filename, 'wb') as f:
                 response.raw.decode_content = True
                 shutil.copyfileobj(response.raw, f)
+            self.metrics.transferred(os.path.getsize(filename))
 
             Logger.write('(%.2f sec)' % (time.time() - elapsed))
 
@@ -0,0 +1,150 @@
+"""WikiArt Fetcher Load Test.
+
+Runs the fetcher end to end against a local `StubServer` and reports its
+throughput, the requests it made and whether it complied with the server's
+rate limit. Nothing leaves the machine.
+
+Usage:
+    python -m wikiart.loadtest --artists 5 --paintings 20 --latency .05
+
+"""
+import argparse
+import json
+import os
+import tempfile
+import time
+
+from . import base, fetcher, settings, stub
+
+
+def run(artists, paintings_per_artist=5, image_size=32 * 1024, latency=0.,
+        jitter=0., error_rate=0., rate_limit=None, rate_window=None,
+        stride=None, padding=None, datadir=None, seed=0):
+    """Fetch everything from a stub server and measure the process.
+
+    :param artists: list, artists served by the stub.
+    :param rate_limit: int, requests the stub accepts within `rate_window`.
+        Defaults to the stride the fetcher is configured with.
+    :param rate_window: float, seconds of the rate limit window. Defaults to
+        the padding the fetcher is configured with.
+    :param stride: int, overrides `settings.REQUEST_STRIDE` during the run.
+    :param padding: float, overrides `settings.REQUEST_PADDING_IN_SECS`
+        during the run. Scale it down to keep runs short.
+    :param datadir: str, where to save fetched data. A temporary folder is
+        used and removed afterwards if none is given.
+
+    :return: dict, load test report. Server-side counts are complemented
+        with the fetcher's own `base.Metrics` snapshot.
+    """
+    overridden = ('BASE_URL', 'BASE_FOLDER', 'REQUEST_STRIDE',
+                  'REQUEST_PADDING_IN_SECS')
+    previous = {name: getattr(settings, name) for name in overridden}
+
+    if stride is not None:
+        settings.REQUEST_STRIDE = stride
+    if padding is not None:
+        settings.REQUEST_PADDING_IN_SECS = padding
+    if rate_limit is None:
+        rate_limit = settings.REQUEST_STRIDE
+    if rate_window is None:
+        rate_window = settings.REQUEST_PADDING_IN_SECS
+
+    tmp = tempfile.TemporaryDirectory() if datadir is None else None
+    server = stub.StubServer(artists, paintings_per_artist=paintings_per_artist,
+                             image_size=image_size, latency=latency,
+                             jitter=jitter, error_rate=error_rate,
+                             rate_limit=rate_limit, rate_window=rate_window,
+                             seed=seed)
+    try:
+        settings.BASE_URL = server.base_url
+        settings.BASE_FOLDER = datadir or tmp.name
+
+        with server:
+            elapsed = time.time()
+            aborted = None
+            metrics = base.Metrics()
+            try:
+                (fetcher.WikiArtFetcher(override=True, metrics=metrics)
+                 .prepare()
+                 .fetch_all())
+            except RuntimeError as error:
+                aborted = str(error)
+            elapsed = time.time() - elapsed
+
+        images_dir = os.path.join(settings.BASE_FOLDER, 'images')
+        copies = sum(len(files) for _, _, files in os.walk(images_dir))
+    finally:
+        for name, value in previous.items():
+            setattr(settings, name, value)
+        if tmp is not None:
+            tmp.cleanup()
+
+    stats = server.stats
+    max_in_window = stats.max_requests_in_window(rate_window)
+
+    return {
+        'elapsed_secs': round(elapsed, 3),
+        'aborted': aborted,
+        'requests': stats.n_requests,
+        'requests_per_sec': round(stats.n_requests / elapsed, 3) if elapsed else None,
+        'bytes_per_sec': round(stats.bytes_sent / elapsed, 3) if elapsed else None,
+        'bytes_sent': stats.bytes_sent,
+        'by_endpoint': dict(stats.by_endpoint),
+        'by_status': {str(k): v for k, v in stats.by_status.items()},
+        'paintings': server.n_paintings,
+        'copies_saved': copies,
+        'rate_limit': rate_limit,
+        'rate_window_secs': rate_window,
+        'max_requests_in_window': max_in_window,
+        'rate_limit_compliant': (max_in_window <= rate_limit
+                                 and not stats.by_status.get(429)),
+        'fetcher_metrics': metrics.snapshot(),
+    }
+
+
+def main():
+    p = argparse.ArgumentParser(
+        description='Load test the WikiArt fetcher against a local stub.')
+    p.add_argument('--artists-file', default=stub.ARTISTS_BACKUP,
+                   help='json file with the artists served by the stub')
+    p.add_argument('--artists', type=int, default=5,
+                   help='number of artists served')
+    p.add_argument('--paintings', type=int, default=10,
+                   help='paintings served per artist')
+    p.add_argument('--image-size', type=int, default=32 * 1024,
+                   help='size in bytes of every image copy')
+    p.add_argument('--latency', type=float, default=0.,
+                   help='seconds the stub waits before answering')
+    p.add_argument('--jitter', type=float, default=0.,
+                   help='maximum random deviation from latency, in seconds')
+    p.add_argument('--error-rate', type=float, default=0.,
+                   help='fraction of requests answered with a 500 error')
+    p.add_argument('--rate-limit', type=int, default=None,
+                   help='requests accepted per window (default: stride)')
+    p.add_argument('--rate-window', type=float, default=None,
+                   help='rate limit window in seconds (default: padding)')
+    p.add_argument('--stride', type=int, default=None,
+                   help='override settings.REQUEST_STRIDE')
+    p.add_argument('--padding', type=float, default=None,
+                   help='override settings.REQUEST_PADDING_IN_SECS')
+    p.add_argument('--datadir', default=None,
+                   help='keep fetched data in this folder')
+    p.add_argument('--seed', type=int, default=0)
+    p.add_argument('--verbose', default=False, action='store_true',
+                   help='show the fetcher log')
+    args = p.parse_args()
+
+    base.Logger.active = args.verbose
+    report = run(stub.load_artists(args.artists_file, args.artists),
+                 paintings_per_artist=args.paintings,
+                 image_size=args.image_size, latency=args.latency,
+                 jitter=args.jitter, error_rate=args.error_rate,
+                 rate_limit=args.rate_limit, rate_window=args.rate_window,
+                 stride=args.stride, padding=args.padding,
+                 datadir=args.datadir, seed=args.seed)
+
+    print(json.dumps(report, indent=4))
+
+
+if __name__ == '__main__':
+    main()
@@ -30,6 +30,13 @@ REQUEST_PADDING_IN_SECS = 5
 METADATA_REQUEST_TIMEOUT = 2 * 60
 PAINTINGS_REQUEST_TIMEOUT = 5 * 60
 
+# Metrics and Logging Settings
+
+# Minimum delta time (in secs) between two consecutive metrics snapshots.
+METRICS_INTERVAL_IN_SECS = 60
+# Maximum number of messages kept by the logger when `keep_messages` is set.
+LOGGER_MAX_MESSAGES = 1000
+
 # Data Set Conversion Settings
 
 # Set which attributes are considered when converting the paintings json files
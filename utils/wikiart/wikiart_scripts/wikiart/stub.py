@@ -0,0 +1,269 @@
+"""WikiArt Stub Server.
+
+Local stand-in for the WikiArt.org endpoints used by the fetcher. Artists,
+paintings and image bytes are served from fixtures so the fetcher can be
+exercised and benchmarked offline.
+
+"""
+import collections
+import json
+import os
+import random
+import threading
+import time
+import urllib.parse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Default fixtures source: the artists backup shipped with this project.
+ARTISTS_BACKUP = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                              os.pardir, os.pardir, 'artist_backup.json')
+
+
+def load_artists(path=ARTISTS_BACKUP, n_artists=None):
+    """Load a list of artists to be used as fixtures.
+
+    :param path: str, path to a json file with WikiArt's artists list.
+    :param n_artists: int, keep only the first `n_artists` entries.
+    """
+    with open(path, encoding='utf-8') as f:
+        artists = json.load(f)
+
+    return artists[:n_artists] if n_artists else artists
+
+
+def make_fixtures(artists, paintings_per_artist=5, seed=0):
+    """Generate paintings metadata for every artist.
+
+    :param artists: list, artists in WikiArt's `AlphabetJson` notation.
+    :param paintings_per_artist: int, number of paintings per artist.
+    :param seed: int, seed for the generated years.
+
+    :return: tuple, (paintings by artist url, details by painting id).
+    """
+    rng = random.Random(seed)
+    paintings, details = {}, {}
+    content_id = 1
+
+    for artist in artists:
+        group = []
+
+        for i in range(paintings_per_artist):
+            year = rng.choice((None, rng.randint(1500, 2000)))
+            painting = {
+                'title': '%s #%i' % (artist['artistName'], i),
+                'contentId': content_id,
+                'artistContentId': artist['contentId'],
+                'artistName': artist['artistName'],
+                'artistUrl': artist['url'],
+                'completitionYear': year,
+                'url': 'painting-%i' % content_id,
+                # Relative until served, the host is only known at runtime.
+                'image': '/images/%s/%i.jpg!Large.jpg' % (artist['url'],
+                                                          content_id),
+            }
+            group.append(painting)
+            details[content_id] = {
+                'contentId': content_id,
+                'style': rng.choice(('Baroque', 'Impressionism', 'Cubism')),
+                'genre': rng.choice(('portrait', 'landscape', 'abstract')),
+                'width': rng.randint(300, 3000),
+                'height': rng.randint(300, 3000),
+            }
+            content_id += 1
+
+        paintings[artist['url']] = group
+
+    return paintings, details
+
+
+class StubStats:
+    """Requests Served by a `StubServer`."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.timestamps = []
+        self.by_endpoint = collections.Counter()
+        self.by_status = collections.Counter()
+        self.bytes_sent = 0
+
+    def record(self, endpoint, status, n_bytes):
+        with self.lock:
+            self.timestamps.append(time.time())
+            self.by_endpoint[endpoint] += 1
+            self.by_status[status] += 1
+            self.bytes_sent += n_bytes
+
+    @property
+    def n_requests(self):
+        return len(self.timestamps)
+
+    def max_requests_in_window(self, window):
+        """Largest number of requests received within `window` seconds."""
+        with self.lock:
+            stamps = sorted(self.timestamps)
+
+        largest, start = 0, 0
+        for end, stamp in enumerate(stamps):
+            while stamp - stamps[start] > window:
+                start += 1
+            largest = max(largest, end - start + 1)
+
+        return largest
+
+
+class StubServer:
+    """Local WikiArt Stand-in.
+
+    Serves `Artist/AlphabetJson`, `Painting/PaintingsByArtist`,
+    `Painting/ImageJson/<id>` and image copies from fixtures. Latency, error
+    rate and the server-side rate limit are configurable, so the fetcher's
+    behavior can be measured under controlled conditions.
+
+    Point the fetcher to it by assigning `settings.BASE_URL = server.base_url`.
+    """
+
+    def __init__(self, artists, paintings_per_artist=5, image_size=32 * 1024,
+                 latency=0., jitter=0., error_rate=0., rate_limit=None,
+                 rate_window=5., seed=0, host='127.0.0.1', port=0):
+        self.artists = artists
+        self.paintings, self.details = make_fixtures(
+            artists, paintings_per_artist, seed)
+
+        # A valid JPEG envelope is enough: the fetcher never decodes images.
+        self.image = b'\xff\xd8' + bytes(max(0, image_size - 4)) + b'\xff\xd9'
+
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.rate_limit = rate_limit
+        self.rate_window = rate_window
+
+        self.stats = StubStats()
+        self._rng = random.Random(seed)
+        self._rng_lock = threading.Lock()
+        self._recent = collections.deque()
+        self._recent_lock = threading.Lock()
+
+        self.httpd = ThreadingHTTPServer((host, port), _StubHandler)
+        self.httpd.daemon_threads = True
+        self.httpd.stub = self
+        self._thread = None
+
+    @property
+    def address(self):
+        host, port = self.httpd.server_address[:2]
+        return 'http://%s:%i' % (host, port)
+
+    @property
+    def base_url(self):
+        return self.address + '/en/App'
+
+    @property
+    def n_paintings(self):
+        return len(self.details)
+
+    def start(self):
+        self._thread = threading.Thread(target=self.httpd.serve_forever,
+                                        daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+        if self._thread is not None:
+            self._thread.join()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def delay(self):
+        """Time to wait before answering a request."""
+        with self._rng_lock:
+            return max(0., self.latency + self._rng.uniform(-1, 1) * self.jitter)
+
+    def fails(self):
+        """Whether the current request should fail with an internal error."""
+        with self._rng_lock:
+            return self._rng.random() < self.error_rate
+
+    def throttled(self):
+        """Whether the current request exceeds the server's rate limit."""
+        if not self.rate_limit:
+            return False
+
+        now = time.time()
+        with self._recent_lock:
+            while self._recent and now - self._recent[0] > self.rate_window:
+                self._recent.popleft()
+            if len(self._recent) >= self.rate_limit:
+                return True
+            self._recent.append(now)
+
+        return False
+
+    def route(self, path, query):
+        """Resolve a request into (endpoint, status, content type, body)."""
+        parts = [p for p in path.split('/') if p]
+
+        if parts[:2] == ['en', 'App']:
+            parts = parts[2:]
+
+            if parts == ['Artist', 'AlphabetJson']:
+                return 'AlphabetJson', 200, self._json(self.artists)
+
+            if parts == ['Painting', 'PaintingsByArtist']:
+                artist = query.get('artistUrl', [''])[0]
+                if artist not in self.paintings:
+                    return 'PaintingsByArtist', 404, self._json({})
+
+                group = [dict(p, image=self.address + p['image'])
+                         for p in self.paintings[artist]]
+                return 'PaintingsByArtist', 200, self._json(group)
+
+            if parts[:2] == ['Painting', 'ImageJson'] and len(parts) == 3:
+                details = self.details.get(int(parts[2]) if parts[2].isdigit()
+                                           else None)
+                if details is None:
+                    return 'ImageJson', 404, self._json({})
+                return 'ImageJson', 200, self._json(details)
+
+        if parts[:1] == ['images']:
+            return 'image', 200, ('image/jpeg', self.image)
+
+        return 'unknown', 404, self._json({})
+
+    @staticmethod
+    def _json(data):
+        return 'application/json', json.dumps(data).encode('utf-8')
+
+
+class _StubHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        stub = self.server.stub
+        url = urllib.parse.urlsplit(self.path)
+        endpoint, status, (content_type, body) = stub.route(
+            url.path, urllib.parse.parse_qs(url.query))
+
+        time.sleep(stub.delay())
+
+        if stub.throttled():
+            status, content_type, body = 429, 'text/plain', b'Too Many Requests'
+        elif status == 200 and stub.fails():
+            status, content_type, body = 500, 'text/plain', b'Internal Error'
+
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+        stub.stats.record(endpoint, status, len(body))
+
+    def log_message(self, format, *args):
+        pass